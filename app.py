@@ -1,10 +1,20 @@
 import streamlit as st
 import json
 import html
-from expander import load_abbreviation_dict, expand_abbreviations
+from dictionaries import (DEFAULT_DICTIONARY, get_dictionary, get_disk_cache, get_worker_pool, session_id,
+                          uploaded_dictionary)
+from dictionary_edits import overlay_path, set_entry, delete_entry, write_workbook
 import base64
+import os
+import time
+from result_cache import SHARED_CACHE, result_key
+from expander import contract_abbreviations
+from jobs import PREVIEW_LINES, ExpansionJob, StreamingExpansionJob
+from memory_guard import MEMORY_BUDGET, admit
+from metrics import METRICS, start_metrics_server
 
 st.set_page_config(page_title="Abbreviation Expander", layout="wide")
+start_metrics_server()   # no-op unless NEMO_METRICS_PORT is set
 
 # Function to encode image to base64
 def get_base64_of_image(image_path):
@@ -33,6 +43,32 @@ with st.sidebar:
             </div>
         """, unsafe_allow_html=True)
 
+    with st.expander("📈 Metrics"):
+        st.download_button("Prometheus text", METRICS.render_prometheus(), file_name="nemo_metrics.txt", mime="text/plain")
+        st.download_button("JSON snapshot", json.dumps(METRICS.to_dict(), ensure_ascii=False, indent=1),
+                           file_name="nemo_metrics.json", mime="application/json")
+
+    # Abbreviation-shaped tokens no workbook entry covers, from the expansions that collected them
+    with st.expander("🔍 Unknown abbreviations"):
+        # Off unless asked for, the scan slows every expansion down. Stored under a plain
+        # key rather than the widget's so the riders page still sees it
+        st.session_state["collect_unknown"] = st.checkbox(
+            "Collect from my expansions", value=st.session_state.get("collect_unknown", False))
+        top_unknown = METRICS.unknown_ranked(10)
+        if top_unknown:
+            st.markdown("\n".join(f"- `{row['abbreviation']}` × {row['count']}" for row in top_unknown))
+            st.download_button("⬇️ Ranked list (.csv)", METRICS.unknown_csv(), file_name="unknown_abbreviations.csv",
+                               mime="text/csv")
+        else:
+            st.caption("None seen yet")
+
+    cache_stats = SHARED_CACHE.stats()
+    st.caption(f"Result cache: {cache_stats['hits']} hits / {cache_stats['misses']} misses, "
+               f"{cache_stats['bytes'] / 1048576:.1f} of {cache_stats['max_bytes'] / 1048576:.0f} MB")
+    memory_stats = MEMORY_BUDGET.stats()
+    st.caption(f"Expansion memory: {memory_stats['reserved_bytes'] / 1048576:.0f} of "
+               f"{memory_stats['limit_bytes'] / 1048576:.0f} MB reserved")
+
 # Enhanced Custom CSS with logo support
 st.markdown("""
     <style>
@@ -488,11 +524,63 @@ st.markdown(f"""
     </div>
 """, unsafe_allow_html=True)
 
+def discard_expand_download():
+    """Drops a streamed expansion's temporary output file."""
+    path = st.session_state.pop("expand_download", None)
+    if path and os.path.exists(path):
+        os.remove(path)
+
+
 # Load abbreviation dictionary
 if uploaded_file:
-    abbr_dict = load_abbreviation_dict(uploaded_file)
+    abbr_dict = uploaded_dictionary(uploaded_file.name, uploaded_file.getvalue())
 else:
-    abbr_dict = load_abbreviation_dict("abbreviations_01.12.25.xlsx")
+    abbr_dict = get_dictionary()
+
+# Categorised workbooks: expand only the categories this desk wants
+expand_dict = abbr_dict
+if abbr_dict.categories:
+    selected_categories = st.sidebar.multiselect("Categories to expand", abbr_dict.categories,
+                                                 default=abbr_dict.categories, key="expand_categories")
+    if not selected_categories:
+        st.sidebar.caption("No category selected: expanding with the whole dictionary")
+    expand_dict = abbr_dict.select(selected_categories)
+
+# Contract mode: the reverse, full forms back to house abbreviations for chat and telex
+contract_mode = st.sidebar.radio("Mode", ["Expand", "Contract"], horizontal=True, key="text_mode") == "Contract"
+
+# Sidebar dictionary editor: edits apply to the loaded dictionary immediately,
+# and for the default workbook are also saved to its overlay log
+with st.sidebar:
+    with st.expander("✏️ Edit dictionary"):
+        edit_abbr = st.text_input("Abbreviation", key="edit_abbr")
+        edit_full = st.text_input("Full form", key="edit_full")
+        edit_log = None if uploaded_file else overlay_path(DEFAULT_DICTIONARY)
+        if uploaded_file:
+            st.caption("Edits to an uploaded workbook last only for this session and are not saved. "
+                       "Download the workbook to keep them.")
+        col_set, col_del = st.columns(2, gap="small")
+        with col_set:
+            if st.button("Add / Update", key="edit_set", use_container_width=True):
+                try:
+                    set_entry(abbr_dict, edit_abbr, edit_full, edit_log)
+                    st.success(f"Saved '{edit_abbr.strip().lower()}'")
+                except ValueError as exc:
+                    st.error(str(exc))
+        with col_del:
+            if st.button("Delete", key="edit_delete", use_container_width=True):
+                try:
+                    delete_entry(abbr_dict, edit_abbr, edit_log)
+                    st.success(f"Deleted '{edit_abbr.strip().lower()}'")
+                except KeyError:
+                    st.error(f"'{edit_abbr}' is not in the dictionary")
+        if st.button("Prepare workbook download", key="edit_export", use_container_width=True):
+            st.session_state["workbook_bytes"] = write_workbook(abbr_dict)
+        if "workbook_bytes" in st.session_state:
+            st.download_button("⬇️ Download workbook", data=st.session_state["workbook_bytes"],
+                               file_name="abbreviations.xlsx",
+                               mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                               use_container_width=True)
 
 # Initialize clear counter for forcing text area reset
 if "clear_counter" not in st.session_state:
@@ -529,7 +617,17 @@ with col1:
         expand_clicked = st.button("🔄 Expand Text", use_container_width=True)
     
     with col1_btn2:
-        if "expanded" in st.session_state:
+        if "expand_download" in st.session_state:
+            # Streamed expansion: the full text is only on disk
+            with open(st.session_state["expand_download"], "rb") as f:
+                st.download_button(
+                    label="⬇️ Download",
+                    data=f.read(),
+                    file_name="expanded_text.txt",
+                    mime="text/plain",
+                    use_container_width=True
+                )
+        elif "expanded" in st.session_state:
             st.download_button(
                 label="⬇️ Download",
                 data=st.session_state["expanded"],
@@ -591,6 +689,8 @@ with col2:
                 # Clear both columns by removing all relevant session state
                 st.session_state.pop("expanded", None)
                 st.session_state.pop("highlighted", None)
+                st.session_state.pop("expand_notice", None)
+                discard_expand_download()
                 # Increment counter to force text area reset
                 st.session_state.clear_counter += 1
                 st.rerun()
@@ -628,9 +728,84 @@ if expand_clicked:
     if not original_text.strip():
         st.warning("⚠️ Please enter some text to expand.")
     else:
-        with st.spinner("Expanding abbreviations..."):
-            expanded_text, highlighted_text = expand_abbreviations(original_text, abbr_dict)
-            # Store the plain text version (without HTML tags)
-            st.session_state["expanded"] = expanded_text
-            st.session_state["highlighted"] = highlighted_text
-        st.rerun()
\ No newline at end of file
+        # Pressing again replaces the running expansion instead of queueing another
+        previous_job = st.session_state.pop("expand_job", None)
+        if previous_job is not None:
+            previous_job.cancel()
+        st.session_state.pop("expand_notice", None)
+        discard_expand_download()
+
+        cache_key = result_key(original_text, expand_dict.version, "contract" if contract_mode else "both")
+        cached = SHARED_CACHE.get(cache_key)
+        if cached is not None:
+            st.session_state["expanded"], st.session_state["highlighted"] = cached
+        elif contract_mode:
+            # A single pass over the text, quick enough to run inline
+            started = time.perf_counter()
+            contracted = contract_abbreviations(original_text, expand_dict)
+            METRICS.observe_expansion(time.perf_counter() - started, original_text.count("\n") + 1,
+                                      len(original_text), source="contract")
+            SHARED_CACHE.put(cache_key, contracted)
+            st.session_state["expanded"], st.session_state["highlighted"] = contracted
+        else:
+            # Too big for a full expansion right now: stream it, plain-only, to a file
+            estimate, reservation = admit(original_text, expand_dict)
+            if reservation is not None:
+                expand_job = ExpansionJob(original_text, expand_dict, line_cache=get_disk_cache(), pool=get_worker_pool(),
+                                          session=session_id(), reservation=reservation, estimate=estimate,
+                                          collect_unknown=st.session_state.get("collect_unknown", False))
+            else:
+                expand_job = StreamingExpansionJob(original_text, expand_dict, pool=get_worker_pool(),
+                                                   session=session_id(), estimate=estimate,
+                                                   collect_unknown=st.session_state.get("collect_unknown", False))
+                METRICS.count("nemo_streaming_fallbacks_total")
+            st.session_state["expand_job"] = expand_job.start()
+            st.session_state["expand_cache_key"] = cache_key
+        st.rerun()
+
+# Background expansion: stream partial output, show progress, allow cancel
+expand_job = st.session_state.get("expand_job")
+if expand_job is not None:
+    if not expand_job.finished:
+        done, total = expand_job.progress()
+        st.progress(done / total if total else 0.0, text=f"Expanding abbreviations… {done} / {total} lines")
+        if expand_job.pool is not None:
+            pool_stats = expand_job.pool.stats()
+            st.caption(f"🧵 Workers: {pool_stats['running']} / {pool_stats['workers']} busy · "
+                       f"{pool_stats['queued']} chunks queued from {pool_stats['sessions']} session(s)")
+        if st.button("⏹️ Cancel", key="cancel_expand"):
+            expand_job.cancel()
+        st.session_state["expanded"], st.session_state["highlighted"] = expand_job.partial()
+        time.sleep(0.3)
+        st.rerun()
+    else:
+        st.session_state.pop("expand_job")
+        expanded_text, highlighted_text = expand_job.partial()
+        # Store the plain text version (without HTML tags)
+        st.session_state["expanded"] = expanded_text
+        st.session_state["highlighted"] = highlighted_text
+        done, total = expand_job.progress()
+        if isinstance(expand_job, StreamingExpansionJob):
+            st.session_state.pop("expand_cache_key", None)
+            st.session_state["expand_download"] = expand_job.output_path
+            if expand_job.status == "done":
+                st.session_state["expand_notice"] = (
+                    f"📦 Large input: expanded without highlighting to spare memory. Showing the first "
+                    f"{min(done, PREVIEW_LINES)} of {total} lines; download for the full text.")
+            elif expand_job.status == "failed":
+                discard_expand_download()
+                st.session_state["expand_notice"] = f"❌ Expansion failed: {expand_job.error}"
+            else:
+                st.session_state["expand_notice"] = f"⏹️ Expansion stopped after {done} of {total} lines."
+        elif expand_job.complete:
+            SHARED_CACHE.put(st.session_state.pop("expand_cache_key"), (expanded_text, highlighted_text))
+        elif expand_job.status == "cancelled":
+            st.session_state["expand_notice"] = f"⏹️ Expansion cancelled after {done} of {total} lines."
+        elif expand_job.status == "timed_out":
+            st.session_state["expand_notice"] = f"⏱️ Time limit reached: showing the first {done} of {total} lines."
+        else:
+            st.session_state["expand_notice"] = f"❌ Expansion failed: {expand_job.error}"
+        st.rerun()
+
+if "expand_notice" in st.session_state:
+    st.warning(st.session_state["expand_notice"])
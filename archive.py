@@ -0,0 +1,165 @@
+"""
+Expansion of very large text archives (years of exported recap emails).
+
+The source is memory-mapped and processed in newline-aligned chunks that
+are decoded only when reached; output is written incrementally, and a
+checkpoint file records how far both files got so an interrupted run can
+resume where it stopped:
+
+    python archive.py recaps_2019.txt recaps_2019_expanded.txt --resume
+
+--unknown writes the abbreviations found that the dictionary lacks to a
+CSV, most frequent first (unknown_abbreviations.py). After a resume it
+only covers the part expanded by that run.
+"""
+import argparse
+import json
+import mmap
+import os
+import sys
+import time
+
+from expander import compile_abbreviations, expand_line, load_compiled_dictionary
+from unknown_abbreviations import UnknownAbbreviations
+
+DEFAULT_CHUNK_BYTES = 4 * 1024 * 1024
+
+# Invalid UTF-8 bytes are carried through unchanged rather than replaced
+ENCODING_ERRORS = "surrogateescape"
+
+
+def _load_checkpoint(path, src_size, version, highlighted):
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if state.get("src_size") != src_size or state.get("version") != version:
+        # Different input or dictionary: the partial output is not reusable
+        return None
+    if state.get("highlighted") != highlighted:
+        # Appending highlighted output to plain (or the reverse) would mix the two
+        return None
+    return state
+
+
+def _save_checkpoint(path, state):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+
+def iter_chunks(mm, start, chunk_bytes):
+    """Yields (start, end) byte ranges of *mm* that end on a newline (or EOF)."""
+    size = len(mm)
+    while start < size:
+        end = min(start + chunk_bytes, size)
+        if end < size:
+            newline = mm.rfind(b"\n", start, end)
+            if newline == -1:
+                # A single line longer than the chunk: extend to its end
+                newline = mm.find(b"\n", end)
+                end = size if newline == -1 else newline + 1
+            else:
+                end = newline + 1
+        yield start, end
+        start = end
+
+
+def expand_chunk(text, compiled, highlighted=False, unknown=None, first_line=0):
+    # Lines are expanded one by one; "\n" terminators are kept exactly as found
+    which, mode = (1, "highlighted") if highlighted else (0, "plain")
+    lines = text.split("\n")
+    if unknown is not None:
+        unknown.scan_lines(lines, compiled, first_line)
+    return "\n".join(expand_line(line, compiled, mode=mode)[which] for line in lines)
+
+
+def expand_file(src_path, dst_path, abbr_dict, chunk_bytes=DEFAULT_CHUNK_BYTES, checkpoint_path=None,
+                resume=False, highlighted=False, progress=None, unknown=None):
+    """
+    Expands *src_path* into *dst_path*. With *resume*, continues from
+    *checkpoint_path* (default: dst_path + ".checkpoint") if it matches the
+    same source size, dictionary version and *highlighted*. *progress* is called with
+    (bytes done, total bytes) after every chunk. Unknown abbreviations are
+    collected in *unknown* (an UnknownAbbreviations), by source line number.
+    Returns the bytes written.
+    """
+    compiled = compile_abbreviations(abbr_dict)
+    checkpoint_path = checkpoint_path or f"{dst_path}.checkpoint"
+    src_size = os.path.getsize(src_path)
+
+    state = _load_checkpoint(checkpoint_path, src_size, compiled.version, highlighted) if resume else None
+    if state is None:
+        state = {"src_size": src_size, "version": compiled.version, "highlighted": highlighted,
+                 "src_offset": 0, "dst_offset": 0, "lines": 0}
+        mode = "wb"
+    else:
+        mode = "r+b"
+
+    with open(dst_path, mode) as dst:
+        dst.truncate(state["dst_offset"])
+        dst.seek(state["dst_offset"])
+        if src_size == 0:
+            return 0
+
+        with open(src_path, "rb") as src, mmap.mmap(src.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            if hasattr(mm, "madvise"):
+                mm.madvise(mmap.MADV_SEQUENTIAL)
+            with memoryview(mm) as view:
+                for start, end in iter_chunks(mm, state["src_offset"], chunk_bytes):
+                    text = str(view[start:end], "utf-8", ENCODING_ERRORS)
+                    data = expand_chunk(text, compiled, highlighted, unknown,
+                                        state.get("lines", 0)).encode("utf-8", ENCODING_ERRORS)
+                    dst.write(data)
+                    dst.flush()
+                    os.fsync(dst.fileno())
+
+                    state["src_offset"] = end
+                    state["dst_offset"] += len(data)
+                    state["lines"] = state.get("lines", 0) + text.count("\n")
+                    _save_checkpoint(checkpoint_path, state)
+                    if hasattr(mm, "madvise"):
+                        # Done with these pages; keep resident memory flat
+                        page_start = start - start % mmap.PAGESIZE
+                        mm.madvise(mmap.MADV_DONTNEED, page_start, end - page_start)
+                    if progress:
+                        progress(end, src_size)
+
+    os.remove(checkpoint_path)
+    return state["dst_offset"]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source")
+    parser.add_argument("destination")
+    parser.add_argument("--dict", default="abbreviations_01.12.25.xlsx", help="abbreviation workbook")
+    parser.add_argument("--resume", action="store_true", help="continue from the checkpoint if there is one")
+    parser.add_argument("--highlighted", action="store_true", help="write <mark> highlighted output")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_BYTES / 1048576)
+    parser.add_argument("--unknown", metavar="CSV", help="write abbreviations missing from the dictionary here")
+    args = parser.parse_args(argv)
+
+    compiled = load_compiled_dictionary(args.dict)
+    unknown = UnknownAbbreviations() if args.unknown else None
+    started = time.monotonic()
+
+    def report(done, total):
+        elapsed = time.monotonic() - started
+        rate = done / elapsed / 1048576 if elapsed else 0.0
+        print(f"\r{done / total:6.1%}  {done / 1048576:,.0f} / {total / 1048576:,.0f} MB  {rate:.2f} MB/s",
+              end="", file=sys.stderr, flush=True)
+
+    written = expand_file(args.source, args.destination, compiled, int(args.chunk_mb * 1048576),
+                          resume=args.resume, highlighted=args.highlighted, progress=report, unknown=unknown)
+    print(f"\nwrote {written:,} bytes to {args.destination}", file=sys.stderr)
+    if unknown is not None:
+        with open(args.unknown, "w", encoding="utf-8", newline="") as f:
+            unknown.write_csv(f)
+        print(f"{len(unknown):,} unknown abbreviations listed in {args.unknown}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Benchmarks expander.expand_many against one expand_abbreviations() call
+per message, and against the same messages joined into a single document.
+
+    python benchmarks/bench_batch.py                     # 10,000 messages
+    python benchmarks/bench_batch.py --messages 2000 --duplicates 0.3
+
+The per-call baselines are timed on --sample messages and scaled up: one
+is given the raw dict, as integration code does, and relies on
+compile_abbreviations() reusing its compile; the other is given the
+compiled dictionary. *duplicates* is the share of messages that repeat an
+earlier one, which expand_many's dedupe skips.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from expander import compile_abbreviations, expand_abbreviations, expand_many, load_abbreviation_dict  # noqa: E402
+from bench_riders import PROSE                                                                        # noqa: E402
+
+
+def synthetic_messages(count, keys, duplicates, seed=0):
+    rng = random.Random(seed)
+    messages = []
+    for _ in range(count):
+        if messages and rng.random() < duplicates:
+            messages.append(rng.choice(messages))
+            continue
+        words = [rng.choice(keys) if rng.random() < 0.2 else rng.choice(PROSE) for _ in range(rng.randint(5, 25))]
+        messages.append(" ".join(words).capitalize() + ".")
+    return messages
+
+
+def timed(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dict", default=os.path.join(ROOT, "abbreviations_01.12.25.xlsx"))
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--duplicates", type=float, default=0.0)
+    parser.add_argument("--sample", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    abbr_dict = load_abbreviation_dict(args.dict)
+    messages = synthetic_messages(args.messages, list(abbr_dict), args.duplicates, args.seed)
+    sample = messages[:args.sample]
+
+    compile_once = timed(lambda: compile_abbreviations(abbr_dict))
+    per_call = timed(lambda: [expand_abbreviations(m, abbr_dict) for m in sample]) * len(messages) / len(sample)
+    compiled = compile_abbreviations(abbr_dict)
+    per_call_compiled = timed(lambda: [expand_abbreviations(m, compiled) for m in sample]) * len(messages) / len(sample)
+    batch = timed(lambda: expand_many(messages, abbr_dict, dedupe=False))
+    deduped = timed(lambda: expand_many(messages, abbr_dict))
+    one_document = timed(lambda: expand_abbreviations("\n".join(messages), compiled))
+
+    print(f"{len(messages)} messages, {args.duplicates:.0%} duplicates")
+    print(f"  compiling the dict          {compile_once:>9.2f}s")
+    print(f"  per message, raw dict (est.){per_call:>9.2f}s")
+    print(f"  per message, compiled (est.){per_call_compiled:>9.2f}s")
+    print(f"  expand_many                 {batch:>9.2f}s")
+    print(f"  expand_many, deduped        {deduped:>9.2f}s")
+    print(f"  one joined document         {one_document:>9.2f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Benchmarks the riders clause cache: a rider is formatted once into an empty
+cache, then again with a few clause bodies edited, against formatting the
+edited rider with no cache at all.
+
+    python benchmarks/bench_clause_cache.py                  # 200 clauses, 5 edited
+    python benchmarks/bench_clause_cache.py --clauses 1000 --edits 20 --density 0.3
+
+The edited rider also loses its third clause, so every later clause is
+renumbered. Each cached document is checked against the uncached one.
+"""
+import argparse
+import io
+import os
+import random
+import sys
+import time
+import zipfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from expander import load_compiled_dictionary          # noqa: E402
+from result_cache import ResultCache                   # noqa: E402
+from rider_pipeline import HEADER_RE, CLAUSE_RE, format_riders  # noqa: E402
+from bench_riders import synthetic_rider               # noqa: E402
+
+
+def edit_rider(text, edits, seed=0):
+    """*text* with *edits* body lines changed and the third clause dropped."""
+    rng = random.Random(seed)
+    clauses, lines = [], []
+    for line in text.split("\n"):
+        if HEADER_RE.match(line) or CLAUSE_RE.match(line):
+            clauses.append(lines)
+            lines = []
+        lines.append(line)
+    clauses.append(lines)
+    del clauses[3]
+    # Renumber what follows, keeping each heading's style
+    for n, clause in enumerate(clauses[3:], start=3):
+        m = HEADER_RE.match(clause[0]) or CLAUSE_RE.match(clause[0])
+        clause[0] = clause[0][:m.start(1)] + str(n) + clause[0][m.end(1):]
+    bodies = [(c, i) for c in clauses[1:] for i in range(1, len(c)) if c[i]]
+    for clause, i in rng.sample(bodies, min(edits, len(bodies))):
+        clause[i] += " Amended by owners."
+    return "\n".join(line for clause in clauses for line in clause)
+
+
+def xml_parts(docx_bytes):
+    with zipfile.ZipFile(io.BytesIO(docx_bytes)) as z:
+        return {name: z.read(name) for name in z.namelist() if name.endswith(".xml")}
+
+
+def timed(fn):
+    started = time.perf_counter()
+    result = fn()
+    return time.perf_counter() - started, result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dict", default=os.path.join(ROOT, "abbreviations_01.12.25.xlsx"))
+    parser.add_argument("--clauses", type=int, default=200)
+    parser.add_argument("--edits", type=int, default=5)
+    parser.add_argument("--density", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    compiled = load_compiled_dictionary(args.dict)
+    text = synthetic_rider(args.clauses, args.density, list(compiled.abbr_dict), args.seed)
+    edited = edit_rider(text, args.edits, args.seed)
+
+    cache = ResultCache(1 << 30)
+    uncached, expected = timed(lambda: format_riders(edited, compiled))
+    cold, _ = timed(lambda: format_riders(text, compiled, clause_cache=cache))
+    warm, result = timed(lambda: format_riders(edited, compiled, clause_cache=cache))
+    if xml_parts(result[0]) != xml_parts(expected[0]) or result[1:] != expected[1:]:
+        raise AssertionError("cached rider differs from the uncached one")
+
+    print(f"{args.clauses} clauses @ {args.density:.0%}, {args.edits} edited, later clauses renumbered")
+    print(f"  no cache                   {uncached:>8.3f}s")
+    print(f"  empty cache                {cold:>8.3f}s")
+    print(f"  edited rider, warm cache   {warm:>8.3f}s   x{uncached / warm:.1f}")
+    stats = cache.stats()
+    print(f"  cache: {stats['entries']} entries, {stats['bytes'] / 1048576:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Benchmarks the riders pipeline (rider_pipeline.format_riders) on synthetic
+riders and reports where the time and memory go, phase by phase.
+
+    python benchmarks/bench_riders.py                        # full matrix, saved under benchmarks/results/
+    python benchmarks/bench_riders.py --clauses 10 200 --density 0.2
+    python benchmarks/bench_riders.py --compare benchmarks/results/<older>.json
+
+Each rider has N numbered clauses of a few paragraphs; *density* is the
+share of body words that are dictionary abbreviations, so it drives both
+the expansion work and the number of highlighted runs. Timings are the
+median of --repeat runs; allocations come from one extra run under
+tracemalloc (net bytes still held after the phase, and the largest
+transient peak inside it). tracemalloc only sees Python allocations, so
+the XML trees lxml builds for python-docx are not counted.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from expander import load_compiled_dictionary          # noqa: E402
+from rider_pipeline import PHASES, PhaseRecorder, format_riders  # noqa: E402
+
+DEFAULT_CLAUSES = [10, 50, 200, 1000, 2000]
+DEFAULT_DENSITIES = [0.0, 0.1, 0.3]
+RESULTS_DIR = os.path.join(ROOT, "benchmarks", "results")
+
+TITLES = ["Laytime", "Demurrage", "Deleted", "Trading Limits", "Bunkers", "Cargo Exclusions",
+          "Ice Clause", "War Risks", "Off-hire", "Hold Cleaning", ""]
+PROSE = ("the vessel shall be delivered and redelivered with about the same quantities of bunkers "
+         "and owners shall give notice of readiness on arrival at the port of loading or discharge "
+         "whichever is earlier always subject to the terms of this charter party").split()
+
+
+def synthetic_rider(clauses, density, keys, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for n in range(1, clauses + 1):
+        style = rng.random()
+        title = rng.choice(TITLES)
+        if style < 0.4:
+            lines.append(f"{n}. {title}")
+        elif style < 0.7:
+            lines.append(f"Clause {n}: {title}")
+        else:
+            lines.append(f"{n}- {title}".rstrip())
+        for _ in range(rng.randint(1, 3)):
+            words = [rng.choice(keys) if rng.random() < density else rng.choice(PROSE)
+                     for _ in range(rng.randint(20, 60))]
+            lines.append(" ".join(words).capitalize() + ".")
+        lines.append("")
+    return "\n".join(lines)
+
+
+def run_case(text, compiled, repeat):
+    timings = []
+    for _ in range(repeat):
+        phases = PhaseRecorder()
+        started = time.perf_counter()
+        docx_bytes, _, _ = format_riders(text, compiled, phases=phases)
+        total = time.perf_counter() - started
+        timings.append((total, phases))
+
+    tracemalloc.start()
+    try:
+        alloc = PhaseRecorder(track_allocations=True)
+        format_riders(text, compiled, phases=alloc)
+        _, overall_peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    result = {
+        "total_seconds": statistics.median(t for t, _ in timings),
+        "docx_bytes": len(docx_bytes),
+        "peak_bytes": overall_peak,
+        "phases": {},
+    }
+    for name in PHASES:
+        result["phases"][name] = {
+            "seconds": statistics.median(p.seconds[name] for _, p in timings),
+            "calls": alloc.calls[name],
+            "net_bytes": alloc.net_bytes[name],
+            "peak_bytes": alloc.peak_bytes[name],
+        }
+    return result
+
+
+def _label():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def _case_name(case):
+    return f"{case['clauses']} clauses @ {case['density']:.0%}"
+
+
+def print_report(cases, baseline=None):
+    before = {_case_name(c): c for c in (baseline or {}).get("cases", [])}
+    header = f"{'case':<22}{'total':>9}" + "".join(f"{name:>10}" for name in PHASES) + f"{'peak MB':>9}"
+    print(header)
+    print("-" * len(header))
+    for case in cases:
+        row = f"{_case_name(case):<22}{case['total_seconds']:>8.3f}s"
+        row += "".join(f"{case['phases'][name]['seconds']:>9.3f}s" for name in PHASES)
+        row += f"{case['peak_bytes'] / 1048576:>9.1f}"
+        old = before.get(_case_name(case))
+        if old:
+            row += f"   x{old['total_seconds'] / case['total_seconds']:.2f} vs baseline"
+        print(row)
+    print()
+    print("allocations (net / peak KB)")
+    for case in cases:
+        print(f"{_case_name(case):<22}" + "".join(
+            f"{name}: {case['phases'][name]['net_bytes'] // 1024:,}/{case['phases'][name]['peak_bytes'] // 1024:,}  "
+            for name in PHASES))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dict", default=os.path.join(ROOT, "abbreviations_01.12.25.xlsx"))
+    parser.add_argument("--clauses", type=int, nargs="+", default=DEFAULT_CLAUSES)
+    parser.add_argument("--density", type=float, nargs="+", default=DEFAULT_DENSITIES)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="where to store the results (default: benchmarks/results/riders-<commit>.json)")
+    parser.add_argument("--compare", help="earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    compiled = load_compiled_dictionary(args.dict)
+    keys = list(compiled.abbr_dict)
+
+    cases = []
+    for clauses in args.clauses:
+        for density in args.density:
+            text = synthetic_rider(clauses, density, keys, args.seed)
+            case = {"clauses": clauses, "density": density, "lines": text.count("\n") + 1, "chars": len(text)}
+            case.update(run_case(text, compiled, args.repeat))
+            cases.append(case)
+            print(f"  {_case_name(case)}: {case['total_seconds']:.3f}s", file=sys.stderr)
+
+    label = _label()
+    results = {
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "dictionary": os.path.basename(args.dict),
+        "repeat": args.repeat,
+        "cases": cases,
+    }
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(cases, baseline)
+
+    output = args.output or os.path.join(RESULTS_DIR, f"riders-{label}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
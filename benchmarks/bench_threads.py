@@ -0,0 +1,110 @@
+"""
+Benchmarks how expansion scales with the number of threads sharing one
+compiled dictionary (worker_pool.ThreadPool), and optionally with the
+number of worker processes (worker_pool.WorkerPool) for comparison.
+
+    python benchmarks/bench_threads.py                    # 1, 2, 4, 8 threads
+    python benchmarks/bench_threads.py --threads 1 2 4 8 16 --processes
+    python3.13t benchmarks/bench_threads.py               # free-threaded build
+
+Each run expands the same synthetic messages with expand_many (no
+deduplication) and is checked against the single-threaded result. Speedups
+are against expand_many with no pool, median of --repeat runs. Under a
+standard build the GIL lets only one thread run Python code at a time, so
+threads are expected to stay near 1x there; on a free-threaded build they
+should approach the number of cores. Results are saved under
+benchmarks/results/threads-<commit>-<interpreter>.json.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from expander import expand_many, load_compiled_dictionary        # noqa: E402
+from worker_pool import ThreadPool, WorkerPool, gil_enabled        # noqa: E402
+from bench_batch import synthetic_messages                         # noqa: E402
+from bench_riders import RESULTS_DIR, _label                       # noqa: E402
+
+DEFAULT_THREADS = [1, 2, 4, 8]
+
+
+def median_seconds(fn, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = fn()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+
+def run_pool(pool, messages, compiled, chunk_lines, repeat, expected):
+    try:
+        # One untimed run starts the workers (and sends processes the dictionary)
+        expand_many(messages[:chunk_lines], compiled, dedupe=False, pool=pool, chunk_lines=chunk_lines)
+        seconds, result = median_seconds(
+            lambda: expand_many(messages, compiled, dedupe=False, pool=pool, chunk_lines=chunk_lines), repeat)
+    finally:
+        pool.shutdown()
+    if result != expected:
+        raise AssertionError("pooled expansion differs from the single-threaded result")
+    return seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dict", default=os.path.join(ROOT, "abbreviations_01.12.25.xlsx"))
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--threads", type=int, nargs="+", default=DEFAULT_THREADS)
+    parser.add_argument("--processes", action="store_true", help="also time worker processes")
+    parser.add_argument("--chunk-lines", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="where to store the results")
+    args = parser.parse_args(argv)
+
+    compiled = load_compiled_dictionary(args.dict)
+    messages = synthetic_messages(args.messages, list(compiled.abbr_dict), 0.0, args.seed)
+    baseline, expected = median_seconds(lambda: expand_many(messages, compiled, dedupe=False), args.repeat)
+
+    interpreter = f"{platform.python_implementation()} {platform.python_version()}" + ("" if gil_enabled() else "t")
+    print(f"{interpreter}, GIL {'enabled' if gil_enabled() else 'disabled'}, {os.cpu_count()} CPUs, "
+          f"{len(messages)} messages")
+    print(f"{'backend':<12}{'workers':>8}{'seconds':>10}{'speedup':>9}")
+    print(f"{'none':<12}{1:>8}{baseline:>10.3f}{1.0:>8.2f}x")
+
+    backends = [("threads", ThreadPool)] + ([("processes", WorkerPool)] if args.processes else [])
+    cases = []
+    for name, pool_class in backends:
+        for workers in args.threads:
+            seconds = run_pool(pool_class(workers), messages, compiled, args.chunk_lines, args.repeat, expected)
+            cases.append({"backend": name, "workers": workers, "seconds": seconds, "speedup": baseline / seconds})
+            print(f"{name:<12}{workers:>8}{seconds:>10.3f}{baseline / seconds:>8.2f}x")
+
+    label = _label()
+    results = {
+        "label": label,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "interpreter": interpreter,
+        "gil_enabled": gil_enabled(),
+        "cpus": os.cpu_count(),
+        "machine": platform.machine(),
+        "messages": len(messages),
+        "baseline_seconds": baseline,
+        "cases": cases,
+    }
+    tag = interpreter.split()[1].replace(".", "")
+    output = args.output or os.path.join(RESULTS_DIR, f"threads-{label}-py{tag}.json")
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nresults written to {output}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
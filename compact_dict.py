@@ -0,0 +1,241 @@
+from array import array
+import threading
+from collections.abc import Mapping
+
+
+class CompactDict(Mapping):
+    """
+    Read-only str -> str mapping for very large abbreviation dictionaries.
+
+    Keys are stored sorted in one contiguous string with an offset array,
+    identical full forms are stored once in a second string, and lookups go
+    through an open-addressing hash table of int32 slots. Per entry this costs
+    a few bytes of offsets on top of the characters themselves, against
+    several hundred bytes for a dict of separate str objects. It behaves like
+    the dict returned by load_abbreviation_dict(), so it can be passed
+    anywhere that dict is accepted.
+    """
+
+    def __init__(self, items=()):
+        if isinstance(items, Mapping):
+            items = items.items()
+        entries = dict(items)
+        keys = sorted(entries)
+
+        value_ids = {}
+        values = []
+        self._value_of = array("I")
+        for key in keys:
+            full_form = entries[key]
+            if full_form not in value_ids:
+                value_ids[full_form] = len(values)
+                values.append(full_form)
+            self._value_of.append(value_ids[full_form])
+
+        self._keys, self._key_offsets = _pack(keys)
+        self._values, self._value_offsets = _pack(values)
+
+        # Power-of-two table at most half full; slot holds entry index + 1
+        size = 8
+        while size < 2 * len(keys):
+            size *= 2
+        self._mask = size - 1
+        self._slots = array("I", bytes(4 * size))
+        for i, key in enumerate(keys):
+            slot = hash(key) & self._mask
+            while self._slots[slot]:
+                slot = (slot + 1) & self._mask
+            self._slots[slot] = i + 1
+
+    def __reduce__(self):
+        # str hashes differ between processes, so rebuild the table on unpickle
+        return (CompactDict, (list(self.items()),))
+
+    def _key(self, i):
+        return self._keys[self._key_offsets[i]:self._key_offsets[i + 1]]
+
+    def _value(self, i):
+        v = self._value_of[i]
+        return self._values[self._value_offsets[v]:self._value_offsets[v + 1]]
+
+    # Entries by position, in items() order, for tables that refer to them that way
+    key_at = _key
+    value_at = _value
+
+    def _find(self, key):
+        if not isinstance(key, str):
+            return -1
+        slot = hash(key) & self._mask
+        offsets, buf = self._key_offsets, self._keys
+        while True:
+            entry = self._slots[slot]
+            if not entry:
+                return -1
+            i = entry - 1
+            start, end = offsets[i], offsets[i + 1]
+            if end - start == len(key) and buf.startswith(key, start):
+                return i
+            slot = (slot + 1) & self._mask
+
+    def __getitem__(self, key):
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._value(i)
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        return default if i < 0 else self._value(i)
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        return len(self._value_of)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._key(i)
+
+    def items(self):
+        return [(self._key(i), self._value(i)) for i in range(len(self))]
+
+    def nbytes(self):
+        """Approximate bytes held by the packed buffers and index."""
+        return (len(self._keys.encode("utf-8")) + len(self._values.encode("utf-8"))
+                + sum(a.itemsize * len(a) for a in (self._key_offsets, self._value_offsets, self._value_of, self._slots)))
+
+
+def _pack(strings):
+    offsets = array("I", [0])
+    total = 0
+    for s in strings:
+        total += len(s)
+        offsets.append(total)
+    return "".join(strings), offsets
+
+
+# Marks a key an OverlayDict has removed from its base
+_REMOVED = object()
+# Marks a key an OverlayDict has not changed
+_UNCHANGED = object()
+
+
+class _ChangeLog:
+    """
+    Changes shared by successive OverlayDicts over one base: for each key,
+    its (seq, value) history, oldest first. A view sees the entries up to
+    its own seq, so later changes can be appended in place.
+    """
+
+    def __init__(self, history=None, seq=0):
+        self.history = history if history is not None else {}
+        self.seq = seq
+        self.lock = threading.Lock()
+
+    def fork(self, seq):
+        """A new log holding only what a view at *seq* sees."""
+        history = {}
+        for key, entries in list(self.history.items()):
+            entries = [entry for entry in entries if entry[0] <= seq]
+            if entries:
+                history[key] = entries
+        return _ChangeLog(history, seq)
+
+
+class OverlayDict(Mapping):
+    """
+    Read-only mapping of a few changes laid over a larger base mapping,
+    which is shared rather than copied. with_item() and without() return a
+    new OverlayDict over the same base whose change is appended to a log
+    the views share, so an edit costs about the same however many came
+    before it and however large the base is, and a CompactDict base stays
+    compact. Each view still only sees the changes made up to it. Changing
+    a view that is not the latest (an older version kept by someone else)
+    copies the log first. Iterates like a dict copy edited in place: base
+    keys first, then added keys.
+    """
+
+    def __init__(self, base):
+        if isinstance(base, OverlayDict):
+            self.base, self._log, self._seq, self._len = base.base, base._log, base._seq, base._len
+        else:
+            self.base, self._log, self._seq, self._len = base, _ChangeLog(), 0, len(base)
+
+    def with_item(self, key, value):
+        return self._changed(key, value)
+
+    def without(self, key):
+        return self._changed(key, _REMOVED)
+
+    def _changed(self, key, value):
+        size = self._len + (value is not _REMOVED) - (key in self)
+        log = self._log
+        with log.lock:
+            if log.seq != self._seq:
+                log = log.fork(self._seq)
+            log.seq += 1
+            seq = log.seq
+            log.history.setdefault(key, []).append((seq, value))
+        view = OverlayDict.__new__(OverlayDict)
+        view.base, view._log, view._seq, view._len = self.base, log, seq, size
+        return view
+
+    def _change(self, key):
+        # The value this view sees changed for *key*: a value, _REMOVED or _UNCHANGED
+        entries = self._log.history.get(key)
+        if entries:
+            seq = self._seq
+            for entry_seq, value in reversed(entries):
+                if entry_seq <= seq:
+                    return value
+        return _UNCHANGED
+
+    def __getitem__(self, key):
+        value = self._change(key)
+        if value is _UNCHANGED:
+            return self.base[key]
+        if value is _REMOVED:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self._change(key)
+        if value is _UNCHANGED:
+            return self.base.get(key, default)
+        return default if value is _REMOVED else value
+
+    def __contains__(self, key):
+        value = self._change(key)
+        if value is _UNCHANGED:
+            return key in self.base
+        return value is not _REMOVED
+
+    def __len__(self):
+        return self._len
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def items(self):
+        changes = {}
+        # Keys first changed after this view are not seen by it anyway
+        for key in list(self._log.history):
+            value = self._change(key)
+            if value is not _UNCHANGED:
+                changes[key] = value
+        if not changes:
+            return list(self.base.items())
+        items = []
+        for key, value in self.base.items():
+            value = changes.get(key, value)
+            if value is not _REMOVED:
+                items.append((key, value))
+        base = self.base
+        items.extend((key, value) for key, value in changes.items()
+                     if value is not _REMOVED and key not in base)
+        return items
+
+    def values(self):
+        return [value for _, value in self.items()]
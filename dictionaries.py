@@ -0,0 +1,63 @@
+import hashlib
+import io
+import uuid
+
+import streamlit as st
+
+from dictionary_edits import apply_overlay, overlay_path
+from expander import load_compiled_dictionary
+from metrics import METRICS
+from persistent_cache import open_default_cache
+from worker_pool import open_default_pool
+
+DEFAULT_DICTIONARY = "abbreviations_01.12.25.xlsx"
+
+
+@st.cache_resource(max_entries=8, show_spinner=False)
+def get_dictionary(file_name=DEFAULT_DICTIONARY, file_bytes=None):
+    """
+    One compact, compiled dictionary per distinct workbook, shared by every
+    session and page of the process, so edits made to the default workbook
+    on one page are seen by all of them. Uploads are edited through
+    uploaded_dictionary() instead.
+    """
+    compiled = load_compiled_dictionary(io.BytesIO(file_bytes) if file_bytes is not None else file_name)
+    if file_bytes is None:
+        # Edits saved from the sidebar are replayed on top of the shipped workbook
+        apply_overlay(compiled, overlay_path(file_name))
+    METRICS.observe_dictionary(compiled)
+    return compiled
+
+
+def uploaded_dictionary(file_name, file_bytes):
+    """
+    This session's own copy of an uploaded workbook's dictionary. The
+    compiled upload is shared like the default workbook, but edits to it
+    stay in the session that made them, for as long as the session lasts,
+    and are never saved.
+    """
+    key = (file_name, hashlib.sha1(file_bytes).hexdigest())
+    uploads = st.session_state.setdefault("uploaded_dictionaries", {})
+    if key not in uploads:
+        uploads[key] = get_dictionary(file_name, file_bytes).copy()
+    return uploads[key]
+
+
+@st.cache_resource(show_spinner=False)
+def get_disk_cache():
+    """The process's handle on the NEMO_DISK_CACHE line cache, or None."""
+    return open_default_cache()
+
+
+@st.cache_resource(show_spinner=False)
+def get_worker_pool():
+    """The process-wide WorkerPool or ThreadPool (NEMO_WORKERS, NEMO_POOL), or None to expand in-process."""
+    return open_default_pool(DEFAULT_DICTIONARY, get_disk_cache())
+
+
+def session_id():
+    """Stable id of the current browser session, for fair dispatch in the worker pool."""
+    if "session_id" not in st.session_state:
+        st.session_state["session_id"] = uuid.uuid4().hex
+    return st.session_state["session_id"]
+
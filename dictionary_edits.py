@@ -0,0 +1,76 @@
+"""
+Persistence for incremental dictionary edits.
+
+Edits made through CompiledDictionary.set_entry()/delete_entry() are
+appended to an overlay log next to the workbook
+("abbreviations_01.12.25.xlsx.edits.jsonl") and replayed on load, so the
+workbook itself only needs rewriting when someone wants a clean copy
+(write_workbook()).
+"""
+import io
+import json
+import os
+import threading
+
+import pandas as pd
+
+_log_lock = threading.Lock()
+
+
+def overlay_path(workbook_path):
+    return f"{workbook_path}.edits.jsonl"
+
+
+def apply_overlay(compiled, path):
+    """Replays the edit log at *path* (if any) onto *compiled*; returns the edits applied."""
+    if not os.path.exists(path):
+        return 0
+    applied = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            edit = json.loads(line)
+            if edit["op"] == "set":
+                compiled.set_entry(edit["abbr"], edit["full"])
+            elif edit["op"] == "delete" and edit["abbr"] in compiled.abbr_dict:
+                compiled.delete_entry(edit["abbr"])
+            applied += 1
+    return applied
+
+
+def _append(path, edit):
+    with _log_lock, open(path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(edit, ensure_ascii=False) + "\n")
+
+
+def set_entry(compiled, abbr, full_form, path=None):
+    """Adds or updates an entry and, with *path*, records it in the overlay log."""
+    compiled.set_entry(abbr, full_form)
+    if path:
+        _append(path, {"op": "set", "abbr": str(abbr).strip().lower(), "full": str(full_form).strip()})
+
+
+def delete_entry(compiled, abbr, path=None):
+    compiled.delete_entry(abbr)
+    if path:
+        _append(path, {"op": "delete", "abbr": str(abbr).strip().lower()})
+
+
+def write_workbook(compiled, destination=None):
+    """
+    Writes the dictionary, edits included, as a workbook load_abbreviation_dict()
+    can read back. Returns the bytes when *destination* is None.
+    """
+    target = destination if destination is not None else io.BytesIO()
+    entries = sorted(compiled.abbr_dict.items())
+    columns = ["Abbreviation", "Full Form"]
+    if compiled.categories:
+        entries = [(abbr, full, ", ".join(compiled.categories_of(abbr))) for abbr, full in entries]
+        columns.append("Category")
+    with pd.ExcelWriter(target, engine="openpyxl") as writer:
+        pd.DataFrame(entries, columns=columns).to_excel(writer, sheet_name="Sheet1", index=False)
+        rules = sorted(compiled.plural_rules.items())
+        pd.DataFrame(rules, columns=["Plural", "Singular"]).to_excel(writer, sheet_name="Plural Rules", index=False)
+    if destination is None:
+        return target.getvalue()
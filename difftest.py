@@ -0,0 +1,281 @@
+"""
+Differential harness: runs the reference engine (reference_expander.py) and
+one or more candidate engines over the same inputs and reports any output
+divergence with a minimal reproducer, plus the speedup per corpus.
+
+    python difftest.py                                  # random inputs, shipped dictionaries
+    python difftest.py --corpus recaps.txt --random 0   # a real corpus only
+    python difftest.py --candidate current --random 2000 --seed 7
+
+Each corpus file is split into documents on blank-line-separated blocks.
+The same documents are also scanned for unknown abbreviations
+(unknown_abbreviations.py), on a fresh and on an edited compile, against
+a direct scan of the dictionary.
+"""
+import argparse
+import random
+import sys
+import time
+
+import reference_expander
+from compact_dict import CompactDict
+from expander import CompiledDictionary, compile_abbreviations, expand_abbreviations, load_abbreviation_dict
+from unknown_abbreviations import NUMBER_SUFFIXES, SLASH_WORDS, UNKNOWN_RE, find_unknown
+
+DEFAULT_DICTIONARIES = ["abbreviations_01.12.25.xlsx", "abbreviations14thJuly.xlsx"]
+
+
+def decoy_keys(abbr_dict):
+    """
+    Keys that are not in *abbr_dict* but overlap its keys where documents
+    will have them: short prefixes (random documents glue them to numbers)
+    and the first words of multi-word keys.
+    """
+    decoys = set()
+    for key in abbr_dict:
+        decoys.update(key[:n] for n in range(1, min(len(key), 5)))
+        decoys.add(key.split()[0])
+    return sorted(d for d in decoys.difference(abbr_dict) if d == d.strip())
+
+
+def category_view(abbr_dict):
+    """
+    A CategoryView holding exactly *abbr_dict*, selected from a workbook that
+    also has decoy entries in another category (and every third entry in
+    both), so it must match a compile of the filtered entries.
+    """
+    keys = list(abbr_dict)
+    merged = dict(abbr_dict)
+    merged.update((key, "DECOY") for key in decoy_keys(abbr_dict))
+    entry_categories = {key: ["Selected", "Other"] if i % 3 == 0 else ["Selected"] for i, key in enumerate(keys)}
+    entry_categories.update((key, ["Other"]) for key in merged if key not in abbr_dict)
+    return CompiledDictionary(CompactDict(merged), None, entry_categories).select(["Selected"])
+
+
+def edited_dictionary(abbr_dict, edits=300, seed=0):
+    """
+    *abbr_dict* reached by random set_entry()/delete_entry() calls on a
+    compile of a different dictionary: entries missing, with stale full
+    forms, or extra (decoys), so it must match a fresh compile.
+    """
+    rng = random.Random(seed)
+    keys = list(abbr_dict)
+    start = dict(abbr_dict)
+    missing = rng.sample(keys, min(edits // 3, len(keys)))
+    stale = rng.sample(keys, min(edits // 3, len(keys)))
+    decoys = decoy_keys(abbr_dict)
+    extra = rng.sample(decoys, min(edits // 3, len(decoys)))
+    for key in stale:
+        start[key] = "STALE"
+    for key in missing:
+        del start[key]
+    start.update((key, "DECOY") for key in extra)
+    compiled = compile_abbreviations(CompactDict(start))
+    changes = [("set", key) for key in set(missing) | set(stale)] + [("delete", key) for key in extra]
+    rng.shuffle(changes)
+    for op, key in changes:
+        if op == "set":
+            compiled.set_entry(key, abbr_dict[key])
+        else:
+            compiled.delete_entry(key)
+    return compiled
+
+# name -> (prepare(abbr_dict), expand(text, prepared) -> (plain, highlighted))
+ENGINES = {
+    "reference": (lambda abbr_dict: abbr_dict, reference_expander.expand_abbreviations),
+    "current": (compile_abbreviations, expand_abbreviations),
+    "compact": (lambda abbr_dict: compile_abbreviations(CompactDict(abbr_dict)), expand_abbreviations),
+    "category": (category_view, expand_abbreviations),
+    "edited": (edited_dictionary, expand_abbreviations),
+}
+
+# Fragments that exercise the special cases documents depend on: slash
+# spacing, and/or, tons->ton, capitalisation after punctuation, mark tags.
+FRAGMENTS = [
+    "the", "vessel", "and", "or", "/", " / ", "and/or", "AND / OR", "a/b", "x / y / z",
+    ".", "!", "?", ",", ":", "-", "(", ")", "'", "shall", "tons", "Clause 1.",
+    "<mark>", "</mark>", "é", "_x", "12", "3.5",
+]
+QUANTITIES = ["0.5", "1", "1.01", "2", "25", ".5", "14.5"]
+SEPARATORS = [" ", " ", " ", "", "/", " / ", "\n", ", ", ". "]
+
+
+def random_document(rng, keys, max_tokens=25):
+    tokens = []
+    for _ in range(rng.randint(1, max_tokens)):
+        roll = rng.random()
+        if roll < 0.5:
+            key = rng.choice(keys)
+            tokens.append(rng.choice([key, key.upper(), key.capitalize()]))
+        elif roll < 0.8:
+            tokens.append(rng.choice(FRAGMENTS))
+        else:
+            unit = rng.choice(keys)
+            tokens.append(rng.choice(QUANTITIES) + rng.choice(["", " "]) + unit[:rng.randint(1, 4)])
+    return "".join(token + rng.choice(SEPARATORS) for token in tokens)
+
+
+def read_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        blocks = f.read().split("\n\n")
+    return [block for block in blocks if block.strip()]
+
+
+def _split_lines(text):
+    return text.splitlines(keepends=True)
+
+
+def _split_tokens(text):
+    parts, current = [], ""
+    for ch in text:
+        if current and ch.isspace() != current[-1].isspace():
+            parts.append(current)
+            current = ""
+        current += ch
+    if current:
+        parts.append(current)
+    return parts
+
+
+def minimise(text, diverges):
+    """Shrink *text* (lines, then tokens, then characters) while it still diverges."""
+    for split in (_split_lines, _split_tokens, list):
+        parts = split(text)
+        chunk = max(len(parts) // 2, 1)
+        while True:
+            i, changed = 0, False
+            while i < len(parts):
+                trial = parts[:i] + parts[i + chunk:]
+                if trial and diverges("".join(trial)):
+                    parts, changed = trial, True
+                else:
+                    i += chunk
+            if changed:
+                continue
+            if chunk == 1:
+                break
+            chunk //= 2
+        text = "".join(parts)
+    return text
+
+
+def run_engine(expand, prepared, documents):
+    outputs = []
+    start = time.perf_counter()
+    for document in documents:
+        outputs.append(expand(document, prepared))
+    return outputs, time.perf_counter() - start
+
+
+def compare(name, documents, abbr_dict, candidates, max_reports=5):
+    """Run every candidate against the reference on *documents*; returns the divergence count."""
+    ref_prepare, ref_expand = ENGINES["reference"]
+    ref_prepared = ref_prepare(abbr_dict)
+    expected, ref_time = run_engine(ref_expand, ref_prepared, documents)
+    failures = 0
+
+    for candidate in candidates:
+        prepare, expand = ENGINES[candidate]
+        start = time.perf_counter()
+        prepared = prepare(abbr_dict)
+        prepare_time = time.perf_counter() - start
+        actual, cand_time = run_engine(expand, prepared, documents)
+
+        diverged = [i for i, (a, b) in enumerate(zip(expected, actual)) if a != b]
+        speedup = ref_time / cand_time if cand_time else float("inf")
+        print(f"[{name}] {candidate}: {len(documents)} docs, {len(diverged)} divergent, "
+              f"reference {ref_time:.3f}s, candidate {cand_time:.3f}s "
+              f"(+{prepare_time:.3f}s prepare), speedup x{speedup:.2f}")
+
+        for i in diverged[:max_reports]:
+            def diverges(text):
+                return ref_expand(text, ref_prepared) != expand(text, prepared)
+            reproducer = minimise(documents[i], diverges)
+            print(f"  divergence in document {i}, minimal reproducer: {reproducer!r}")
+            print(f"    reference: {ref_expand(reproducer, ref_prepared)!r}")
+            print(f"    {candidate}: {expand(reproducer, prepared)!r}")
+        failures += len(diverged)
+    return failures
+
+
+def scan_unknown(line, abbr_dict, key_words):
+    """find_unknown() as a direct scan of *abbr_dict* and the set of its keys' words."""
+    found = []
+    for m in UNKNOWN_RE.finditer(line):
+        caps, unit, slash = m.groups()
+        if caps is not None:
+            if caps.lower() not in key_words and not line.isupper():
+                found.append((m.start(), caps, "caps"))
+        elif unit is not None:
+            if unit.lower() not in key_words and unit.lower() not in NUMBER_SUFFIXES:
+                found.append((m.start(2), unit, "unit"))
+        else:
+            key = slash.lower()
+            left, right = key.split("/")
+            if (key not in key_words and key not in SLASH_WORDS
+                    and left not in abbr_dict and right not in abbr_dict):
+                found.append((m.start(), slash, "slash"))
+    return found
+
+
+def compare_unknown(name, documents, abbr_dict, engines=("current", "edited"), max_reports=5):
+    """Check find_unknown() on each engine's dictionary against scan_unknown(); returns the divergence count."""
+    key_words = {word for key in abbr_dict for word in key.split()}
+
+    def expected(text):
+        return [scan_unknown(line, abbr_dict, key_words) for line in text.split("\n")]
+
+    failures = 0
+    for engine in engines:
+        compiled = ENGINES[engine][0](abbr_dict)
+
+        def actual(text):
+            return [list(find_unknown(line, compiled)) for line in text.split("\n")]
+
+        def diverges(text):
+            return expected(text) != actual(text)
+
+        diverged = [i for i, document in enumerate(documents) if diverges(document)]
+        found = sum(len(line) for document in documents for line in expected(document))
+        print(f"[{name}] unknown abbreviations on {engine}: {len(documents)} docs, {found} found, "
+              f"{len(diverged)} divergent")
+        for i in diverged[:max_reports]:
+            reproducer = minimise(documents[i], diverges)
+            print(f"  divergence in document {i}, minimal reproducer: {reproducer!r}")
+            print(f"    direct scan: {expected(reproducer)!r}")
+            print(f"    {engine}: {actual(reproducer)!r}")
+        failures += len(diverged)
+    return failures
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dict", action="append", dest="dictionaries", help="abbreviation workbook (repeatable)")
+    parser.add_argument("--corpus", action="append", default=[], help="text corpus file (repeatable)")
+    parser.add_argument("--candidate", action="append", choices=sorted(set(ENGINES) - {"reference"}),
+                        help="engine to compare against the reference (default: all)")
+    parser.add_argument("--random", type=int, default=500, help="number of random documents per dictionary")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    candidates = args.candidate or sorted(set(ENGINES) - {"reference"})
+    failures = 0
+    for dictionary in args.dictionaries or DEFAULT_DICTIONARIES:
+        abbr_dict = load_abbreviation_dict(dictionary)
+        for corpus in args.corpus:
+            documents = read_corpus(corpus)
+            failures += compare(f"{dictionary} | {corpus}", documents, abbr_dict, candidates)
+            failures += compare_unknown(f"{dictionary} | {corpus}", documents, abbr_dict)
+        if args.random:
+            rng = random.Random(args.seed)
+            keys = sorted(abbr_dict)
+            documents = [random_document(rng, keys) for _ in range(args.random)]
+            failures += compare(f"{dictionary} | random", documents, abbr_dict, candidates)
+            failures += compare_unknown(f"{dictionary} | random", documents, abbr_dict)
+
+    print("OK: no divergence" if not failures else f"FAILED: {failures} divergent documents")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,347 @@
+"""
+In-place abbreviation expansion of .docx files.
+
+Each paragraph's text is expanded once with the normal engine, then the
+result is mapped back onto the original runs, so styles, tables,
+numbering, headers and footers survive untouched. The mapping comes from
+the positions of the engine's own matches where the text has no slashes,
+from the <mark> tags of its highlighted output otherwise, and only falls
+back to a token diff of old and new text where neither lines up.
+"""
+import copy
+import difflib
+import io
+import re
+from bisect import bisect_right
+
+from docx import Document
+from docx.enum.text import WD_COLOR_INDEX
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+from docx.text.run import Run
+
+from expander import NUMBER_ABBR_RE, TRIGGER_RE, compile_abbreviations, expand_line, number_unit_text
+
+DOCX_MIME = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+TOKEN_RE = re.compile(r'\w+|\s+|[^\w\s]')
+MARK_TAG_RE = re.compile(r'<(/?)mark>')
+# Characters Run.text turns into elements of their own
+SPECIAL_CHARS = ("\t", "\r", "\n")
+# Places tried for the text after a mark before falling back to _align()
+MAX_ANCHOR_TRIES = 8
+
+# Run children whose text round-trips through python-docx's Run.text
+_TEXT_CHILDREN = {qn('w:rPr'), qn('w:t'), qn('w:tab'), qn('w:cr'), qn('w:br')}
+# Paragraph children that can sit between runs of one word without meaning anything
+_TRANSPARENT = {qn('w:proofErr')}
+
+
+def _is_text_run(r):
+    for child in r:
+        if child.tag not in _TEXT_CHILDREN:
+            return False
+        if child.tag == qn('w:br') and child.get(qn('w:type')) not in (None, 'textWrapping'):
+            return False
+    return True
+
+
+def _run_groups(p):
+    """Consecutive plain-text runs of a paragraph, split at anything else."""
+    group = []
+    for child in p:
+        if child.tag == qn('w:r') and _is_text_run(child):
+            group.append(child)
+        elif child.tag in _TRANSPARENT:
+            continue
+        elif group:
+            yield group
+            group = []
+    if group:
+        yield group
+
+
+def _run_at(run_ends, offset):
+    return min(bisect_right(run_ends, offset), len(run_ends) - 1)
+
+
+def _unchanged(start, end, shift, run_ends):
+    # Unchanged text keeps the run of every original character
+    while start < end:
+        run_index = _run_at(run_ends, start)
+        stop = min(end, run_ends[run_index])
+        yield start + shift, stop + shift, run_index, False
+        start = stop
+
+
+def _align(original, expanded, run_ends):
+    """
+    Yields (output_start, output_end, run_index, changed) spans that map the
+    expanded text onto the runs of *original*; run_ends holds the offset at
+    which each original run ends.
+    """
+    old_tokens = TOKEN_RE.findall(original)
+    new_tokens = TOKEN_RE.findall(expanded)
+    old_pos = [0]
+    for t in old_tokens:
+        old_pos.append(old_pos[-1] + len(t))
+    new_pos = [0]
+    for t in new_tokens:
+        new_pos.append(new_pos[-1] + len(t))
+
+    matcher = difflib.SequenceMatcher(None, old_tokens, new_tokens, autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag == 'equal':
+            yield from _unchanged(old_pos[i1], old_pos[i2], new_pos[j1] - old_pos[i1], run_ends)
+        elif tag in ('replace', 'insert') and j2 > j1:
+            anchor = old_pos[i1] if tag == 'replace' else max(old_pos[i1] - 1, 0)
+            old_text = original[old_pos[i1]:old_pos[i2]]
+            new_text = expanded[new_pos[j1]:new_pos[j2]]
+            # Capitalisation after punctuation is not an expansion worth highlighting
+            changed = old_text.lower() != new_text.lower()
+            yield new_pos[j1], new_pos[j2], _run_at(run_ends, anchor), changed
+
+
+def _match_spans(original, expanded, compiled, run_ends):
+    """
+    The spans _align() yields, straight from the positions of the engine's
+    number + unit and dictionary matches, for text where they are the only
+    change besides capitalisation. None for text with a slash or <mark>
+    tag, or where the engine's result is not what those matches make of
+    it (an index match running into a unit's full form).
+    """
+    if TRIGGER_RE.search(original):
+        return None
+    unit_forms = compiled.unit_forms
+    # (start, end, replacement) in the original, units first, then keys between them
+    edits = []
+    for m in NUMBER_ABBR_RE.finditer(original):
+        forms = unit_forms(m.group(2).lower())
+        if forms:
+            edits.append((m.start(), m.end(), number_unit_text(m.group(1), forms)))
+    gaps = [0] + [bound for start, end, _ in edits for bound in (start, end)] + [len(original)]
+    for gap_start, gap_end in zip(gaps[::2], gaps[1::2]):
+        for start, end, _, full_form in compiled.abbr_index.finditer(original[gap_start:gap_end]):
+            edits.append((start + gap_start, end + gap_start, full_form))
+    edits.sort()
+
+    spans = []
+    parts = []
+    pos = out = 0
+    for start, end, replacement in edits:
+        spans.extend(_unchanged(pos, start, out - pos, run_ends))
+        out += start - pos
+        changed = original[start:end].lower() != replacement.lower()
+        spans.append((out, out + len(replacement), _run_at(run_ends, start), changed))
+        parts += (original[pos:start], replacement)
+        pos, out = end, out + len(replacement)
+    spans.extend(_unchanged(pos, len(original), out - pos, run_ends))
+    parts.append(original[pos:])
+    # Anything else the engine changed leaves the text to the other mappings
+    rebuilt = "".join(parts)
+    if len(rebuilt) != len(expanded) or rebuilt.lower() != expanded.lower():
+        return None
+    return spans
+
+
+def _marked_spans(original, expanded, highlighted, run_ends, compiled):
+    """
+    The spans _align() yields, anchored on the <mark> tags of the engine's
+    highlighted output: text outside the marks is the original's, up to
+    capitalisation, and each mark replaces the original text up to where
+    the next unmarked text resumes - the first place where the text
+    skipped expands to the mark's. Only the text of the marks is diffed,
+    a few tokens at a time. None when that does not hold (slash
+    pairs are respaced outside any mark, and capitalisation can differ
+    between the outputs), so the caller can fall back to _align().
+    """
+    # (text, marked) pieces; the engine can nest marks
+    pieces = []
+    last = depth = 0
+    for m in MARK_TAG_RE.finditer(highlighted):
+        pieces.append((highlighted[last:m.start()], depth > 0))
+        depth += -1 if m.group(1) else 1
+        if depth < 0:
+            return None
+        last = m.end()
+    pieces.append((highlighted[last:], depth > 0))
+    stripped = "".join(text for text, _ in pieces)
+    lower = original.lower()
+    if (len(stripped) != len(expanded) or stripped.lower() != expanded.lower()
+            or len(lower) != len(original) or "mark>" in stripped):
+        return None
+
+    spans = []
+    pos = out = 0           # offsets in original and expanded
+    pending = None          # output start of marks still to be given their original text
+
+    def close_mark(at):
+        if at == pos:
+            spans.append((pending, out, _run_at(run_ends, max(pos - 1, 0)), True))
+            return
+        # Neighbouring expansions share a mark, so it is diffed on its own
+        local_ends = [max(end - pos, 0) for end in run_ends]
+        for start, end, run_index, changed in _align(original[pos:at], expanded[pending:out], local_ends):
+            spans.append((start + pending, end + pending, run_index, changed))
+
+    for text, marked in pieces:
+        if marked:
+            if pending is None:
+                pending = out
+            out += len(text)
+            continue
+        if not text:
+            continue
+        if pending is None:
+            at = pos if lower.startswith(text.lower(), pos) else -1
+        else:
+            # The next unmarked text can also occur inside the text the mark replaced
+            mark_text = expanded[pending:out].lower()
+            needle = text.lower()
+            at = lower.find(needle, pos)
+            # Only a place that is not the last one needs checking
+            for _ in range(MAX_ANCHOR_TRIES):
+                if (at < 0 or lower.find(needle, at + 1) < 0
+                        or _expand_text(original[pos:at], compiled).lower() == mark_text):
+                    break
+                at = lower.find(needle, at + 1)
+            else:
+                at = -1
+        if at < 0:
+            return None
+        if pending is not None:
+            close_mark(at)
+            pending = None
+        spans.extend(_unchanged(at, at + len(text), out - at, run_ends))
+        pos, out = at + len(text), out + len(text)
+    if pending is not None:
+        close_mark(len(original))
+    elif pos != len(original):
+        return None
+    return spans
+
+
+def _expand_text(text, compiled, hits=None, mode="plain"):
+    results = [expand_line(line, compiled, hits, mode) for line in text.split("\n")]
+    return "\n".join(r[mode == "highlighted"] for r in results)
+
+
+def _set_text(r, text):
+    if any(c in text for c in SPECIAL_CHARS):
+        Run(r, None).text = text
+        return
+    for child in list(r):
+        if child.tag != qn('w:rPr'):
+            r.remove(child)
+    r.add_t(text)
+
+
+def _highlighted_rpr(r):
+    """Copy of the run's properties with the yellow highlight added."""
+    rpr = copy.deepcopy(r.rPr) if r.rPr is not None else OxmlElement('w:rPr')
+    rpr.highlight_val = WD_COLOR_INDEX.YELLOW
+    return rpr
+
+
+def _rewrite_group(runs, compiled, highlight, hits=None):
+    texts = [r.text for r in runs]
+    original = "".join(texts)
+    if not original.strip():
+        return False
+    expanded = _expand_text(original, compiled, hits)
+    if expanded == original:
+        return False
+    if len(runs) == 1 and not highlight:
+        _set_text(runs[0], expanded)
+        return True
+
+    run_ends = []
+    for t in texts:
+        run_ends.append((run_ends[-1] if run_ends else 0) + len(t))
+
+    spans = _match_spans(original, expanded, compiled, run_ends)
+    if spans is None:
+        # Hits were counted by the plain pass
+        highlighted = _expand_text(original, compiled, mode="highlighted")
+        spans = _marked_spans(original, expanded, highlighted, run_ends, compiled)
+    if spans is None:
+        spans = _align(original, expanded, run_ends)
+
+    # Merge aligned spans into (run, highlighted, text) segments
+    segments = []
+    for start, end, run_index, changed in spans:
+        marked = highlight and changed
+        if segments and segments[-1][0] == run_index and segments[-1][1] == marked:
+            segments[-1][2].append(expanded[start:end])
+        else:
+            segments.append((run_index, marked, [expanded[start:end]]))
+
+    # A run's last segment reuses its element; earlier ones need copies,
+    # all taken before any element is changed
+    uses = [0] * len(runs)
+    for run_index, _, _ in segments:
+        uses[run_index] += 1
+    elements = []
+    for run_index, _, _ in segments:
+        uses[run_index] -= 1
+        elements.append(runs[run_index] if not uses[run_index] else copy.deepcopy(runs[run_index]))
+    highlighted_rprs = {}
+
+    parent = runs[0].getparent()
+    position = parent.index(runs[0])
+    for r in runs:
+        parent.remove(r)
+    for new_r, (run_index, marked, parts) in zip(elements, segments):
+        _set_text(new_r, "".join(parts))
+        if marked:
+            rpr = highlighted_rprs.get(run_index)
+            if rpr is None:
+                rpr = highlighted_rprs[run_index] = _highlighted_rpr(runs[run_index])
+            if new_r.rPr is not None:
+                new_r.remove(new_r.rPr)
+            new_r.insert(0, copy.deepcopy(rpr))
+        parent.insert(position, new_r)
+        position += 1
+    return True
+
+
+def _story_roots(doc):
+    yield doc.element.body
+    seen = set()
+    for section in doc.sections:
+        for part in (section.header, section.first_page_header, section.even_page_header,
+                     section.footer, section.first_page_footer, section.even_page_footer):
+            if part.is_linked_to_previous:
+                continue
+            element = part._element
+            if id(element) not in seen:
+                seen.add(id(element))
+                yield element
+
+
+def expand_document(doc, abbr_dict, highlight=True, hits=None):
+    """
+    Expands every paragraph of a python-docx Document in place - body,
+    tables, text boxes, headers and footers. Returns the number of
+    paragraphs changed.
+    """
+    compiled = compile_abbreviations(abbr_dict)
+    changed = 0
+    for root in _story_roots(doc):
+        for p in root.iter(qn('w:p')):
+            touched = False
+            for group in list(_run_groups(p)):
+                touched |= _rewrite_group(group, compiled, highlight, hits)
+            changed += touched
+    return changed
+
+
+def expand_docx(source, abbr_dict, highlight=True, hits=None):
+    """Expands a .docx (path, bytes or file object) and returns the new package bytes."""
+    if isinstance(source, (bytes, bytearray)):
+        source = io.BytesIO(source)
+    doc = Document(source)
+    expand_document(doc, abbr_dict, highlight, hits)
+    out = io.BytesIO()
+    doc.save(out)
+    return out.getvalue()
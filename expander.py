@@ -1,5 +1,36 @@
 import pandas as pd
+import copy
+import hashlib
 import re
+import threading
+import time
+from collections import Counter, OrderedDict
+from types import MappingProxyType
+
+from compact_dict import CompactDict, OverlayDict
+
+# Number followed by a unit abbreviation, e.g. "25kt", "0.5 mt", "14.5kts"
+NUMBER_ABBR_RE = re.compile(r'\b(\d*\.?\d+)\s*([a-zA-Z()./]+)\b')
+UNIT_KEY_RE = re.compile(r'[a-zA-Z()./]+')
+
+# Plural word -> singular word, applied to a unit's full form when the quantity
+# is 1 or less ("0.5 metric ton"). Workbooks can add their own rules on a
+# "Plural Rules" sheet, see load_plural_rules().
+DEFAULT_PLURAL_RULES = MappingProxyType({"tons": "ton"})
+
+# Category of entries in a categorised workbook that do not name one
+GENERAL_CATEGORY = "General"
+
+# Patterns are compiled once here rather than looked up in re's shared cache on every line
+AND_OR_RE = re.compile(r'\band\s*/\s*or\b', re.IGNORECASE)
+SLASH_SPLIT_RE = re.compile(r'\s*/\s*')
+SLASH_RUN_RE = re.compile(r'(\w+\s*/\s*\w+(?:\s*/\s*\w+)+)')
+SLASH_PAIR_RE = re.compile(r'\b(\w+)\s*/\s*(\w+)\b')
+SENTENCE_START_RE = re.compile(r'([.!?])(\s*)([a-z])')
+DOUBLE_MARK_RE = re.compile(r'<mark><mark>(.*?)</mark></mark>')
+DOUBLE_CLOSE_RE = re.compile(r'<mark>(.*?)</mark></mark>')
+ADJACENT_MARKS_RE = re.compile(r'</mark>\s*<mark>')
+MARK_SPLIT_RE = re.compile(r'(<mark>.*?</mark>)')
 
 def normalize_slashes(text: str, highlight=False) -> str:
     """
@@ -11,13 +42,13 @@ def normalize_slashes(text: str, highlight=False) -> str:
 
     def fix_and_or(m):
         return "<mark>and/or</mark>" if highlight else "and/or"
-    text = re.sub(r'\band\s*/\s*or\b', fix_and_or, text, flags=re.IGNORECASE)
+    text = AND_OR_RE.sub(fix_and_or, text)
 
     def fix_multiple(m):
-        parts = re.split(r'\s*/\s*', m.group())
+        parts = SLASH_SPLIT_RE.split(m.group())
         fixed = ' / '.join(parts)
         return f"<mark>{fixed}</mark>" if highlight else fixed
-    text = re.sub(r'(\w+\s*/\s*\w+(?:\s*/\s*\w+)+)', fix_multiple, text)
+    text = SLASH_RUN_RE.sub(fix_multiple, text)
 
     def fix_single(m):
         a, b = m.group(1), m.group(2)
@@ -25,185 +56,1037 @@ def normalize_slashes(text: str, highlight=False) -> str:
             return "<mark>and/or</mark>" if highlight else "and/or"
         fixed = f"{a} / {b}"
         return f"<mark>{fixed}</mark>" if highlight else fixed
-    text = re.sub(r'\b(\w+)\s*/\s*(\w+)\b', fix_single, text)
+    text = SLASH_PAIR_RE.sub(fix_single, text)
 
     return text
 
 
 def load_abbreviation_dict(excel_file):
-    df = pd.read_excel(excel_file)
+    return load_abbreviation_categories(excel_file)[0]
+
+
+def load_abbreviation_categories(excel_file):
+    """
+    Returns (abbr_dict, entry_categories) for a workbook. Entries are read
+    from every sheet with "Abbreviation" and "Full Form" columns. A row's
+    categories come from an optional "Category" column (several separated by
+    "," or ";"), otherwise from its sheet's name when the workbook has more
+    than one such sheet, otherwise GENERAL_CATEGORY. entry_categories maps
+    each key to its list of categories, and is empty for a workbook that
+    uses neither categories column nor category sheets.
+    """
+    if hasattr(excel_file, "seek"):
+        excel_file.seek(0)
+    with pd.ExcelFile(excel_file) as book:
+        sheets = [(name, book.parse(name)) for name in book.sheet_names]
+    sheets = [(name, df) for name, df in sheets if 'Abbreviation' in df.columns and 'Full Form' in df.columns]
+    categorised = len(sheets) > 1 or any('Category' in df.columns for _, df in sheets)
+
     result = {}
-    for abbr, full in zip(df['Abbreviation'], df['Full Form']):
-        if pd.notna(abbr) and pd.notna(full):
-            clean_abbr = str(abbr).strip().lower()
-            clean_full = str(full).strip()
-            if clean_abbr and clean_full:
-                result[clean_abbr] = clean_full
-    return result
-
-def expand_abbreviations(text, abbr_dict):
-    def expand_slash_words(text, abbr_dict):
-        # Find patterns like word1/word2 and expand each part
-        def replacer(match):
-            left, right = match.group(1), match.group(2)
-            left_full = abbr_dict.get(left.lower(), left)
-            right_full = abbr_dict.get(right.lower(), right)
-            return f"{left_full} / {right_full}"
-    
-        return re.sub(r'\b(\w+)\s*/\s*(\w+)\b', replacer, text)
-    
-
-
-    def capitalize_after_punctuation(text):
-        return re.sub(r'([.!?])(\s*)([a-z])', lambda m: m.group(1) + m.group(2) + m.group(3).upper(), text)
-
-    def highlight_expansion(original_text):
-        lines = original_text.splitlines()
-        highlighted_lines = []
-        plain_lines = []
+    entry_categories = {}
+    for sheet_name, df in sheets:
+        default_category = sheet_name if len(sheets) > 1 else GENERAL_CATEGORY
+        categories = df['Category'] if 'Category' in df.columns else [None] * len(df)
+        for abbr, full, category in zip(df['Abbreviation'], df['Full Form'], categories):
+            if pd.notna(abbr) and pd.notna(full):
+                clean_abbr = str(abbr).strip().lower()
+                clean_full = str(full).strip()
+                if clean_abbr and clean_full:
+                    result[clean_abbr] = clean_full
+                    if categorised:
+                        names = [c.strip() for c in re.split(r'[,;]', str(category))] if pd.notna(category) else []
+                        names = [c for c in names if c] or [default_category]
+                        known = entry_categories.setdefault(clean_abbr, [])
+                        known.extend(c for c in names if c not in known)
+    return result, entry_categories
 
-        # Sort abbreviation keys by length descending for longest matching
-        sorted_keys = sorted(abbr_dict.keys(), key=len, reverse=True)
-        escaped_keys = [re.escape(k) for k in sorted_keys]
-        abbr_pattern = re.compile(r'(?<!\w)(' + '|'.join(escaped_keys) + r')(?!\w)', re.IGNORECASE)
-
-        for line in lines:
-            def avoid_nested_mark(text):
-                # Simple but effective nested mark cleanup
-                text = re.sub(r'<mark><mark>(.*?)</mark></mark>', r'<mark>\1</mark>', text)
-                text = re.sub(r'<mark>(.*?)</mark></mark>', r'<mark>\1</mark>', text)
-                text = re.sub(r'</mark>\s*<mark>', ' ', text)
-                return text
-
-            # Apply abbreviation expansion BEFORE slash normalization
-            plain_line = line
-            highlighted_line = line
-
-            plain_line = expand_slash_words(plain_line, abbr_dict)
-            highlighted_line = expand_slash_words(highlighted_line, abbr_dict)
-
-            # More precise number + abbreviation pattern
-            number_abbr_pattern = re.compile(r'\b(\d*\.?\d+)\s*([a-zA-Z()./]+)\b')
-            
-            def replace_number_abbr_plain(match):
-                quantity = match.group(1)
-                abbr = match.group(2)
-                abbr_key = abbr.lower()
-                full_form = abbr_dict.get(abbr_key)
-                if full_form:
-                    try:
-                        if float(quantity) < 1.01:
-                            full_form = re.sub(r'\btons\b', 'ton', full_form, flags=re.IGNORECASE)
-                    except ValueError:
-                        pass
-                    return f"{quantity} {full_form}"
-                return match.group(0)
-
-            def replace_number_abbr_highlighted(match):
-                quantity = match.group(1)
-                abbr = match.group(2)
-                abbr_key = abbr.lower()
-                full_form = abbr_dict.get(abbr_key)
-                if full_form:
-                    try:
-                        if float(quantity) < 1.01:
-                            full_form = re.sub(r'\btons\b', 'ton', full_form, flags=re.IGNORECASE)
-                    except ValueError:
-                        pass
-                    return f"<mark>{quantity} {full_form}</mark>"
-                return match.group(0)
-
-            # Pure abbreviation replacements - only replace if found in dictionary
-            def replace_abbr_plain(match):
-                abbr = match.group(0)
-                abbr_key = abbr.lower()
-                full_form = abbr_dict.get(abbr_key)
-                return full_form if full_form else abbr
-
-            def replace_abbr_highlighted(match):
-                abbr = match.group(0)
-                abbr_key = abbr.lower()
-                full_form = abbr_dict.get(abbr_key)
-                return f"<mark>{full_form}</mark>" if full_form else abbr
-
-            # Apply expansions with more careful matching
-            # First handle number + abbreviation patterns
-            plain_line = number_abbr_pattern.sub(replace_number_abbr_plain, plain_line)
-            
-            # For highlighted text, avoid matching inside existing marks
-            if '<mark>' not in highlighted_line:
-                highlighted_line = number_abbr_pattern.sub(replace_number_abbr_highlighted, highlighted_line)
-            else:
-                # Split by existing marks and only process unmarked parts
-                parts = re.split(r'(<mark>.*?</mark>)', highlighted_line)
-                new_parts = []
-                for part in parts:
-                    if part.startswith('<mark>') and part.endswith('</mark>'):
-                        new_parts.append(part)
-                    else:
-                        new_parts.append(number_abbr_pattern.sub(replace_number_abbr_highlighted, part))
-                highlighted_line = ''.join(new_parts)
 
-            # Handle standalone abbreviations with mark-aware processing
-            if '<mark>' not in plain_line:
-                plain_line = abbr_pattern.sub(replace_abbr_plain, plain_line)
-            else:
-                # Split by existing marks and only process unmarked parts
-                parts = re.split(r'(<mark>.*?</mark>)', plain_line)
-                new_parts = []
-                for part in parts:
-                    if part.startswith('<mark>') and part.endswith('</mark>'):
-                        new_parts.append(part)
-                    else:
-                        new_parts.append(abbr_pattern.sub(replace_abbr_plain, part))
-                plain_line = ''.join(new_parts)
-            
-            if '<mark>' not in highlighted_line:
-                highlighted_line = abbr_pattern.sub(replace_abbr_highlighted, highlighted_line)
+def load_compiled_dictionary(excel_file):
+    """
+    Loads a workbook straight into a CompiledDictionary backed by a
+    CompactDict, for long-lived shared use by the pages.
+    """
+    started = time.perf_counter()
+    abbr_dict, entry_categories = load_abbreviation_categories(excel_file)
+    abbr_dict = CompactDict(abbr_dict)
+    plural_rules = load_plural_rules(excel_file)
+    load_seconds = time.perf_counter() - started
+    compiled = CompiledDictionary(abbr_dict, plural_rules, entry_categories)
+    compiled.load_seconds = load_seconds
+    return compiled
+
+
+def load_plural_rules(excel_file):
+    """
+    Returns DEFAULT_PLURAL_RULES extended with the optional "Plural Rules"
+    sheet (columns "Plural" and "Singular") of the workbook.
+    """
+    rules = dict(DEFAULT_PLURAL_RULES)
+    if hasattr(excel_file, "seek"):
+        excel_file.seek(0)
+    with pd.ExcelFile(excel_file) as book:
+        if "Plural Rules" not in book.sheet_names:
+            return rules
+        df = book.parse("Plural Rules")
+    for plural, singular in zip(df['Plural'], df['Singular']):
+        if pd.notna(plural) and pd.notna(singular):
+            clean_plural = str(plural).strip().lower()
+            clean_singular = str(singular).strip()
+            if clean_plural and clean_singular:
+                rules[clean_plural] = clean_singular
+    return rules
+
+
+def make_singularizer(plural_rules=None):
+    """Returns a function applying *plural_rules* (plural -> singular words) to a full form."""
+    if plural_rules is None:
+        plural_rules = DEFAULT_PLURAL_RULES
+    rules = {k.lower(): v for k, v in plural_rules.items()}
+    if not rules:
+        return lambda full: full
+    plural_re = re.compile(r'\b(' + '|'.join(re.escape(k) for k in sorted(rules, key=len, reverse=True)) + r')\b', re.IGNORECASE)
+    return lambda full: plural_re.sub(lambda m: rules[m.group(1).lower()], full)
+
+
+def build_singular_table(abbr_dict, plural_rules=None):
+    """
+    Singular full forms of the keys that can follow a number, for the few
+    whose full form *plural_rules* change ("mts" -> "metric ton"). Every
+    other unit is its full form either way and is read from *abbr_dict*.
+    """
+    singularize = make_singularizer(plural_rules)
+    table = {}
+    for abbr_key, full_form in abbr_dict.items():
+        if UNIT_KEY_RE.fullmatch(abbr_key):
+            singular_form = singularize(full_form)
+            if singular_form != full_form:
+                table[abbr_key] = singular_form
+    return table
+
+
+# Positions where a dictionary key may start: the start of every word, and
+# every non-word character not preceded by a word character
+CANDIDATE_RE = re.compile(r'(?<!\w)(?:\w+|\W)')
+LEADING_WORD_RE = re.compile(r'\w+')
+WORD_CHAR_RE = re.compile(r'\w')
+# Slash handling needs a "/" and the mark cleanup a <mark> tag
+TRIGGER_RE = re.compile(r'/|mark>')
+# Outputs expand_line() and its callers can be asked for
+OUTPUT_MODES = ("both", "plain", "highlighted")
+# Contract mode only uses abbreviations at least this much shorter than the full form
+MIN_CONTRACTION_SAVING = 2
+
+
+def _bucket_of(key):
+    m = LEADING_WORD_RE.match(key)
+    return m.group() if m else key[0]
+
+
+def _next_words(keys):
+    """
+    Second words of a bucket's keys, for AbbreviationIndex.may_match(): ""
+    for a key that is just the bucket's word, None for any other key
+    without a second word ("tonnage :").
+    """
+    words = set()
+    for key in keys:
+        key_words = LEADING_WORD_RE.findall(key)
+        if len(key_words) > 1:
+            words.add(key_words[1])
+        elif key_words and key == key_words[0]:
+            words.add("")
+        else:
+            words.add(None)
+    return frozenset(words)
+
+
+# Base bucket whose only key is the bucket's word itself, by far the
+# commonest kind: one shared marker instead of a tuple per bucket
+_SOLE_KEY = object()
+_SOLE_NEXT_WORDS = frozenset({""})
+
+
+class AbbreviationIndex:
+    """
+    Case-insensitive, whole-word, longest-match lookup of dictionary keys.
+
+    Matches exactly what the alternation regex
+    (?<!\w)(key1|key2|...)(?!\w) over length-sorted keys used to, but keys
+    are bucketed by their leading word (or leading character for keys that
+    start with punctuation) so each candidate position costs one dict lookup,
+    and a key can be added or removed without recompiling anything.
+
+    A bucket is (keys, full forms, next words). Most buckets hold a single
+    key that is the bucket's word itself and share one marker instead, and
+    base buckets give full forms as positions in the dictionary, so a
+    CompactDict's full forms are only sliced out of its buffers on a match.
+
+    The base tables are never modified once built. An edit replaces the one
+    bucket it touches in an OverlayDict of edited buckets laid over them
+    and publishes it with a single assignment, so an edit costs the size
+    of that bucket, and any number of threads can scan while another edits,
+    each scan seeing one version.
+    """
+
+    def __init__(self, abbr_dict=None):
+        abbr_dict = abbr_dict if abbr_dict is not None else {}
+        self._base = abbr_dict
+        if isinstance(abbr_dict, CompactDict):
+            key_at, self._full_at = abbr_dict.key_at, abbr_dict.value_at
+        else:
+            key_at = list(abbr_dict.keys()).__getitem__
+            self._full_at = list(abbr_dict.values()).__getitem__
+        grouped = {}
+        for i, key in enumerate(abbr_dict.keys()):
+            grouped.setdefault(_bucket_of(key), []).append(i)
+        buckets = {}
+        shared_next_words = {}
+        for bucket, indexes in grouped.items():
+            if len(indexes) == 1 and key_at(indexes[0]) == bucket:
+                buckets[bucket] = _SOLE_KEY
+                continue
+            # Longest key first within a bucket
+            indexes.sort(key=lambda i: len(key_at(i)), reverse=True)
+            keys = tuple(key_at(i) for i in indexes)
+            # Identical sets stored once, as tuples, which are a quarter the size
+            next_words = _next_words(keys)
+            next_words = shared_next_words.setdefault(next_words, tuple(next_words))
+            buckets[bucket] = (keys, tuple(indexes), next_words)
+        # Buckets of keys that start with punctuation, as a set of characters
+        punct_buckets = frozenset(b for b in buckets if not WORD_CHAR_RE.match(b))
+        # (base buckets, buckets replaced by edits, punctuation buckets)
+        self._tables = (buckets, OverlayDict({}), punct_buckets)
+
+    def _entries(self, bucket):
+        # The bucket's (key, full form) pairs
+        buckets, edited, _ = self._tables
+        value = edited[bucket] if bucket in edited else buckets.get(bucket)
+        if value is None:
+            return ()
+        if value is _SOLE_KEY:
+            return ((bucket, self._base[bucket]),)
+        keys, forms, _ = value
+        return tuple((key, self._full_at(f) if f.__class__ is int else f) for key, f in zip(keys, forms))
+
+    def _replace_bucket(self, bucket, entries):
+        buckets, edited, punct_buckets = self._tables
+        keys = tuple(key for key, _ in entries)
+        edited = edited.with_item(bucket, (keys, tuple(full_form for _, full_form in entries), _next_words(keys)))
+        if not WORD_CHAR_RE.match(bucket):
+            punct_buckets = punct_buckets | {bucket} if entries else punct_buckets - {bucket}
+        self._tables = (buckets, edited, punct_buckets)
+
+    def add(self, key, full_form):
+        bucket = _bucket_of(key)
+        entries = [e for e in self._entries(bucket) if e[0] != key]
+        entries.append((key, full_form))
+        entries.sort(key=lambda e: len(e[0]), reverse=True)
+        self._replace_bucket(bucket, tuple(entries))
+
+    def remove(self, key):
+        bucket = _bucket_of(key)
+        self._replace_bucket(bucket, tuple(e for e in self._entries(bucket) if e[0] != key))
+
+    def may_match(self, text, allowed=None):
+        """
+        False only when finditer(text, allowed) would find nothing. A key
+        can only match where the line has its first word, and (for longer
+        keys) its second word too, so most lines are settled with set
+        lookups; the rest are scanned until their first real match.
+        """
+        buckets, edited, punct_buckets = self._tables
+        words = {w.lower() for w in LEADING_WORD_RE.findall(text)}
+        candidates = buckets.keys() & words
+        if edited:
+            # An edited bucket left empty by its edits no longer counts
+            candidates = {b for b in candidates | {w for w in words if w in edited} if b not in edited or edited[b][0]}
+        if not candidates and punct_buckets.isdisjoint(text):
+            return False
+        if candidates and text.isascii():
+            # Lowercasing ASCII never splits or merges words, so word sets compare exactly
+            needs_scan = not punct_buckets.isdisjoint(text)
+            for bucket in candidates:
+                value = edited[bucket] if edited and bucket in edited else buckets[bucket]
+                next_words = _SOLE_NEXT_WORDS if value is _SOLE_KEY else value[2]
+                if "" in next_words and allowed is None:
+                    return True         # the bucket's word is itself a key
+                if None in next_words or "" in next_words or not words.isdisjoint(next_words):
+                    needs_scan = True
+                    break
+            if not needs_scan:
+                return False
+        return next(self.finditer(text, allowed), None) is not None
+
+    def finditer(self, text, allowed=None):
+        """
+        Yields non-overlapping (start, end, key, full_form) matches, left to
+        right; with *allowed*, only keys in that set can match.
+        """
+        buckets, edited, _ = self._tables
+        full_at = self._full_at
+        n = len(text)
+        pos = 0
+        for m in CANDIDATE_RE.finditer(text):
+            start = m.start()
+            if start < pos:
+                continue
+            word = m.group().lower()
+            value = edited[word] if word in edited else buckets.get(word)
+            if value is None:
+                continue
+            if value is _SOLE_KEY:
+                keys, forms = (word,), None
             else:
-                # Split by existing marks and only process unmarked parts
-                parts = re.split(r'(<mark>.*?</mark>)', highlighted_line)
-                new_parts = []
-                for part in parts:
-                    if part.startswith('<mark>') and part.endswith('</mark>'):
-                        new_parts.append(part)
+                keys, forms, _ = value
+            for j, key in enumerate(keys):
+                if allowed is not None and key not in allowed:
+                    continue
+                end = start + len(key)
+                if text[start:end].lower() == key and (end >= n or not WORD_CHAR_RE.match(text, end)):
+                    if forms is None:
+                        full_form = self._base[key]
                     else:
-                        new_parts.append(abbr_pattern.sub(replace_abbr_highlighted, part))
-                highlighted_line = ''.join(new_parts)
-
-            # Apply slash normalization AFTER expansion, but protect dictionary content
-            # For plain text - apply normalization
-            normalized_plain = normalize_slashes(plain_line, highlight=False)
-            
-            # Restore any dictionary expansions that got normalized
-            for abbr_key in sorted_keys:
-                full_form = abbr_dict[abbr_key]
-                if '/' in full_form:
-                    # If normalization changed this dictionary entry, restore it
-                    normalized_form = normalize_slashes(full_form, highlight=False)
-                    if normalized_form != full_form:
-                        normalized_plain = normalized_plain.replace(normalized_form, full_form)
-
-            # For highlighted text
-            normalized_highlighted = normalize_slashes(highlighted_line, highlight=True)
-            
-            # Restore dictionary expansions in highlighted text
-            for abbr_key in sorted_keys:
-                full_form = abbr_dict[abbr_key]
-                if '/' in full_form:
-                    marked_original = f"<mark>{full_form}</mark>"
-                    marked_normalized = f"<mark>{normalize_slashes(full_form, highlight=False)}</mark>"
-                    if marked_normalized != marked_original:
-                        normalized_highlighted = normalized_highlighted.replace(marked_normalized, marked_original)
-
-            # Final formatting
-            plain_line = capitalize_after_punctuation(normalized_plain)
-            highlighted_line = capitalize_after_punctuation(normalized_highlighted)
-            highlighted_line = avoid_nested_mark(highlighted_line)
+                        full_form = forms[j]
+                        if full_form.__class__ is int:
+                            full_form = full_at(full_form)
+                    yield start, end, key, full_form
+                    pos = end
+                    break
+
+    def sub(self, repl, text, allowed=None):
+        """Like re.sub(): repl(matched_text, key, full_form) returns the replacement."""
+        out = []
+        last = 0
+        for start, end, key, full_form in self.finditer(text, allowed):
+            out.append(text[last:start])
+            out.append(repl(text[start:end], key, full_form))
+            last = end
+        if not out:
+            return text
+        out.append(text[last:])
+        return ''.join(out)
+
+    def restricted(self, allowed):
+        """This index limited to the keys in *allowed*, sharing its buckets."""
+        return RestrictedIndex(self, allowed)
+
+
+class RestrictedIndex:
+    """View of an AbbreviationIndex that only matches a subset of its keys."""
+
+    def __init__(self, index, allowed):
+        self.index = index
+        self.allowed = allowed
+
+    def may_match(self, text):
+        return self.index.may_match(text, self.allowed)
+
+    def finditer(self, text):
+        return self.index.finditer(text, self.allowed)
+
+    def sub(self, repl, text):
+        return self.index.sub(repl, text, self.allowed)
+
+
+class PhraseIndex(AbbreviationIndex):
+    """
+    AbbreviationIndex for long multi-word keys, such as the full forms
+    contraction looks for. A bucket's entries are grouped again by the
+    key's next word, so a common leading word ("port", "safe") only costs
+    the few keys that also share the text's next word, and a scan stays
+    linear in the text whatever the number of phrases.
+    """
+
+    def __init__(self, abbr_dict=None):
+        super().__init__(abbr_dict)
+        self._max_len = max((len(key) for key in abbr_dict or ()), default=0)
+        grouped = {}
+        # Longest key first within a group
+        for key, full_form in sorted((abbr_dict or {}).items(), key=lambda e: len(e[0]), reverse=True):
+            bucket = _bucket_of(key)
+            m = LEADING_WORD_RE.search(key, len(bucket))
+            grouped.setdefault(bucket, {}).setdefault(m.group() if m else None, []).append((key, full_form))
+        self._groups = {bucket: {word: tuple(group) for word, group in groups.items()}
+                        for bucket, groups in grouped.items()}
+
+    def add(self, key, full_form):
+        raise TypeError("PhraseIndex is rebuilt, not edited")
+
+    def remove(self, key):
+        raise TypeError("PhraseIndex is rebuilt, not edited")
+
+    def finditer(self, text, allowed=None):
+        groups = self._groups
+        n = len(text)
+        pos = 0
+        for m in CANDIDATE_RE.finditer(text):
+            start = m.start()
+            if start < pos:
+                continue
+            bucket = groups.get(m.group().lower())
+            if not bucket:
+                continue
+            # A key's next word lies within its length, so the search never runs further
+            next_word = LEADING_WORD_RE.search(text, m.end(), start + self._max_len)
+            # Keys with a next word are always longer than matching keys without one
+            entries = bucket.get(next_word.group().lower(), ()) if next_word else ()
+            for key, full_form in entries + bucket.get(None, ()):
+                if allowed is not None and key not in allowed:
+                    continue
+                end = start + len(key)
+                if text[start:end].lower() == key and (end >= n or not WORD_CHAR_RE.match(text, end)):
+                    yield start, end, key, full_form
+                    pos = end
+                    break
+
+
+def build_contractions(abbr_dict):
+    """
+    Reverse of *abbr_dict* for contract mode: lower-cased full form ->
+    abbreviation. Where several abbreviations share a full form the
+    shortest wins, then the first alphabetically. Full forms that are also
+    keys of their own ("owners") are left alone, as are abbreviations that
+    save fewer than MIN_CONTRACTION_SAVING characters, which in the house
+    workbooks are misspellings rather than abbreviations ("attched").
+    """
+    candidates = {}
+    for abbr_key, full_form in abbr_dict.items():
+        full_key = full_form.lower()
+        if len(abbr_key) > len(full_key) - MIN_CONTRACTION_SAVING:
+            continue
+        best = candidates.get(full_key)
+        if best is None or (len(abbr_key), abbr_key) < (len(best), best):
+            candidates[full_key] = abbr_key
+    return {full_key: abbr_key for full_key, abbr_key in candidates.items()
+            if abbr_dict.get(full_key, "").lower() != full_key}
+
+
+def dictionary_version(abbr_dict, plural_rules=None):
+    """Content hash of a dictionary, used to key cached expansion results."""
+    if plural_rules is None:
+        plural_rules = DEFAULT_PLURAL_RULES
+    digest = hashlib.sha1()
+    for items in (abbr_dict, plural_rules):
+        for key in sorted(items):
+            digest.update(key.encode("utf-8") + b"\0" + items[key].encode("utf-8") + b"\1")
+        digest.update(b"\2")
+    return digest.hexdigest()
+
+
+class CompiledDictionary:
+    """
+    Everything expand_abbreviations() derives from an abbreviation dict.
+    Build it once per loaded dictionary and pass it instead of the dict.
+    """
+
+    def __init__(self, abbr_dict, plural_rules=None, entry_categories=None):
+        started = time.perf_counter()
+        self.abbr_dict = abbr_dict
+        # Category names (bit i of a mask is categories[i]) and each key's mask
+        self.categories = []
+        self.entry_masks = {}
+        for abbr_key, names in (entry_categories or {}).items():
+            self.entry_masks[abbr_key] = self._category_mask(names)
+        self._views = {}
+        self.plural_rules = dict(DEFAULT_PLURAL_RULES if plural_rules is None else plural_rules)
+        self.load_seconds = 0.0
+        self.abbr_index = AbbreviationIndex(abbr_dict)
+        # Full forms that normalize_slashes() would alter, as (key, normalized, original)
+        # in longest-key-first order, so they can be put back after normalization
+        self.slash_restores = []
+        for abbr_key in sorted(abbr_dict.keys(), key=len, reverse=True):
+            restore = _slash_restore(abbr_key, abbr_dict[abbr_key])
+            if restore:
+                self.slash_restores.append(restore)
+        self._singularize = make_singularizer(self.plural_rules)
+        self.singular_forms = build_singular_table(abbr_dict, self.plural_rules)
+        self.version = dictionary_version(abbr_dict, self.plural_rules)
+        self._contraction_index = None
+        self._key_words = None
+        self._compiled_keys = abbr_dict.keys()
+        # Word -> change in its number of keys since compiling
+        self._key_word_changes = OverlayDict({})
+        self._edit_lock = threading.Lock()
+        self.compile_seconds = time.perf_counter() - started
+
+    # Incremental edits -----------------------------------------------------
+    # Each edit touches one index bucket, the unit table and at most one
+    # slash-restore entry; the version is chained so cached results keyed
+    # by it are never reused across an edit. The per-entry tables become
+    # OverlayDicts over the compiled ones and the index replaces a single
+    # bucket, so an edit costs about the same whether it is the first or
+    # the thousandth and whatever the size of the dictionary, and
+    # expansions running on other threads only ever see whole tables.
+
+    def set_entry(self, abbr, full_form, categories=None):
+        """
+        Adds or updates one entry; visible to the next expansion. In a
+        categorised dictionary an update keeps the entry's categories unless
+        *categories* are given, and a new entry defaults to GENERAL_CATEGORY.
+        """
+        abbr_key = str(abbr).strip().lower()
+        full_form = str(full_form).strip()
+        if not abbr_key or not full_form:
+            raise ValueError("abbreviation and full form must not be empty")
+        with self._edit_lock:
+            if self.categories and (categories or abbr_key not in self.entry_masks):
+                mask = self._category_mask(categories or [GENERAL_CATEGORY])
+                self.entry_masks = OverlayDict(self.entry_masks).with_item(abbr_key, mask)
+            self.abbr_index.add(abbr_key, full_form)
+            singular_form = self._singularize(full_form) if UNIT_KEY_RE.fullmatch(abbr_key) else full_form
+            if singular_form != full_form:
+                self.singular_forms = OverlayDict(self.singular_forms).with_item(abbr_key, singular_form)
+            elif abbr_key in self.singular_forms:
+                self.singular_forms = OverlayDict(self.singular_forms).without(abbr_key)
+            if abbr_key not in self.abbr_dict:
+                self._count_key_words(abbr_key, 1)
+            self.abbr_dict = OverlayDict(self.abbr_dict).with_item(abbr_key, full_form)
+            self._set_slash_restore(abbr_key, _slash_restore(abbr_key, full_form))
+            self._bump_version("set", abbr_key, full_form)
+
+    def delete_entry(self, abbr):
+        abbr_key = str(abbr).strip().lower()
+        with self._edit_lock:
+            if abbr_key not in self.abbr_dict:
+                raise KeyError(abbr)
+            self._count_key_words(abbr_key, -1)
+            self.abbr_dict = OverlayDict(self.abbr_dict).without(abbr_key)
+            if abbr_key in self.entry_masks:
+                self.entry_masks = OverlayDict(self.entry_masks).without(abbr_key)
+            self.abbr_index.remove(abbr_key)
+            if abbr_key in self.singular_forms:
+                self.singular_forms = OverlayDict(self.singular_forms).without(abbr_key)
+            self._set_slash_restore(abbr_key, None)
+            self._bump_version("delete", abbr_key, "")
+
+    def unit_forms(self, unit_key):
+        """(singular, plural) full forms of a key following a number, or None if it is not a key."""
+        full_form = self.abbr_dict.get(unit_key)
+        if full_form is None:
+            return None
+        return self.singular_forms.get(unit_key, full_form), full_form
+
+    def copy(self):
+        """
+        A copy that can be edited without affecting this dictionary. Edits
+        replace tables rather than change them, so the copy shares every
+        table and costs nothing like compiling again.
+        """
+        with self._edit_lock:
+            clone = copy.copy(self)
+            clone.abbr_index = copy.copy(self.abbr_index)
+        clone._views = {}
+        clone._edit_lock = threading.Lock()
+        return clone
+
+    def _set_slash_restore(self, abbr_key, restore):
+        existing = [i for i, r in enumerate(self.slash_restores) if r[0] == abbr_key]
+        if not existing and not restore:
+            return
+        if existing and restore:
+            # An update keeps the entry's place, as re-assigning a dict key does
+            restores = list(self.slash_restores)
+            restores[existing[0]] = restore
+            self.slash_restores = restores
+            return
+        restores = [r for r in self.slash_restores if r[0] != abbr_key]
+        if restore:
+            i = 0
+            while i < len(restores) and len(restores[i][0]) >= len(abbr_key):
+                i += 1
+            restores.insert(i, restore)
+        self.slash_restores = restores
+
+    def _bump_version(self, op, abbr_key, full_form):
+        digest = hashlib.sha1(f"{self.version}\0{op}\0{abbr_key}\0{full_form}".encode("utf-8"))
+        self.version = digest.hexdigest()
+        self._views = {}
+        self._contraction_index = None
+
+    @property
+    def contraction_index(self):
+        """PhraseIndex over build_contractions(), built on first use after each edit."""
+        index = self._contraction_index
+        if index is None:
+            index = self._contraction_index = PhraseIndex(build_contractions(self.abbr_dict))
+        return index
+
+    def _count_key_words(self, abbr_key, delta):
+        changes = self._key_word_changes
+        for word in abbr_key.split():
+            changes = changes.with_item(word, changes.get(word, 0) + delta)
+        self._key_word_changes = changes
+
+    def is_key_word(self, word):
+        """True if *word* is a space-separated word of some key."""
+        counts = self._key_words
+        if counts is None:
+            # Keys per word of the compiled dict, built on first use; edits only count changes
+            counts = Counter(w for key in self._compiled_keys for w in key.split())
+            self._key_words = counts
+        return counts.get(word, 0) + self._key_word_changes.get(word, 0) > 0
 
+    # Categories --------------------------------------------------------------
+
+    def _category_mask(self, names):
+        mask = 0
+        for name in names:
+            if name not in self.categories:
+                self.categories = self.categories + [name]
+            mask |= 1 << self.categories.index(name)
+        return mask
+
+    def categories_of(self, abbr_key):
+        mask = self.entry_masks.get(abbr_key, 0)
+        return [name for i, name in enumerate(self.categories) if mask >> i & 1]
+
+    def select(self, categories=None):
+        """
+        The dictionary limited to *categories*: a CategoryView sharing this
+        dictionary's index, built once per selection and edit. None, or
+        every category, is the dictionary itself.
+        """
+        if not categories or not self.categories:
+            return self
+        mask = 0
+        for name in categories:
+            if name not in self.categories:
+                raise KeyError(name)
+            mask |= 1 << self.categories.index(name)
+        if mask == (1 << len(self.categories)) - 1:
+            return self
+        view = self._views.get(mask)
+        if view is None:
+            with self._edit_lock:
+                view = self._views[mask] = CategoryView(self, mask)
+        return view
+
+
+class CategoryView(CompiledDictionary):
+    """
+    Read-only selection of a categorised CompiledDictionary. Only the
+    small per-entry tables are filtered; the index is shared and told which
+    keys it may match, so picking categories never recompiles anything.
+    """
+
+    def __init__(self, compiled, mask):
+        masks = compiled.entry_masks
+        allowed = frozenset(k for k in compiled.abbr_dict.keys() if masks.get(k, 0) & mask)
+        self.abbr_dict = {k: v for k, v in compiled.abbr_dict.items() if k in allowed}
+        self.plural_rules = compiled.plural_rules
+        self.categories = [name for i, name in enumerate(compiled.categories) if mask >> i & 1]
+        self.entry_masks = {}
+        self.abbr_index = compiled.abbr_index.restricted(allowed)
+        self.slash_restores = [r for r in compiled.slash_restores if r[0] in allowed]
+        self.singular_forms = {k: form for k, form in compiled.singular_forms.items() if k in allowed}
+        self.version = hashlib.sha1(f"{compiled.version}\0categories\0{mask}".encode("utf-8")).hexdigest()
+        self.load_seconds = compiled.load_seconds
+        self.compile_seconds = 0.0
+        self._views = {}
+        self._contraction_index = None
+        self._full = compiled
+
+    def is_key_word(self, word):
+        # Words of the whole workbook: a key outside the selection is not unknown
+        return self._full.is_key_word(word)
+
+    def set_entry(self, abbr, full_form, categories=None):
+        raise TypeError("edit the full dictionary, not a category selection")
+
+    def delete_entry(self, abbr):
+        raise TypeError("edit the full dictionary, not a category selection")
+
+    def select(self, categories=None):
+        raise TypeError("select categories on the full dictionary")
+
+
+def _slash_restore(abbr_key, full_form):
+    if '/' in full_form:
+        normalized_form = normalize_slashes(full_form, highlight=False)
+        if normalized_form != full_form:
+            return (abbr_key, normalized_form, full_form)
+    return None
+
+
+# Compiles of dicts passed to the expansion functions uncompiled, by id(),
+# least recently used dropped first
+COMPILE_CACHE_ENTRIES = 4
+_compiled_dicts = OrderedDict()
+_compiled_dicts_lock = threading.Lock()
+
+
+def compile_abbreviations(abbr_dict, plural_rules=None):
+    """
+    *abbr_dict* as a CompiledDictionary. A dict passed again with the same
+    entries and plural rules gets the compile made the first time, so
+    callers handing the same dict to every call do not pay for compiling
+    it on each one. The compile is made from a copy, so later changes to
+    the dict are seen as a different dict rather than a stale index.
+    """
+    if isinstance(abbr_dict, CompiledDictionary):
+        return abbr_dict
+    key = id(abbr_dict)
+    with _compiled_dicts_lock:
+        cached = _compiled_dicts.get(key)
+        if cached is not None:
+            _compiled_dicts.move_to_end(key)
+    if cached is not None:
+        source, rules, compiled = cached
+        # The dict holds on to its id while cached, so only its entries can differ
+        if (source is abbr_dict and rules == plural_rules
+                and (compiled.abbr_dict is abbr_dict or compiled.abbr_dict == abbr_dict)):
+            return compiled
+    # A CompactDict cannot change; anything else is copied
+    entries = abbr_dict if isinstance(abbr_dict, CompactDict) else dict(abbr_dict)
+    rules = None if plural_rules is None else dict(plural_rules)
+    compiled = CompiledDictionary(entries, rules)
+    with _compiled_dicts_lock:
+        _compiled_dicts[key] = (abbr_dict, rules, compiled)
+        _compiled_dicts.move_to_end(key)
+        while len(_compiled_dicts) > COMPILE_CACHE_ENTRIES:
+            _compiled_dicts.popitem(last=False)
+    return compiled
+
+
+def expand_slash_words(text, abbr_dict, hits=None):
+    # Find patterns like word1/word2 and expand each part
+    def replacer(match):
+        left, right = match.group(1), match.group(2)
+        left_full = abbr_dict.get(left.lower(), left)
+        right_full = abbr_dict.get(right.lower(), right)
+        if hits is not None:
+            if left_full is not left:
+                hits[left.lower()] += 1
+            if right_full is not right:
+                hits[right.lower()] += 1
+        return f"{left_full} / {right_full}"
+
+    return SLASH_PAIR_RE.sub(replacer, text)
+
+
+def capitalize_after_punctuation(text):
+    return SENTENCE_START_RE.sub(lambda m: m.group(1) + m.group(2) + m.group(3).upper(), text)
+
+
+def avoid_nested_mark(text):
+    # Simple but effective nested mark cleanup
+    text = DOUBLE_MARK_RE.sub(r'<mark>\1</mark>', text)
+    text = DOUBLE_CLOSE_RE.sub(r'<mark>\1</mark>', text)
+    text = ADJACENT_MARKS_RE.sub(' ', text)
+    return text
+
+
+def sub_outside_marks(pattern, repl, text):
+    """
+    pattern.sub() that leaves existing <mark>...</mark> spans untouched;
+    *pattern* is a compiled regex or an AbbreviationIndex.
+    """
+    if '<mark>' not in text:
+        return pattern.sub(repl, text)
+    # Split by existing marks and only process unmarked parts
+    parts = MARK_SPLIT_RE.split(text)
+    new_parts = []
+    for part in parts:
+        if part.startswith('<mark>') and part.endswith('</mark>'):
+            new_parts.append(part)
+        else:
+            new_parts.append(pattern.sub(repl, part))
+    return ''.join(new_parts)
+
+
+def number_unit_text(quantity, forms):
+    """What a number + unit match becomes, given the unit's (singular, plural) full forms."""
+    singular_form, full_form = forms
+    try:
+        if float(quantity) < 1.01:
+            full_form = singular_form
+    except ValueError:
+        pass
+    return f"{quantity} {full_form}"
+
+
+def may_expand(line, compiled):
+    """
+    Prefilter for expand_line(): False when no stage other than
+    capitalisation can change *line* - no slash, no <mark> tag, no number
+    followed by a known unit and no dictionary key.
+    """
+    if TRIGGER_RE.search(line):
+        return True
+    abbr_dict = compiled.abbr_dict
+    for m in NUMBER_ABBR_RE.finditer(line):
+        if m.group(2).lower() in abbr_dict:
+            return True
+    return compiled.abbr_index.may_match(line)
+
+
+def expand_line(line, compiled, hits=None, mode="both"):
+    """
+    Expand a single line, returning (plain, highlighted).
+    If *hits* is a Counter, each dictionary key used is counted in it.
+    With mode "plain" or "highlighted" only that form's passes run and the
+    other comes back as None - except for lines with nothing to expand,
+    where both forms are the same and come for free. Run alone, the
+    highlighted passes count the keys they highlight, which can differ from
+    the plain count on text that already holds <mark> tags.
+    """
+    abbr_dict = compiled.abbr_dict
+    unit_forms = compiled.unit_forms
+    slash_restores = compiled.slash_restores
+    abbr_index = compiled.abbr_index
+
+    if not may_expand(line, compiled):
+        # Nothing to expand: only the capitalisation pass can change the line
+        line = capitalize_after_punctuation(line)
+        return line, line
+
+    want_plain = mode != "highlighted"
+    want_highlighted = mode != "plain"
+    # Keys are counted by the plain passes, or by the highlighted ones when those run alone
+    plain_hits = hits if want_plain else None
+    highlighted_hits = None if want_plain else hits
+
+    def replace_number_abbr_plain(match):
+        forms = unit_forms(match.group(2).lower())
+        if forms:
+            if plain_hits is not None:
+                plain_hits[match.group(2).lower()] += 1
+            return number_unit_text(match.group(1), forms)
+        return match.group(0)
+
+    def replace_number_abbr_highlighted(match):
+        forms = unit_forms(match.group(2).lower())
+        if forms:
+            if highlighted_hits is not None:
+                highlighted_hits[match.group(2).lower()] += 1
+            return f"<mark>{number_unit_text(match.group(1), forms)}</mark>"
+        return match.group(0)
+
+    # Pure abbreviation replacements - the index only matches dictionary keys
+    def replace_abbr_plain(abbr, abbr_key, full_form):
+        if plain_hits is not None:
+            plain_hits[abbr_key] += 1
+        return full_form
+
+    def replace_abbr_highlighted(abbr, abbr_key, full_form):
+        if highlighted_hits is not None:
+            highlighted_hits[abbr_key] += 1
+        return f"<mark>{full_form}</mark>"
+
+    # Apply abbreviation expansion BEFORE slash normalization
+    slash_expanded = expand_slash_words(line, abbr_dict, hits)
+    plain_line = highlighted_line = None
+
+    if want_plain:
+        # First handle number + abbreviation patterns, then standalone abbreviations
+        plain_line = NUMBER_ABBR_RE.sub(replace_number_abbr_plain, slash_expanded)
+        plain_line = sub_outside_marks(abbr_index, replace_abbr_plain, plain_line)
+
+        # Apply slash normalization AFTER expansion, but protect dictionary content
+        normalized_plain = normalize_slashes(plain_line, highlight=False)
+
+        # Restore any dictionary expansions that got normalized
+        for _, normalized_form, full_form in slash_restores:
+            normalized_plain = normalized_plain.replace(normalized_form, full_form)
+
+        plain_line = capitalize_after_punctuation(normalized_plain)
+
+    if want_highlighted:
+        # For highlighted text, avoid matching inside existing marks
+        highlighted_line = sub_outside_marks(NUMBER_ABBR_RE, replace_number_abbr_highlighted, slash_expanded)
+        highlighted_line = sub_outside_marks(abbr_index, replace_abbr_highlighted, highlighted_line)
+
+        normalized_highlighted = normalize_slashes(highlighted_line, highlight=True)
+
+        # Restore dictionary expansions in highlighted text
+        for _, normalized_form, full_form in slash_restores:
+            normalized_highlighted = normalized_highlighted.replace(f"<mark>{normalized_form}</mark>", f"<mark>{full_form}</mark>")
+
+        highlighted_line = capitalize_after_punctuation(normalized_highlighted)
+        highlighted_line = avoid_nested_mark(highlighted_line)
+
+    return plain_line, highlighted_line
+
+
+def _match_case(matched, abbr_key):
+    """Cases an abbreviation like the text it replaces: "Delivery" -> "Dly", "Charter Party" -> "CP"."""
+    if matched.isupper() or (matched.istitle() and len(LEADING_WORD_RE.findall(matched)) > 1):
+        return abbr_key.upper()
+    if matched[:1].isupper():
+        return abbr_key[:1].upper() + abbr_key[1:]
+    return abbr_key
+
+
+def contract_line(line, compiled, hits=None):
+    """
+    Contract mode: replace full forms in a single line with their
+    abbreviations, longest phrase first, returning (plain, highlighted)
+    like expand_line(). *hits* counts the abbreviations used.
+    """
+    index = compiled.contraction_index
+    if not index.may_match(line):
+        return line, line
+
+    def replace_plain(matched, full_key, abbr_key):
+        if hits is not None:
+            hits[abbr_key] += 1
+        return _match_case(matched, abbr_key)
+
+    def replace_highlighted(matched, full_key, abbr_key):
+        return f"<mark>{_match_case(matched, abbr_key)}</mark>"
+
+    return index.sub(replace_plain, line), sub_outside_marks(index, replace_highlighted, line)
+
+
+def contract_abbreviations(text, abbr_dict, hits=None):
+    """The reverse of expand_abbreviations(): (plain, highlighted) with full forms abbreviated."""
+    compiled = compile_abbreviations(abbr_dict)
+    plain_lines = []
+    highlighted_lines = []
+    for line in text.splitlines():
+        plain_line, highlighted_line = contract_line(line, compiled, hits)
+        plain_lines.append(plain_line)
+        highlighted_lines.append(highlighted_line)
+    return "\n".join(plain_lines), "\n".join(highlighted_lines)
+
+
+def _check_mode(mode):
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"unknown output mode {mode!r}, expected one of {', '.join(OUTPUT_MODES)}")
+
+
+def expand_lines(lines, abbr_dict, hits=None, mode="both", unknown=None):
+    """
+    Expand each line independently, returning (plain_lines, highlighted_lines);
+    the list *mode* does not ask for is None. With an UnknownAbbreviations
+    as *unknown*, abbreviation-shaped tokens the dictionary lacks are
+    collected in it on the way.
+    """
+    _check_mode(mode)
+    compiled = compile_abbreviations(abbr_dict)
+    plain_lines = [] if mode != "highlighted" else None
+    highlighted_lines = [] if mode != "plain" else None
+    for line_no, line in enumerate(lines):
+        if unknown is not None:
+            unknown.scan(line, compiled, line_no)
+        plain_line, highlighted_line = expand_line(line, compiled, hits, mode)
+        if plain_lines is not None:
             plain_lines.append(plain_line)
+        if highlighted_lines is not None:
             highlighted_lines.append(highlighted_line)
+    return plain_lines, highlighted_lines
+
+
+def expand_abbreviations(text, abbr_dict, hits=None, mode="both", unknown=None):
+    """(plain, highlighted) for *text*; the form *mode* does not ask for is None."""
+    plain_lines, highlighted_lines = expand_lines(text.splitlines(), abbr_dict, hits, mode, unknown)
+    return ("\n".join(plain_lines) if plain_lines is not None else None,
+            "\n".join(highlighted_lines) if highlighted_lines is not None else None)
 
-        return "\n".join(plain_lines), "\n".join(highlighted_lines)
 
-    return highlight_expansion(text)
\ No newline at end of file
+def expand_many(texts, abbr_dict, hits=None, dedupe=True, pool=None, session="batch", chunk_lines=200, mode="both",
+                unknown=None):
+    """
+    Expand a batch of documents, returning one (plain, highlighted) pair per
+    text, in order - each equal to expand_abbreviations(text, abbr_dict).
+
+    The dictionary is compiled once for the whole batch. With *dedupe*,
+    identical texts and identical lines anywhere in the batch are expanded
+    only once (*hits* still counts every occurrence). With a WorkerPool as
+    *pool*, the distinct lines are expanded there in chunks of *chunk_lines*.
+    *mode* picks the forms returned, as for expand_abbreviations(). An
+    UnknownAbbreviations as *unknown* collects unknown abbreviations with
+    the index of the text they were found in as source.
+    """
+    _check_mode(mode)
+    compiled = compile_abbreviations(abbr_dict)
+    texts = list(texts)
+
+    # Every document as indexes into one list of distinct lines
+    unique_lines = []
+    line_ids = {}
+    occurrences = []
+    doc_lines = []
+    seen_texts = {}
+    for text_no, text in enumerate(texts):
+        if dedupe and text in seen_texts:
+            ids = seen_texts[text]
+            for line_id in ids:
+                occurrences[line_id] += 1
+            doc_lines.append(ids)
+            if unknown is not None:
+                unknown.scan_lines(text.splitlines(), compiled, source=text_no)
+            continue
+        ids = []
+        for line_no, line in enumerate(text.splitlines()):
+            if unknown is not None:
+                unknown.scan(line, compiled, line_no, text_no)
+            line_id = line_ids.get(line) if dedupe else None
+            if line_id is None:
+                line_id = len(unique_lines)
+                unique_lines.append(line)
+                occurrences.append(0)
+                if dedupe:
+                    line_ids[line] = line_id
+            occurrences[line_id] += 1
+            ids.append(line_id)
+        doc_lines.append(ids)
+        if dedupe:
+            seen_texts[text] = ids
+
+    if pool is None:
+        plain_lines = []
+        highlighted_lines = []
+        for line, count in zip(unique_lines, occurrences):
+            if hits is not None and count > 1:
+                line_hits = Counter()
+                plain_line, highlighted_line = expand_line(line, compiled, line_hits, mode)
+                for key, n in line_hits.items():
+                    hits[key] += n * count
+            else:
+                plain_line, highlighted_line = expand_line(line, compiled, hits, mode)
+            plain_lines.append(plain_line)
+            highlighted_lines.append(highlighted_line)
+    else:
+        # Chunk hits come back summed, so repeated lines are expanded here
+        # when hits are wanted, where they can be counted per occurrence
+        plain_lines = [None] * len(unique_lines)
+        highlighted_lines = [None] * len(unique_lines)
+        remote = list(range(len(unique_lines)))
+        if hits is not None:
+            remote = []
+            for line_id, count in enumerate(occurrences):
+                if count == 1:
+                    remote.append(line_id)
+                    continue
+                line_hits = Counter()
+                plain_lines[line_id], highlighted_lines[line_id] = expand_line(unique_lines[line_id], compiled, line_hits, mode)
+                for key, n in line_hits.items():
+                    hits[key] += n * count
+        chunks = [remote[start:start + chunk_lines] for start in range(0, len(remote), chunk_lines)]
+        futures = [pool.expand_lines(session, compiled, [unique_lines[i] for i in chunk], mode) for chunk in chunks]
+        try:
+            for chunk, future in zip(chunks, futures):
+                chunk_plain, chunk_highlighted, chunk_hits = future.result()
+                if hits is not None:
+                    hits.update(chunk_hits)
+                chunk_plain = chunk_plain or [None] * len(chunk)
+                chunk_highlighted = chunk_highlighted or [None] * len(chunk)
+                for i, plain_line, highlighted_line in zip(chunk, chunk_plain, chunk_highlighted):
+                    plain_lines[i] = plain_line
+                    highlighted_lines[i] = highlighted_line
+        finally:
+            for future in futures:
+                future.cancel()
+
+    results = []
+    joined = {}
+    for text, ids in zip(texts, doc_lines):
+        result = joined.get(text) if dedupe else None
+        if result is None:
+            result = ("\n".join([plain_lines[i] for i in ids]) if mode != "highlighted" else None,
+                      "\n".join([highlighted_lines[i] for i in ids]) if mode != "plain" else None)
+            if dedupe:
+                joined[text] = result
+        results.append(result)
+    return results
@@ -0,0 +1,285 @@
+import os
+import re
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import TimeoutError
+
+from expander import compile_abbreviations, expand_lines
+from memory_guard import PeakTracker
+from metrics import METRICS
+from persistent_cache import expand_lines_cached
+from unknown_abbreviations import UnknownAbbreviations
+
+# Lines expanded between progress updates / cancellation checks
+DEFAULT_CHUNK_LINES = 200
+# Seconds a single expansion may run before the user gets the partial result
+DEFAULT_TIME_BUDGET = 60.0
+# How often a pooled job checks for cancellation while waiting on a worker
+POLL_INTERVAL = 0.1
+# Streaming jobs: lines kept for the on-page preview, and a longer time limit
+PREVIEW_LINES = 500
+STREAMING_TIME_BUDGET = 600.0
+
+# Everything str.splitlines() splits on
+LINE_BREAK_RE = re.compile(r'\r\n|[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')
+
+
+class ExpansionJob:
+    """
+    Expands a text in chunks of lines on a background thread.
+
+    The Streamlit pages keep the job in session state and poll it on every
+    rerun: `progress()` for the bar, `partial()` for what is done so far and
+    `cancel()` to stop it. Lines are expanded independently, so the joined
+    chunks are identical to a single expand_abbreviations() call.
+    """
+
+    def __init__(self, text, abbr_dict, chunk_lines=DEFAULT_CHUNK_LINES, time_budget=DEFAULT_TIME_BUDGET, source="app",
+                 line_cache=None, pool=None, session=None, reservation=None, estimate=None, collect_unknown=False):
+        self.compiled = compile_abbreviations(abbr_dict)
+        # With *collect_unknown*: abbreviation-shaped tokens the dictionary lacks, merged into METRICS at the end
+        self.unknown = UnknownAbbreviations() if collect_unknown else None
+        # Memory admission (memory_guard.admit): released when the job ends
+        self.reservation = reservation
+        self.estimate = estimate
+        self.peak_bytes = None
+        self._tracker = PeakTracker()
+        self.line_cache = line_cache
+        # With a WorkerPool, chunks are expanded in worker processes under
+        # *session*'s turn in the round-robin; this thread only collects them
+        self.pool = pool
+        self.session = session
+        self.lines = text.splitlines()
+        self.chars = len(text)
+        self.source = source
+        self.chunk_lines = chunk_lines
+        self.time_budget = time_budget
+        self.status = "pending"         # running / done / cancelled / timed_out / failed
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+        self._plain_lines = []
+        self._highlighted_lines = []
+        self._lock = threading.Lock()
+        self._cancel = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self.status = "running"
+        self._tracker.start()
+        self._thread.start()
+        return self
+
+    def cancel(self):
+        self._cancel.set()
+
+    @property
+    def finished(self):
+        return self.status not in ("pending", "running")
+
+    @property
+    def complete(self):
+        return self.status == "done"
+
+    def wait(self, timeout=None):
+        self._thread.join(timeout)
+        return self.finished
+
+    def progress(self):
+        """(lines done, total lines)"""
+        with self._lock:
+            return len(self._plain_lines), len(self.lines)
+
+    def partial(self):
+        """(plain, highlighted) text of the lines expanded so far."""
+        with self._lock:
+            return "\n".join(self._plain_lines), "\n".join(self._highlighted_lines)
+
+    def _run(self):
+        deadline = None if self.time_budget is None else self.started_at + self.time_budget
+        hits = Counter()
+        try:
+            if self.pool is not None:
+                self._run_pooled(deadline, hits)
+                return
+            for start in range(0, len(self.lines), self.chunk_lines):
+                if self._cancel.is_set():
+                    self.status = "cancelled"
+                    return
+                if deadline is not None and time.monotonic() > deadline:
+                    self.status = "timed_out"
+                    return
+                chunk = self.lines[start:start + self.chunk_lines]
+                if self.unknown is not None:
+                    self.unknown.scan_lines(chunk, self.compiled, start)
+                if self.line_cache is not None:
+                    plain, highlighted = expand_lines_cached(chunk, self.compiled, self.line_cache, hits)
+                else:
+                    plain, highlighted = expand_lines(chunk, self.compiled, hits)
+                with self._lock:
+                    self._plain_lines.extend(plain)
+                    self._highlighted_lines.extend(highlighted)
+            self.status = "done"
+        except Exception as exc:
+            self.error = exc
+            self.status = "failed"
+        finally:
+            self._finish(hits, len(self.lines), "full")
+
+    def _finish(self, hits, lines, mode):
+        self.finished_at = time.monotonic()
+        measured = self._tracker.stop()
+        self.peak_bytes = measured if measured is not None else self.estimate
+        if self.reservation is not None:
+            self.reservation.release()
+        METRICS.observe_expansion(self.finished_at - self.started_at, lines, self.chars, hits, self.source, self.unknown)
+        if self.peak_bytes is not None:
+            METRICS.observe_memory(self.peak_bytes, mode, measured is not None)
+
+    def _await(self, future, deadline):
+        """*future*'s result, or None with the status set once the job is cancelled or out of time."""
+        while True:
+            if self._cancel.is_set():
+                self.status = "cancelled"
+                return None
+            if deadline is not None and time.monotonic() > deadline:
+                self.status = "timed_out"
+                return None
+            try:
+                return future.result(timeout=POLL_INTERVAL)
+            except TimeoutError:
+                continue
+
+    def _run_pooled(self, deadline, hits):
+        futures = [self.pool.expand_lines(self.session, self.compiled, self.lines[start:start + self.chunk_lines])
+                   for start in range(0, len(self.lines), self.chunk_lines)]
+        try:
+            for start, future in zip(range(0, len(self.lines), self.chunk_lines), futures):
+                # Scanned here while the workers expand
+                if self.unknown is not None:
+                    self.unknown.scan_lines(self.lines[start:start + self.chunk_lines], self.compiled, start)
+                result = self._await(future, deadline)
+                if result is None:
+                    return
+                plain, highlighted, chunk_hits = result
+                hits.update(chunk_hits)
+                with self._lock:
+                    self._plain_lines.extend(plain)
+                    self._highlighted_lines.extend(highlighted)
+            self.status = "done"
+        finally:
+            # Chunks still queued are dropped rather than expanded for nobody
+            for future in futures:
+                future.cancel()
+
+
+def iter_lines(text):
+    """Lazily yields the same lines as text.splitlines()."""
+    start = 0
+    for m in LINE_BREAK_RE.finditer(text):
+        yield text[start:m.start()]
+        start = m.end()
+    if start < len(text):
+        yield text[start:]
+
+
+class StreamingExpansionJob(ExpansionJob):
+    """
+    Plain-only expansion for inputs too large to expand in full: lines are
+    read lazily, expanded chunk by chunk and appended to a temporary file
+    (output_path), so memory stays at the input plus a few chunks. Only the
+    first PREVIEW_LINES lines are kept for the page; partial() returns
+    them as both plain and "highlighted" text.
+    """
+
+    def __init__(self, text, abbr_dict, chunk_lines=DEFAULT_CHUNK_LINES, time_budget=STREAMING_TIME_BUDGET,
+                 source="app", pool=None, session=None, estimate=None, collect_unknown=False):
+        super().__init__("", abbr_dict, chunk_lines, time_budget, source, pool=pool, session=session,
+                         collect_unknown=collect_unknown)
+        self.text = text
+        self.chars = len(text)
+        self.total_lines = len(LINE_BREAK_RE.findall(text)) + (1 if text and not LINE_BREAK_RE.fullmatch(text[-1]) else 0)
+        if estimate is not None and self.total_lines:
+            # *estimate* is for a full expansion; only the preview and the chunks in flight are held here
+            held_lines = PREVIEW_LINES + chunk_lines * (2 * pool.workers + 1 if pool is not None else 1)
+            self.estimate = int(estimate * min(1.0, held_lines / self.total_lines))
+        self.lines_done = 0
+        fd, self.output_path = tempfile.mkstemp(prefix="nemo-", suffix=".txt")
+        os.close(fd)
+
+    def progress(self):
+        return self.lines_done, self.total_lines
+
+    def partial(self):
+        with self._lock:
+            preview = "\n".join(self._plain_lines)
+        return preview, preview
+
+    def _chunks(self):
+        chunk = []
+        for line in iter_lines(self.text):
+            chunk.append(line)
+            if len(chunk) == self.chunk_lines:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def _write_oldest(self, out, pending, deadline, hits):
+        # Writes the oldest chunk in flight once it is back; False if the job stopped waiting
+        result = self._await(pending[0], deadline)
+        if result is None:
+            return False
+        pending.popleft()
+        plain, _, chunk_hits = result
+        hits.update(chunk_hits)
+        self._write(out, plain)
+        return True
+
+    def _write(self, out, plain):
+        out.write(("\n" if self.lines_done else "") + "\n".join(plain))
+        with self._lock:
+            room = PREVIEW_LINES - len(self._plain_lines)
+            if room > 0:
+                self._plain_lines.extend(plain[:room])
+            self.lines_done += len(plain)
+
+    def _run(self):
+        deadline = None if self.time_budget is None else self.started_at + self.time_budget
+        hits = Counter()
+        pending = deque()
+        # Chunks in flight on the pool: enough to keep every worker busy
+        window = 2 * self.pool.workers if self.pool is not None else 0
+        try:
+            with open(self.output_path, "w", encoding="utf-8", errors="surrogatepass") as out:
+                first_line = 0
+                for chunk in self._chunks():
+                    if self._cancel.is_set():
+                        self.status = "cancelled"
+                        return
+                    if deadline is not None and time.monotonic() > deadline:
+                        self.status = "timed_out"
+                        return
+                    if self.unknown is not None:
+                        self.unknown.scan_lines(chunk, self.compiled, first_line)
+                    first_line += len(chunk)
+                    if self.pool is None:
+                        self._write(out, expand_lines(chunk, self.compiled, hits, "plain")[0])
+                        continue
+                    pending.append(self.pool.expand_lines(self.session, self.compiled, chunk, "plain"))
+                    if len(pending) >= window and not self._write_oldest(out, pending, deadline, hits):
+                        return
+                while pending:
+                    if not self._write_oldest(out, pending, deadline, hits):
+                        return
+            self.status = "done"
+        except Exception as exc:
+            self.error = exc
+            self.status = "failed"
+        finally:
+            for future in pending:
+                future.cancel()
+            self._finish(hits, self.lines_done, "streaming")
@@ -0,0 +1,311 @@
+"""
+Bulk expansion of recap emails straight from mail archives.
+
+Messages are streamed out of an mbox file, a Maildir, a single .eml file
+or a directory of .eml files, their text bodies extracted and expanded,
+and one JSON object per message written to a JSON-lines file, in the
+archive's order:
+
+    python mailbox_ingest.py recaps.mbox recaps_expanded.jsonl
+    python mailbox_ingest.py ~/Maildir/Recaps recaps.jsonl --workers 4
+
+    {"index": 0, "message_id": "<...>", "subject": "...", "plain": "...", "highlighted": "..."}
+
+A reader thread parses messages into a short queue while the main thread
+expands the previous ones, so memory holds a few messages at a time
+whatever the size of the archive. mbox files are read line by line rather
+than through mailbox.mbox, which indexes the whole file before the first
+message; they are taken to be mboxrd, which quotes every ">*From " body
+line, unless --mbox-format mboxo says otherwise. Messages that cannot be
+parsed are written with an "error" field instead of text. --unknown lists
+the abbreviations found that the dictionary lacks in a CSV, most frequent
+first, located by message index.
+"""
+import argparse
+import email
+import email.policy
+import json
+import mailbox
+import os
+import queue
+import sys
+import threading
+import time
+from collections import deque
+from html.parser import HTMLParser
+
+from expander import compile_abbreviations, expand_abbreviations, load_compiled_dictionary
+from unknown_abbreviations import UnknownAbbreviations
+from worker_pool import ThreadPool, WorkerPool, default_backend
+
+# Parsed messages waiting for expansion
+QUEUE_MESSAGES = 16
+# mbox variants iter_mbox() reads, the first being the default
+MBOX_FORMATS = ("mboxrd", "mboxo")
+
+_DONE = object()
+
+
+# Reading ------------------------------------------------------------------------
+
+def iter_mbox(path, mbox_format="mboxrd"):
+    """
+    Yields the raw bytes of each message of an mbox file, without its
+    "From " line. An mboxrd file quotes every body line matching ">*From "
+    with one more ">", and that is taken off again (">From " -> "From ",
+    ">>From " -> ">From "). An mboxo file only quotes "From " itself, so a
+    ">From " line may be the sender's own text and every line is kept as
+    it is, as mailbox.mbox does. Reading an mboxo file as mboxrd would
+    strip a ">" from lines the sender wrote that way.
+    """
+    if mbox_format not in MBOX_FORMATS:
+        raise ValueError(f"unknown mbox format {mbox_format!r}, expected one of {', '.join(MBOX_FORMATS)}")
+    unquote = mbox_format == "mboxrd"
+    with open(path, "rb") as f:
+        lines = None
+        for line in f:
+            # Like mailbox.mbox, every line starting with "From " starts a message
+            if line.startswith(b"From "):
+                if lines is not None:
+                    yield _mbox_message(lines)
+                lines = []
+            elif lines is not None:
+                if unquote and line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+                    line = line[1:]
+                lines.append(line)
+        if lines is not None:
+            yield _mbox_message(lines)
+
+
+def _mbox_message(lines):
+    # The blank line before the next "From " separates messages, it is not part of one
+    if lines and lines[-1] in (b"\n", b"\r\n"):
+        lines.pop()
+    return b"".join(lines)
+
+
+def iter_maildir(path):
+    """Yields the raw bytes of each message of a Maildir, oldest delivery first."""
+    box = mailbox.Maildir(path, factory=None, create=False)
+    # Maildir keys start with the delivery time
+    for key in sorted(box.keys()):
+        yield box.get_bytes(key)
+
+
+def iter_eml_files(path):
+    for name in sorted(os.listdir(path)):
+        if name.lower().endswith(".eml"):
+            with open(os.path.join(path, name), "rb") as f:
+                yield f.read()
+
+
+def iter_raw_messages(path, mbox_format="mboxrd"):
+    """Raw messages of *path*, whichever kind of archive it is; see iter_mbox() for *mbox_format*."""
+    if os.path.isdir(path):
+        if all(os.path.isdir(os.path.join(path, sub)) for sub in ("cur", "new", "tmp")):
+            return iter_maildir(path)
+        return iter_eml_files(path)
+    if path.lower().endswith(".eml"):
+        with open(path, "rb") as f:
+            return iter([f.read()])
+    return iter_mbox(path, mbox_format)
+
+
+# Parsing ------------------------------------------------------------------------
+
+class _TextExtractor(HTMLParser):
+    """Text of an HTML body, with block elements on their own lines."""
+
+    BLOCKS = {"p", "div", "br", "tr", "li", "h1", "h2", "h3", "h4", "h5", "h6", "table", "blockquote"}
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ("script", "style"):
+            self._skip += 1
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in ("script", "style"):
+            self._skip = max(self._skip - 1, 0)
+        elif tag in self.BLOCKS:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def html_to_text(markup):
+    extractor = _TextExtractor()
+    extractor.feed(markup)
+    extractor.close()
+    lines = (line.strip() for line in "".join(extractor.parts).splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+def message_text(message):
+    """The message's text/plain body, else its text/html body as text, else ""."""
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return ""
+    try:
+        text = part.get_content()
+    except (LookupError, UnicodeError):
+        # Unknown or wrong charset: decode the bytes as best we can
+        text = (part.get_payload(decode=True) or b"").decode("utf-8", "replace")
+    if part.get_content_subtype() == "html":
+        text = html_to_text(text)
+    return text
+
+
+def parse_message(raw):
+    """(message_id, subject, text body) of one raw message."""
+    message = email.message_from_bytes(raw, policy=email.policy.default)
+    return str(message.get("Message-ID", "")).strip(), str(message.get("Subject", "")), message_text(message)
+
+
+# Pipeline -----------------------------------------------------------------------
+
+def _read_messages(path, out, stop, counters, mbox_format):
+    # Reader thread: parse messages in order into *out*, until done or stopped
+    try:
+        for index, raw in enumerate(iter_raw_messages(path, mbox_format)):
+            counters["bytes"] += len(raw)
+            try:
+                item = (index, *parse_message(raw), None)
+            except Exception as exc:
+                item = (index, "", "", "", f"{type(exc).__name__}: {exc}")
+            while not stop.is_set():
+                try:
+                    out.put(item, timeout=0.5)
+                    break
+                except queue.Full:
+                    continue
+            if stop.is_set():
+                return
+    except Exception as exc:
+        counters["error"] = exc
+    finally:
+        if not stop.is_set():
+            out.put(_DONE)
+
+
+def ingest(source, output, abbr_dict, pool=None, session="mailbox", progress=None, unknown=None,
+           mbox_format="mboxrd"):
+    """
+    Expands every message of *source* into the JSON-lines file *output* and
+    returns the number of messages written. With a WorkerPool (or
+    ThreadPool) as *pool*, bodies are expanded there, a few messages ahead
+    of the one being written. *progress* is called with (messages done,
+    source bytes read) after every message. An UnknownAbbreviations as
+    *unknown* collects the abbreviations the dictionary lacks, with message
+    indexes as sources. *mbox_format* says how an mbox *source* quotes
+    "From " lines (see iter_mbox()).
+    """
+    compiled = compile_abbreviations(abbr_dict)
+    parsed = queue.Queue(maxsize=QUEUE_MESSAGES)
+    stop = threading.Event()
+    counters = {"bytes": 0, "error": None}
+    reader = threading.Thread(target=_read_messages, args=(source, parsed, stop, counters, mbox_format),
+                              daemon=True)
+    reader.start()
+
+    # Messages expanding on the pool, oldest first, so output keeps the archive's order
+    pending = deque()
+    window = 2 * pool.workers if pool is not None else 0
+    written = 0
+
+    def write(f, item, expanded):
+        nonlocal written
+        index, message_id, subject, _, error = item
+        record = {"index": index, "message_id": message_id, "subject": subject}
+        if error is not None:
+            record["error"] = error
+        else:
+            record["plain"], record["highlighted"] = expanded
+        f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        written += 1
+        if progress:
+            progress(written, counters["bytes"])
+
+    def write_oldest(f):
+        item, future = pending.popleft()
+        if future is None:
+            write(f, item, None)
+            return
+        plain_lines, highlighted_lines, _ = future.result()
+        write(f, item, ("\n".join(plain_lines), "\n".join(highlighted_lines)))
+
+    try:
+        with open(output, "w", encoding="utf-8") as f:
+            while True:
+                item = parsed.get()
+                if item is _DONE:
+                    break
+                if unknown is not None and item[4] is None:
+                    unknown.scan_lines(item[3].splitlines(), compiled, source=item[0])
+                if pool is None:
+                    write(f, item, expand_abbreviations(item[3], compiled) if item[4] is None else None)
+                    continue
+                future = pool.expand_lines(session, compiled, item[3].splitlines()) if item[4] is None else None
+                pending.append((item, future))
+                if len(pending) >= window:
+                    write_oldest(f)
+            while pending:
+                write_oldest(f)
+    finally:
+        stop.set()
+        for _, future in pending:
+            if future is not None:
+                future.cancel()
+    if counters["error"] is not None:
+        raise counters["error"]
+    return written
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("source", help="mbox file, Maildir, .eml file or directory of .eml files")
+    parser.add_argument("destination", help="JSON-lines output")
+    parser.add_argument("--dict", default="abbreviations_01.12.25.xlsx", help="abbreviation workbook")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="expand on this many workers (processes, or threads on a free-threaded build)")
+    parser.add_argument("--unknown", metavar="CSV", help="write abbreviations missing from the dictionary here")
+    parser.add_argument("--mbox-format", choices=MBOX_FORMATS, default=MBOX_FORMATS[0],
+                        help="how the mbox quotes body lines starting with \"From \": mboxrd (default) "
+                             "unquotes \">From \" lines, mboxo keeps them as they are")
+    args = parser.parse_args(argv)
+    unknown = UnknownAbbreviations() if args.unknown else None
+
+    compiled = load_compiled_dictionary(args.dict)
+    pool = None
+    if args.workers:
+        pool = ThreadPool(args.workers) if default_backend() == "threads" else WorkerPool(args.workers)
+    started = time.monotonic()
+
+    def report(done, bytes_read):
+        elapsed = time.monotonic() - started
+        rate = bytes_read / elapsed / 1048576 if elapsed else 0.0
+        print(f"\r{done:,} messages  {bytes_read / 1048576:,.0f} MB  {rate:.2f} MB/s",
+              end="", file=sys.stderr, flush=True)
+
+    try:
+        written = ingest(args.source, args.destination, compiled, pool, progress=report, unknown=unknown,
+                         mbox_format=args.mbox_format)
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    print(f"\nwrote {written:,} messages to {args.destination}", file=sys.stderr)
+    if unknown is not None:
+        with open(args.unknown, "w", encoding="utf-8", newline="") as f:
+            unknown.write_csv(f)
+        print(f"{len(unknown):,} unknown abbreviations listed in {args.unknown}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
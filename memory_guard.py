@@ -0,0 +1,166 @@
+"""
+Memory accounting and admission control for expansions.
+
+Expanding a paste in full keeps several copies of it alive at once: the
+input, its lines, the plain and highlighted line lists, the joined results,
+their session-state copies and the escaped HTML. Before a job starts, its
+peak is estimated from the input size, the bytes per character and the
+growth of a few sample lines. The estimate is cheap and errs on the high side.
+A job is admitted in full only when it fits the per-request limit and the
+process still has that much of its budget unreserved. Anything else is
+expanded by a StreamingExpansionJob, plain-only, into a temporary file.
+
+    NEMO_REQUEST_MEMORY_MB      largest full expansion (default 256)
+    NEMO_PROCESS_MEMORY_MB      budget shared by all running full expansions (default 1024)
+    NEMO_MEMORY_DIAGNOSTICS=1   measure each job's real peak with tracemalloc
+
+tracemalloc slows everything down and, being process-wide, attributes
+concurrent jobs' allocations to each other, so diagnostics are for
+calibrating the estimate rather than for production use.
+"""
+import os
+import sys
+import threading
+import tracemalloc
+
+from expander import compile_abbreviations, expand_line
+
+DEFAULT_REQUEST_MEMORY_MB = 256
+DEFAULT_PROCESS_MEMORY_MB = 1024
+
+# Copies of the output alive at the peak of an app expansion, per output
+# character: line lists, joined text, session copies and escaped HTML
+OUTPUT_COPIES = 9
+# Python object overhead per input line (three str headers and list slots)
+LINE_OVERHEAD = 200
+# Lines expanded to estimate how much the text grows
+SAMPLE_LINES = 64
+# Characters of a sample line expanded around its sample point, and in all
+SAMPLE_WINDOW = 512
+SAMPLE_CHARS = 16384
+
+DIAGNOSTICS = os.environ.get("NEMO_MEMORY_DIAGNOSTICS", "") not in ("", "0")
+if DIAGNOSTICS and not tracemalloc.is_tracing():
+    tracemalloc.start()
+
+
+def _env_mb(name, default):
+    return int(float(os.environ.get(name, default)) * 1024 * 1024)
+
+
+def _sample_growth(text, abbr_dict):
+    """
+    Output/input length ratio over up to SAMPLE_LINES evenly spread lines,
+    each cut to SAMPLE_WINDOW characters around its sample point, so a
+    paste of a few very long lines costs no more to sample than any other.
+    """
+    compiled = compile_abbreviations(abbr_dict)
+    step = max(len(text) // SAMPLE_LINES, 1)
+    half = SAMPLE_WINDOW // 2
+    before = after = 0
+    sampled_to = -1
+    for offset in range(0, len(text), step):
+        low, high = max(offset - half, 0), min(offset + half, len(text))
+        start = text.rfind("\n", low, offset) + 1 or low
+        if start <= sampled_to:
+            continue                    # the line, or window, sampled last
+        end = text.find("\n", offset, high)
+        if end == -1:
+            end = high
+        sampled_to = end
+        line = text[start:end]
+        # Cut windows inside a line at spaces, so no word is split
+        if start == low and start and text[start - 1] != "\n" and " " in line:
+            line = line[line.find(" ") + 1:]
+        if end == high and end < len(text) and text[end] != "\n" and " " in line:
+            line = line[:line.rfind(" ")]
+        before += len(line)
+        after += len(expand_line(line, compiled, mode="highlighted")[1])
+        if before >= SAMPLE_CHARS:
+            break
+    return after / before if before else 1.0
+
+
+def estimate_expansion_bytes(text, abbr_dict=None):
+    """Cheap, deliberately high estimate of the peak bytes a full expansion of *text* holds."""
+    if not text:
+        return 0
+    bytes_per_char = (sys.getsizeof(text) - sys.getsizeof("")) / len(text)
+    growth = _sample_growth(text, abbr_dict) if abbr_dict is not None else 1.5
+    lines = text.count("\n") + 1
+    return int(len(text) * bytes_per_char * (1 + OUTPUT_COPIES * growth) + lines * LINE_OVERHEAD)
+
+
+class Reservation:
+    """Bytes held against a MemoryBudget until release() (safe to call twice)."""
+
+    def __init__(self, budget, nbytes):
+        self.budget = budget
+        self.nbytes = nbytes
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self.budget._release(self.nbytes)
+
+
+class MemoryBudget:
+    def __init__(self, limit_bytes, request_limit_bytes):
+        self.limit_bytes = limit_bytes
+        self.request_limit_bytes = request_limit_bytes
+        self.reserved_bytes = 0
+        self.peak_reserved_bytes = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes):
+        """A Reservation, or None when *nbytes* is over the request limit or the remaining budget."""
+        if nbytes > self.request_limit_bytes:
+            return None
+        with self._lock:
+            if self.reserved_bytes + nbytes > self.limit_bytes:
+                return None
+            self.reserved_bytes += nbytes
+            self.peak_reserved_bytes = max(self.peak_reserved_bytes, self.reserved_bytes)
+        return Reservation(self, nbytes)
+
+    def _release(self, nbytes):
+        with self._lock:
+            self.reserved_bytes -= nbytes
+
+    def stats(self):
+        with self._lock:
+            return {"reserved_bytes": self.reserved_bytes, "peak_reserved_bytes": self.peak_reserved_bytes,
+                    "limit_bytes": self.limit_bytes, "request_limit_bytes": self.request_limit_bytes}
+
+
+MEMORY_BUDGET = MemoryBudget(_env_mb("NEMO_PROCESS_MEMORY_MB", DEFAULT_PROCESS_MEMORY_MB),
+                             _env_mb("NEMO_REQUEST_MEMORY_MB", DEFAULT_REQUEST_MEMORY_MB))
+
+
+def admit(text, abbr_dict, budget=MEMORY_BUDGET):
+    """
+    (estimate, reservation) for a full expansion of *text*; reservation is
+    None when the text has to be streamed instead.
+    """
+    estimate = estimate_expansion_bytes(text, abbr_dict)
+    return estimate, budget.reserve(estimate)
+
+
+class PeakTracker:
+    """Peak traced bytes between start() and stop(), when diagnostics are on."""
+
+    def __init__(self):
+        self.base = None
+        self.peak_bytes = None
+
+    def start(self):
+        if DIAGNOSTICS:
+            tracemalloc.reset_peak()
+            self.base = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def stop(self):
+        if DIAGNOSTICS and self.base is not None:
+            self.peak_bytes = max(tracemalloc.get_traced_memory()[1] - self.base, 0)
+        return self.peak_bytes
@@ -0,0 +1,214 @@
+"""
+Process-wide operational metrics for the expander.
+
+    METRICS.render_prometheus()     # text exposition format
+    METRICS.dump_json(path)         # local JSON snapshot, including per-key hits
+    METRICS.unknown_csv()           # abbreviations missing from the dictionary, ranked
+
+Set NEMO_METRICS_PORT to serve /metrics (Prometheus) and /metrics.json from
+a background HTTP server, and NEMO_METRICS_PATH to have a JSON snapshot
+written after each expansion. `python metrics.py unused metrics.json
+abbreviations_01.12.25.xlsx` lists dictionary entries that were never hit.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from unknown_abbreviations import UnknownAbbreviations
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+LINE_BUCKETS = (1, 5, 10, 50, 100, 500, 1000, 5000, 10000, 50000)
+CHAR_BUCKETS = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000, 5000000)
+MEMORY_BUCKETS = tuple(2 ** i * 1048576 for i in range(0, 12))     # 1 MB .. 2 GB
+# Unknown abbreviations listed in JSON snapshots, most frequent first
+UNKNOWN_SNAPSHOT = 500
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total, out = 0, []
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            out.append((bound, total))
+        return out
+
+    def to_dict(self):
+        return {"buckets": {_le(b): c for b, c in self.cumulative()}, "sum": self.sum, "count": self.count}
+
+
+def _le(bound):
+    return "+Inf" if bound == float("inf") else repr(bound)
+
+
+class Metrics:
+    """All recorded metrics, guarded by one lock; updates are a few increments."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.histograms = {
+            "nemo_expansion_seconds": Histogram(LATENCY_BUCKETS),
+            "nemo_input_lines": Histogram(LINE_BUCKETS),
+            "nemo_input_chars": Histogram(CHAR_BUCKETS),
+            "nemo_dictionary_load_seconds": Histogram(LATENCY_BUCKETS),
+            "nemo_dictionary_compile_seconds": Histogram(LATENCY_BUCKETS),
+            "nemo_request_memory_bytes": Histogram(MEMORY_BUCKETS),
+        }
+        self.counters = Counter()
+        self.key_hits = Counter()
+        self.unknown = UnknownAbbreviations()
+
+    def observe_expansion(self, seconds, lines, chars, hits=None, source="app", unknown=None):
+        with self._lock:
+            self.histograms["nemo_expansion_seconds"].observe(seconds)
+            self.histograms["nemo_input_lines"].observe(lines)
+            self.histograms["nemo_input_chars"].observe(chars)
+            self.counters[f'nemo_expansions_total{{source="{source}"}}'] += 1
+            if hits:
+                self.key_hits.update(hits)
+            if unknown:
+                self.unknown.update(unknown)
+        _maybe_dump(self)
+
+    def observe_memory(self, nbytes, mode="full", measured=False):
+        """Peak bytes of one expansion: tracemalloc-measured, or the admission estimate."""
+        with self._lock:
+            self.histograms["nemo_request_memory_bytes"].observe(nbytes)
+            self.counters[f'nemo_expansions_by_mode_total{{mode="{mode}",measured="{str(measured).lower()}"}}'] += 1
+
+    def observe_dictionary(self, compiled):
+        with self._lock:
+            self.histograms["nemo_dictionary_load_seconds"].observe(compiled.load_seconds)
+            self.histograms["nemo_dictionary_compile_seconds"].observe(compiled.compile_seconds)
+            self.counters["nemo_dictionary_loads_total"] += 1
+
+    def count(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def render_prometheus(self):
+        out = []
+        with self._lock:
+            for name, hist in self.histograms.items():
+                out.append(f"# TYPE {name} histogram")
+                for bound, total in hist.cumulative():
+                    out.append(f'{name}_bucket{{le="{_le(bound)}"}} {total}')
+                out.append(f"{name}_sum {hist.sum}")
+                out.append(f"{name}_count {hist.count}")
+            for name, value in sorted(self.counters.items()):
+                out.append(f"{name} {value}")
+            out.append("# TYPE nemo_abbreviation_hits_total counter")
+            for key, value in self.key_hits.most_common():
+                label = key.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+                out.append(f'nemo_abbreviation_hits_total{{key="{label}"}} {value}')
+        return "\n".join(out) + "\n"
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                "started": self.started,
+                "snapshot": time.time(),
+                "histograms": {name: hist.to_dict() for name, hist in self.histograms.items()},
+                "counters": dict(self.counters),
+                "key_hits": dict(self.key_hits.most_common()),
+                "unknown_abbreviations": self.unknown.ranked(UNKNOWN_SNAPSHOT),
+            }
+
+    def unknown_ranked(self, limit=None):
+        with self._lock:
+            return self.unknown.ranked(limit)
+
+    def unknown_csv(self):
+        """Every unknown abbreviation seen so far, ranked, as workbook-ready CSV."""
+        with self._lock:
+            return self.unknown.to_csv()
+
+    def dump_json(self, path):
+        tmp = f"{path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False, indent=1)
+        os.replace(tmp, path)
+
+
+METRICS = Metrics()
+
+_last_dump = [0.0]
+
+
+def _maybe_dump(metrics, min_interval=5.0):
+    path = os.environ.get("NEMO_METRICS_PATH")
+    if path and time.monotonic() - _last_dump[0] >= min_interval:
+        _last_dump[0] = time.monotonic()
+        metrics.dump_json(path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, ctype = METRICS.render_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/metrics.json":
+            body, ctype = json.dumps(METRICS.to_dict(), ensure_ascii=False), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{ctype}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+_server_lock = threading.Lock()
+_server = []
+
+
+def start_metrics_server(port=None):
+    """Serve the metrics once per process on NEMO_METRICS_PORT (or *port*)."""
+    port = port or os.environ.get("NEMO_METRICS_PORT")
+    if not port:
+        return None
+    with _server_lock:
+        if not _server:
+            server = ThreadingHTTPServer(("", int(port)), _MetricsHandler)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            _server.append(server)
+        return _server[0]
+
+
+def unused_keys(key_hits, abbr_dict):
+    """Dictionary keys that never matched, candidates for pruning."""
+    return sorted(key for key in abbr_dict if not key_hits.get(key))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "unused":
+        sys.exit("usage: python metrics.py unused METRICS.json DICTIONARY.xlsx")
+    from expander import load_abbreviation_dict
+    with open(sys.argv[2], encoding="utf-8") as f:
+        hits = json.load(f)["key_hits"]
+    for key in unused_keys(hits, load_abbreviation_dict(sys.argv[3])):
+        print(key)
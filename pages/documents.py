@@ -0,0 +1,50 @@
+import streamlit as st
+from dictionaries import get_dictionary, uploaded_dictionary
+from docx_expander import DOCX_MIME, expand_docx
+from metrics import start_metrics_server
+
+# ─────────────────────────────────────────────────────────────────────────────
+# Streamlit UI
+# ─────────────────────────────────────────────────────────────────────────────
+st.set_page_config(page_title="NEMO • Document Expander", layout="wide")
+start_metrics_server()   # no-op unless NEMO_METRICS_PORT is set
+st.title("📄 Expand Abbreviations in a Word Document")
+
+# 1️⃣  Abbreviation dictionary ------------------------------------------------
+dict_file = st.sidebar.file_uploader("Upload custom abbreviation dictionary (.xlsx)", type=["xlsx"])
+
+if dict_file:
+    st.sidebar.success("Custom dictionary loaded!", icon="✅")
+    abbr_dict = uploaded_dictionary(dict_file.name, dict_file.getvalue())
+else:
+    abbr_dict = get_dictionary()
+    st.sidebar.info("Using default dictionary")
+
+# Categorised workbooks: expand only the categories this desk wants
+expand_dict = abbr_dict
+if abbr_dict.categories:
+    selected_categories = st.sidebar.multiselect("Categories to expand", abbr_dict.categories,
+                                                 default=abbr_dict.categories, key="expand_categories")
+    if not selected_categories:
+        st.sidebar.caption("No category selected: expanding with the whole dictionary")
+    expand_dict = abbr_dict.select(selected_categories)
+
+# 2️⃣  Document upload --------------------------------------------------------
+doc_file = st.file_uploader("Upload the Word document (.docx) to expand", type=["docx"])
+highlight = st.checkbox("Highlight expansions in yellow", value=True)
+
+# 3️⃣  Expand in place --------------------------------------------------------
+if doc_file and st.button("🚀 Expand Document", use_container_width=True):
+    with st.spinner("Expanding abbreviations in the document…"):
+        try:
+            expanded_bytes = expand_docx(doc_file.getvalue(), expand_dict, highlight=highlight)
+        except Exception as exc:
+            st.error(f"Could not process the document: {exc}")
+            st.stop()
+
+    base_name = doc_file.name.rsplit(".", 1)[0]
+    st.download_button("⬇️ Download expanded .docx",
+                       data=expanded_bytes,
+                       file_name=f"{base_name}_expanded.docx",
+                       mime=DOCX_MIME,
+                       use_container_width=True)
@@ -1,119 +1,39 @@
-import io, json, html, re
+import json, html, os, time
 import streamlit as st
-from docx import Document               
-from docx.shared import Pt
-from docx.enum.text import WD_ALIGN_PARAGRAPH
-from docx.enum.text import WD_COLOR_INDEX
-from expander import load_abbreviation_dict, expand_abbreviations
-
-def strip_html_tags(text):
-    return re.sub(r'</?mark>', '', text)
-
-
-
-
-HEADER_RE = re.compile(r"^\s*(\d{1,3})\\?[\.\:\-]\s*(.*)$")
-
-CLAUSE_RE = re.compile(r"^\s*[Cc]lause\s+(\d{1,3})[\.\:\-]?\s*(.*)$", re.IGNORECASE)
-
-def is_clause_heading(text: str, expected: int | None) -> tuple[bool, int | None]:
-    """
-    Returns (True,new_expected) if *text* is the next main‑clause heading.
-    • Headings must be consecutive numbers (30→31→32 …).
-    • Must be reasonable length (≤30 words) and not contain obvious paragraph text
-    • Also handles numbered clauses without titles (e.g., "91.")
-    • Also handles existing "Clause X" format (e.g., "Clause 31. Trading Limits")
-    """
-    # Try both regex patterns
-    m = HEADER_RE.match(text.strip())
-    clause_m = CLAUSE_RE.match(text.strip())
-    
-    # Use whichever pattern matches
-    if clause_m:
-        m = clause_m
-    elif not m:
-        return (False, expected)
-
-    num, title = int(m.group(1)), m.group(2).strip()
-
-    # More flexible consecutive numbering - allow some gaps but prefer consecutive
-    if expected is None:
-        expected = num          # first heading sets the baseline
-    
-    # Allow for reasonable clause numbers (don't be too strict about perfect sequence)
-    if expected is not None and num < expected:
-        return (False, expected)  # Don't go backwards
-    
-    # Be more lenient with gaps for higher numbered clauses (90+)
-    max_gap = 10 if num >= 90 else 5
-    if expected is not None and num > expected + max_gap: 
-        return (False, expected)
-
-    # Handle different cases based on title content
-    words = title.split()
-    
-    # Case 1: No title at all (e.g., "91." or "Clause 91")
-    if len(words) == 0:
-        return (True, num + 1)
-    
-    # Case 2: Very short title (1-2 words) - likely legitimate clauses
-    if len(words) <= 2:
-        # Accept short titles like "Deleted" or legitimate short clause names
-        return (True, num + 1)
-    
-    # Case 3: Long text that looks like paragraph content
-    if len(words) > 30:
-        return (False, expected)
-    
-    # Case 4: Text starting with obvious sentence starters - likely paragraph text
-    paragraph_starters = [
-        'if', 'when', 'should', 'the charterers shall', 'the owners shall',
-        'in case', 'notwithstanding', 'subject to', 'provided that',
-        'it is understood that', 'all', 'any', 'referring to', 'during the'
-    ]
-    
-    title_lower = title.lower()
-    if any(title_lower.startswith(starter) for starter in paragraph_starters):
-        return (False, expected)
-    
-    # Case 5: Text with too many sentence indicators - likely paragraph text
-    sentence_indicators = ['shall', 'will', 'must', 'should', 'may', 'can']
-    indicator_count = sum(1 for indicator in sentence_indicators if indicator in title_lower)
-    if indicator_count > 1:  # More than one indicates sentence text
-        return (False, expected)
-    
-    # Case 6: Accept if it looks like a proper heading
-    return (True, num + 1)
-
-def clean_header_text(text: str) -> str:
-    """Clean and format header text for display"""
-    # Remove escape characters
-    text = text.replace('\\', '')
-    # Remove leading colons, dashes, and extra spaces
-    text = re.sub(r'^[\:\-\s]+', '', text)
-    # Normalize whitespace
-    text = re.sub(r'\s+', ' ', text.strip())
-    return text
+from dictionaries import get_dictionary, get_disk_cache, get_worker_pool, session_id, uploaded_dictionary
+from jobs import ExpansionJob, StreamingExpansionJob
+from memory_guard import admit
+from metrics import METRICS, start_metrics_server
+from result_cache import SHARED_CACHE, result_key
+from rider_pipeline import build_riders_docx, parse_riders, riders_preview_lines
 
 # ─────────────────────────────────────────────────────────────────────────────
 # Streamlit UI
 # ─────────────────────────────────────────────────────────────────────────────
 st.set_page_config(page_title="NEMO • Word Formatter", layout="wide")
+start_metrics_server()   # no-op unless NEMO_METRICS_PORT is set
 st.title("🛠 Word Formatter + Abbreviation Expander")
 
 # 1️⃣  Abbreviation dictionary ------------------------------------------------
 dict_file = st.sidebar.file_uploader("Upload custom abbreviation dictionary (.xlsx)", type=["xlsx"])
+
 if dict_file:
     st.sidebar.success("Custom dictionary loaded!", icon="✅")
-    abbr_dict = load_abbreviation_dict(dict_file)
+    abbr_dict = uploaded_dictionary(dict_file.name, dict_file.getvalue())
 else:
     # Load the same dictionary as used by the app
-    if dict_file:
-        abbr_dict = load_abbreviation_dict(dict_file)
-    else:
-        abbr_dict = load_abbreviation_dict("abbreviations_01.12.25.xlsx")
+    abbr_dict = get_dictionary()
     st.sidebar.info("Using default dictionary")
 
+# Categorised workbooks: expand only the categories this desk wants
+expand_dict = abbr_dict
+if abbr_dict.categories:
+    selected_categories = st.sidebar.multiselect("Categories to expand", abbr_dict.categories,
+                                                 default=abbr_dict.categories, key="expand_categories")
+    if not selected_categories:
+        st.sidebar.caption("No category selected: expanding with the whole dictionary")
+    expand_dict = abbr_dict.select(selected_categories)
+
 # 2️⃣  User input -------------------------------------------------------------
 raw_text = st.text_area("Paste or type your Word text here 👇",
                         height=400, label_visibility="collapsed",
@@ -131,221 +51,142 @@ col_go, col_dl = st.columns(2, gap="small")
 with col_go:
     go = st.button("🚀 Expand & Format", use_container_width=True)
 
-formatted_bytes = None            # <- will hold .docx
-preview_lines   = []              # <- for the HTML preview
-
 if go:
     if not raw_text.strip():
         st.warning("Please enter some text before formatting.")
     else:
-        with st.spinner("Expanding abbreviations and creating Word document…"):
-
-            # --- 1. expand abbreviations (plain) ---------------------------
-            # 👇 Just renaming to avoid confusion, we’ll keep original variable
-            expanded_plain_text, expanded_highlighted_text = expand_abbreviations(raw_text, abbr_dict)
-
-
-            # Proceed with final lines
-            plain_lines = expanded_plain_text.splitlines()
-            highlighted_lines = expanded_highlighted_text.splitlines()
-
-
-            if not expanded_plain_text or not expanded_highlighted_text:
-                st.error("Something went wrong during abbreviation expansion")
-                st.stop()
-
-            # --- 2. build .docx in memory ----------------------------------
-            doc   = Document("WORKING RIDERS.docx")
-            style = doc.styles["Normal"]
-            style.font.name = "Arial"
-            style.font.size = Pt(10)
-
-            expected_clause_num = None
-            
-            # Process both plain and highlighted versions
-            # ✅ KEEP FINAL EXPANSION AS-IS:
-            plain_lines = expanded_plain_text.splitlines()
-            highlighted_lines = expanded_highlighted_text.splitlines()
-
-            
-            # Ensure both lists have the same length
-            max_len = max(len(plain_lines), len(highlighted_lines))
-            while len(plain_lines) < max_len:
-                plain_lines.append("")
-            while len(highlighted_lines) < max_len:
-                highlighted_lines.append("")
-            
-            for i, (plain_line, highlighted_line) in enumerate(zip(plain_lines, highlighted_lines)):
-
-
-                # Skip blank lines entirely
-                if not plain_line.strip():
-                    preview_lines.append("")        # keep blank for preview
-                    continue
-
-                # Check if this line is a clause heading (handles both "31." and "Clause 31" formats)
-                is_header, expected_clause_num = is_clause_heading(plain_line, expected_clause_num)
-                
-                if is_header:
-                    # Extract number and title using both possible regex patterns
-                    m = HEADER_RE.match(plain_line.strip())
-                    clause_m = CLAUSE_RE.match(plain_line.strip())
-                    
-                    # Use whichever pattern matched
-                    if clause_m:
-                        num = clause_m.group(1)
-                        title = clean_header_text(clause_m.group(2))
-                        original_format = f"Clause {num}"
-                    else:
-                        num = m.group(1)
-                        title = clean_header_text(m.group(2))
-                        # Determine original separator from the line
-                        if ':' in plain_line:
-                            original_format = f"{num}:"
-                        elif '-' in plain_line:
-                            original_format = f"{num}-"
-                        else:
-                            original_format = f"{num}."
-                        
-                    # Determine if we should include the title or treat it as separate paragraph
-                    should_include_title = True
-                    remaining_text = ""
-                    
-                    words = title.split()
-                    
-                    # Check if title looks like paragraph text that got captured
-                    if len(words) > 10:  # Long text - likely paragraph
-                        should_include_title = False
-                        remaining_text = title
-                    elif title.lower().startswith(('in case', 'if', 'referring to', 'during the', 'where and when', 'should the')):
-                        should_include_title = False
-                        remaining_text = title
-                    
-                    # Format the clause header consistently (always CAPS, bold, underlined)
-                    if not should_include_title or not title or title.lower() == 'deleted':
-                        clause_text = f"CLAUSE {num}"
-                        if title.lower() == 'deleted':
-                            clause_text += ". DELETED"
-                    else:
-                        clause_text = f"CLAUSE {num}. {title.upper()}"
-
-                    # Check if clause header was changed (standardized)
-                    original_line = plain_line.strip()
-                    header_was_changed = not original_line.upper().startswith(f"CLAUSE {num}.")
-                    
-                    # docx – header
-                    p = doc.add_paragraph()
-                    run = p.add_run(clause_text)
-                    run.bold = True
-                    run.underline = True
-                    
-                    # Add highlighting if clause header was standardized
-                    if header_was_changed:
-                        run.font.highlight_color = WD_COLOR_INDEX.BRIGHT_GREEN
-
-                    # paragraph formatting
-                    p.paragraph_format.space_before = Pt(0)
-                    p.paragraph_format.space_after = Pt(10)
-                    p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-
-                    # preview - show highlighting if changed
-                    if header_was_changed:
-                        preview_lines.append(
-                            f"<b><u><mark>{html.escape(clause_text)}</mark></u></b>"
-                        )
-                    else:
-                        preview_lines.append(
-                            f"<b><u>{html.escape(clause_text)}</u></b>"
-                        )
-                    
-                    # If we have remaining text that should be a separate paragraph, add it
-                    if remaining_text:
-                        # Check if remaining text has highlights
-                        remaining_highlighted = highlighted_line[highlighted_line.find(remaining_text):] if remaining_text in highlighted_line else remaining_text
-                        
-                        # Add paragraph to docx
-                        p = doc.add_paragraph()
-                        
-                        if '<mark>' in remaining_highlighted:
-                            # Process highlighted parts
-                            parts = re.split(r'(<mark>.*?</mark>)', remaining_highlighted)
-                            for part in parts:
-                                if part.startswith('<mark>') and part.endswith('</mark>'):
-                                    # This is highlighted text
-                                    clean_text = part[6:-7]  # Remove <mark> tags
-                                    run = p.add_run(clean_text)
-                                    run.font.highlight_color = WD_COLOR_INDEX.YELLOW
-                                else:
-                                    # Regular text
-                                    p.add_run(part)
-                        else:
-                            # No highlights in remaining text
-                            p.add_run(remaining_text)
-                            
-                        p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                        p.paragraph_format.space_before = Pt(0)
-                        p.paragraph_format.space_after = Pt(10)
-                        
-                        # Set font for all runs
-                        for run in p.runs:
-                            run.font.name = "Arial"
-                            run.font.size = Pt(10)
-                        
-                        preview_lines.append(remaining_highlighted)
-                else:
-                    # regular paragraph - check for abbreviation highlights
-                    p = doc.add_paragraph()
-                    
-                    if '<mark>' in highlighted_line:
-                        parts = re.split(r'(<mark>.*?</mark>)', highlighted_line)
-                        for part in parts:
-                            if part.startswith('<mark>') and part.endswith('</mark>'):
-                                clean_text = strip_html_tags(part)
-                                run = p.add_run(clean_text)
-                                run.font.highlight_color = WD_COLOR_INDEX.YELLOW
-                            else:
-                                p.add_run(strip_html_tags(part))
-                    else:
-                        # No highlights in this line
-                        if '<mark>' in highlighted_line:
-                            parts = re.split(r'(<mark>.*?</mark>)', highlighted_line)
-                            for part in parts:
-                                if part.startswith('<mark>') and part.endswith('</mark>'):
-                                    clean_text = strip_html_tags(part)
-                                    run = p.add_run(clean_text)
-                                    run.font.highlight_color = WD_COLOR_INDEX.YELLOW
-                                else:
-                                    p.add_run(strip_html_tags(part))
-                        else:
-                            p.add_run(plain_line)
-
-                    
-                    p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
-                    p.paragraph_format.space_before = Pt(0)
-                    p.paragraph_format.space_after = Pt(10)
-                    
-                    # Set font for all runs
-                    for run in p.runs:
-                        run.font.name = "Arial"
-                        run.font.size = Pt(10)
-
-                    preview_lines.append(highlighted_line)
-
-            # save the document
-            bio = io.BytesIO()
-            doc.save(bio)
-            bio.seek(0)
-            formatted_bytes = bio.read()
-
-# 4️⃣  Download + copy --------------------------------------------------------
-if formatted_bytes:
+        # Pressing again replaces the running expansion instead of queueing another
+        previous_job = st.session_state.pop("riders_job", None)
+        if previous_job is not None:
+            previous_job.cancel()
+        previous_result = st.session_state.pop("riders_result", None)
+        if previous_result and previous_result["docx_future"] is not None:
+            previous_result["docx_future"].cancel()
+        estimate, reservation = admit(raw_text, expand_dict)
+        # Set from the main page's unknown-abbreviations panel
+        collect_unknown = st.session_state.get("collect_unknown", False)
+        if reservation is not None:
+            riders_job = ExpansionJob(raw_text, expand_dict, source="riders", line_cache=get_disk_cache(),
+                                      pool=get_worker_pool(), session=session_id(),
+                                      reservation=reservation, estimate=estimate, collect_unknown=collect_unknown)
+        else:
+            # Too big to expand and format in memory: plain text only, streamed to a file
+            riders_job = StreamingExpansionJob(raw_text, expand_dict, source="riders", pool=get_worker_pool(),
+                                               session=session_id(), estimate=estimate, collect_unknown=collect_unknown)
+            METRICS.count("nemo_streaming_fallbacks_total")
+        st.session_state["riders_job"] = riders_job.start()
+        # Keyed by the text and dictionary expanded, not whatever they are when the job ends
+        st.session_state["riders_docx_key"] = result_key(raw_text, expand_dict.version, "riders_docx")
+        st.rerun()
+
+# Background expansion: progress, partial output and cancel while it runs
+riders_job = st.session_state.get("riders_job")
+if riders_job is not None and not riders_job.finished:
+    done, total = riders_job.progress()
+    st.progress(done / total if total else 0.0, text=f"Expanding abbreviations… {done} / {total} lines")
+    if riders_job.pool is not None:
+        pool_stats = riders_job.pool.stats()
+        st.caption(f"🧵 Workers: {pool_stats['running']} / {pool_stats['workers']} busy · "
+                   f"{pool_stats['queued']} chunks queued from {pool_stats['sessions']} session(s)")
+    if st.button("⏹️ Cancel", key="cancel_riders"):
+        riders_job.cancel()
+    _, partial_highlighted = riders_job.partial()
+    safe_partial = html.escape(partial_highlighted).replace("&lt;mark&gt;", "<mark>").replace("&lt;/mark&gt;", "</mark>")
+    st.markdown(safe_partial.replace("\n", "<br>"), unsafe_allow_html=True)
+    time.sleep(0.3)
+    st.rerun()
+
+if riders_job is not None and riders_job.finished:
+    st.session_state.pop("riders_job")
+    docx_key = st.session_state.pop("riders_docx_key", None)
+    done, total = riders_job.progress()
+    if riders_job.status == "cancelled":
+        st.warning(f"Expansion cancelled after {done} of {total} lines.")
+        riders_job = None
+    elif riders_job.status == "failed":
+        st.error(f"Expansion failed: {riders_job.error}")
+        riders_job = None
+    elif riders_job.status == "timed_out":
+        st.warning(f"Time limit reached: the document contains the first {done} of {total} lines.")
+
+if isinstance(riders_job, StreamingExpansionJob):
+    st.warning("📦 Large input: expanded as plain text without Word formatting to spare memory.")
+    with open(riders_job.output_path, "rb") as f:
+        expanded_txt = f.read()
+    os.remove(riders_job.output_path)
     with col_dl:
-        st.download_button("⬇️ Download .docx",
-                           data=formatted_bytes,
-                           file_name="formatted_text.docx",
-                           mime=("application/vnd.openxmlformats-officedocument."
-                                 "wordprocessingml.document"),
-                           use_container_width=True)
+        st.download_button("⬇️ Download .txt", data=expanded_txt, file_name="expanded_text.txt",
+                           mime="text/plain", use_container_width=True)
+    st.text(riders_job.partial()[0])
+    riders_job = None
+
+if riders_job is not None and riders_job.finished:
+    # --- 1. expand abbreviations (plain) ---------------------------
+    expanded_plain_text, expanded_highlighted_text = riders_job.partial()
+
+    if not expanded_plain_text or not expanded_highlighted_text:
+        st.error("Something went wrong during abbreviation expansion")
+        st.stop()
+
+    # --- 2. parse the clause structure for the preview; the .docx waits until asked for
+    # Only complete expansions are cached: a timed-out one is not the whole input
+    if not riders_job.complete:
+        docx_key = None
+    st.session_state["riders_result"] = {
+        "plain": expanded_plain_text,
+        "highlighted": expanded_highlighted_text,
+        "blocks": parse_riders(expanded_plain_text, expanded_highlighted_text),
+        "docx_key": docx_key,
+        "docx": SHARED_CACHE.get(docx_key) if docx_key else None,
+        "docx_future": None,        # the .docx being built on the worker pool
+    }
+
+# 4️⃣  Preview, download + copy -----------------------------------------------
+riders_result = st.session_state.get("riders_result")
+if riders_result:
+    expanded_plain_text = riders_result["plain"]
+    with col_dl:
+        formatted_bytes = None
+        if (riders_result["docx"] is None and riders_result["docx_future"] is None
+                and st.button("📄 Create .docx", use_container_width=True)):
+            # clauses this server formatted before are reused either way
+            pool = get_worker_pool()
+            if pool is not None:
+                # Polled on each rerun below rather than waited on, so it can be cancelled
+                riders_result["docx_future"] = pool.build_riders_docx(
+                    session_id(), expanded_plain_text, riders_result["highlighted"],
+                    blocks=riders_result["blocks"], clause_cache=SHARED_CACHE)
+            else:
+                with st.spinner("Creating Word document…"):
+                    formatted_bytes, _ = build_riders_docx(expanded_plain_text, riders_result["highlighted"],
+                                                           blocks=riders_result["blocks"], clause_cache=SHARED_CACHE)
+        docx_future = riders_result["docx_future"]
+        if docx_future is not None and docx_future.done():
+            riders_result["docx_future"] = None
+            if docx_future.cancelled():
+                st.warning("Word document cancelled.")
+            elif docx_future.exception() is not None:
+                st.error(f"Creating the Word document failed: {docx_future.exception()}")
+            else:
+                formatted_bytes, _ = docx_future.result()
+        elif docx_future is not None:
+            st.info("📄 Creating Word document…")
+            if st.button("⏹️ Cancel", key="cancel_riders_docx", use_container_width=True):
+                docx_future.cancel()
+                riders_result["docx_future"] = None
+        if formatted_bytes is not None:
+            riders_result["docx"] = formatted_bytes
+            if riders_result["docx_key"]:
+                SHARED_CACHE.put(riders_result["docx_key"], formatted_bytes)
+        if riders_result["docx"] is not None:
+            st.download_button("⬇️ Download .docx",
+                               data=riders_result["docx"],
+                               file_name="formatted_text.docx",
+                               mime=("application/vnd.openxmlformats-officedocument."
+                                     "wordprocessingml.document"),
+                               use_container_width=True)
+
+    st.markdown("<br>".join(riders_preview_lines(riders_result["blocks"])), unsafe_allow_html=True)
 
     escaped = json.dumps(expanded_plain_text)[1:-1]
 
@@ -370,4 +211,8 @@ if formatted_bytes:
         📋 Copy text
     </button>
     """
-    st.components.v1.html(copy_js, height=55)
\ No newline at end of file
+    st.components.v1.html(copy_js, height=55)
+
+    if riders_result["docx_future"] is not None:
+        time.sleep(0.3)
+        st.rerun()
\ No newline at end of file
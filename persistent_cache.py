@@ -0,0 +1,165 @@
+"""
+Optional on-disk cache of per-line expansion results that survives worker
+restarts.
+
+Results live in a SQLite database in WAL mode, so several Streamlit worker
+processes can read it concurrently while one writes. Rows are keyed by the
+line's content hash and the dictionary version, so a changed or edited
+dictionary never sees results computed with the old one; those rows stop
+being read and are the first to go when the cache is trimmed back under its
+byte budget by least-recent use.
+
+Enable it for the pages with NEMO_DISK_CACHE=/path/to/cache.sqlite
+(budget: NEMO_DISK_CACHE_MB, default 256).
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from expander import compile_abbreviations, expand_line
+
+DEFAULT_DISK_CACHE_MB = 256
+
+# Reads refresh last_used at most this often, to keep them cheap
+TOUCH_INTERVAL = 3600.0
+# Check the size budget every this many inserted rows
+EVICT_CHECK_EVERY = 500
+# Rows deleted per statement when trimming, so other writers wait for one batch at most
+EVICT_BATCH = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS lines (
+    key TEXT NOT NULL,
+    version TEXT NOT NULL,
+    plain TEXT NOT NULL,
+    highlighted TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (key, version)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS lines_last_used ON lines (last_used);
+"""
+
+
+def line_key(line):
+    return hashlib.blake2b(line.encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+class PersistentCache:
+    def __init__(self, path, max_bytes=DEFAULT_DISK_CACHE_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._inserted = 0
+        with self._connect() as db:
+            db.executescript(_SCHEMA)
+
+    def _connect(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            self._local.db = db
+        return db
+
+    def get_many(self, keys, version):
+        """{key: (plain, highlighted)} for the keys found."""
+        db = self._connect()
+        found, stale = {}, []
+        now = time.time()
+        keys = list(keys)
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            for key, plain, highlighted, last_used in db.execute(
+                    f"SELECT key, plain, highlighted, last_used FROM lines WHERE version = ? AND key IN ({marks})",
+                    [version, *batch]):
+                found[key] = (plain, highlighted)
+                if now - last_used > TOUCH_INTERVAL:
+                    stale.append(key)
+        if stale:
+            db.executemany("UPDATE lines SET last_used = ? WHERE key = ? AND version = ?",
+                           [(now, key, version) for key in stale])
+        return found
+
+    def put_many(self, items, version):
+        """Stores {key: (plain, highlighted)}."""
+        if not items:
+            return
+        db = self._connect()
+        now = time.time()
+        rows = [(key, version, plain, highlighted, len(plain) + len(highlighted) + 64, now)
+                for key, (plain, highlighted) in items.items()]
+        db.execute("BEGIN IMMEDIATE")
+        try:
+            db.executemany("INSERT OR REPLACE INTO lines VALUES (?, ?, ?, ?, ?, ?)", rows)
+            db.execute("COMMIT")
+        except Exception:
+            db.execute("ROLLBACK")
+            raise
+        self._inserted += len(rows)
+        if self._inserted >= EVICT_CHECK_EVERY:
+            self._inserted = 0
+            self.evict()
+
+    def evict(self):
+        """Deletes least recently used rows until the cache is at 90% of its budget."""
+        db = self._connect()
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM lines").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        while total > target:
+            # The oldest rows, as many of the next batch as it takes to reach the target;
+            # each statement is its own transaction
+            rows, size = db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM "
+                "(SELECT size, SUM(size) OVER (ORDER BY last_used ROWS UNBOUNDED PRECEDING) AS upto FROM "
+                "(SELECT size, last_used FROM lines ORDER BY last_used LIMIT ?)) "
+                "WHERE upto - size < ?", (EVICT_BATCH, total - target)).fetchone()
+            if not rows:
+                break
+            db.execute("DELETE FROM lines WHERE (key, version) IN "
+                       "(SELECT key, version FROM lines ORDER BY last_used LIMIT ?)", (rows,))
+            total -= size
+            removed += rows
+        return removed
+
+    def stats(self):
+        db = self._connect()
+        rows, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM lines").fetchone()
+        return {"rows": rows, "bytes": size, "max_bytes": self.max_bytes}
+
+
+def expand_lines_cached(lines, abbr_dict, cache, hits=None):
+    """
+    expand_lines() backed by *cache*: lines already expanded by any process
+    for this dictionary version are read back instead of recomputed (and so
+    do not add to *hits*).
+    """
+    compiled = compile_abbreviations(abbr_dict)
+    keys = [line_key(line) for line in lines]
+    found = cache.get_many(set(keys), compiled.version)
+    computed = {}
+    plain_lines, highlighted_lines = [], []
+    for line, key in zip(lines, keys):
+        result = found.get(key) or computed.get(key)
+        if result is None:
+            result = computed[key] = expand_line(line, compiled, hits)
+        plain_lines.append(result[0])
+        highlighted_lines.append(result[1])
+    cache.put_many(computed, compiled.version)
+    return plain_lines, highlighted_lines
+
+
+def open_default_cache():
+    """The cache configured by NEMO_DISK_CACHE, or None when it is not set."""
+    path = os.environ.get("NEMO_DISK_CACHE")
+    if not path:
+        return None
+    max_mb = float(os.environ.get("NEMO_DISK_CACHE_MB", DEFAULT_DISK_CACHE_MB))
+    return PersistentCache(path, int(max_mb * 1024 * 1024))
@@ -0,0 +1,84 @@
+import hashlib
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+# Default memory budget of the process-wide cache, override with
+# NEMO_RESULT_CACHE_MB.
+DEFAULT_CACHE_MB = 64
+
+
+def result_key(text, version, mode="both"):
+    return (hashlib.sha256(text.encode("utf-8")).hexdigest(), version, mode)
+
+
+def _estimate_bytes(key, value):
+    size = sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+    if isinstance(value, tuple):
+        size += sys.getsizeof(value) + sum(sys.getsizeof(part) for part in value)
+    else:
+        size += sys.getsizeof(value)
+    return size
+
+
+class ResultCache:
+    """
+    Thread-safe LRU cache of expansion results, bounded by an estimate of the
+    bytes held rather than by entry count.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _estimate_bytes(key, value)
+        if size > self.max_bytes:
+            # Never let one huge result flush everything else
+            return
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+SHARED_CACHE = ResultCache(int(float(os.environ.get("NEMO_RESULT_CACHE_MB", DEFAULT_CACHE_MB)) * 1024 * 1024))
+
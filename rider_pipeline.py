@@ -0,0 +1,484 @@
+"""
+The riders pipeline - expansion, clause detection and .docx building - as
+plain functions, so the page and the benchmarks run the same code:
+
+    blocks = parse_riders(plain_text, highlighted_text)       # for the preview
+    docx_bytes, preview_lines = build_riders_docx(plain_text, highlighted_text, blocks=blocks)
+    docx_bytes, preview_lines, plain_text = format_riders(text, abbr_dict)
+    docx_bytes, preview_lines, plain_text = format_riders(text, abbr_dict, clause_cache=SHARED_CACHE)
+
+With a clause cache, clauses already expanded or formatted - in this
+session or another of the same server - are read back rather than redone,
+so re-running a rider with a few edited clauses only processes those. A
+worker process formatting a rider for the server gets the server's cached
+clauses for it as a ClauseCacheSnapshot and hands back the ones it
+formatted.
+
+Pass a PhaseRecorder as *phases* to get the time (and optionally the memory
+allocated) per phase: expand, template, headings, runs, fonts, save.
+"""
+import html
+import io
+import json
+import os
+import re
+import time
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from docx import Document
+from docx.shared import Pt
+from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.enum.text import WD_COLOR_INDEX
+from docx.oxml.parser import parse_xml
+from lxml import etree
+
+from expander import compile_abbreviations, expand_abbreviations, expand_line, expand_lines
+from result_cache import result_key
+
+# Next to this module, so scripts run from any directory find it
+RIDERS_TEMPLATE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "WORKING RIDERS.docx")
+
+PHASES = ("expand", "template", "headings", "runs", "fonts", "save")
+
+HEADER_RE = re.compile(r"^\s*(\d{1,3})\\?[\.\:\-]\s*(.*)$")
+
+CLAUSE_RE = re.compile(r"^\s*[Cc]lause\s+(\d{1,3})[\.\:\-]?\s*(.*)$", re.IGNORECASE)
+
+MARK_SPLIT_RE = re.compile(r'(<mark>.*?</mark>)')
+
+# Part of the key of cached clause paragraphs: change it when body paragraph formatting changes
+CLAUSE_XML_FORMAT = "riders-body-1"
+
+
+def strip_html_tags(text):
+    return re.sub(r'</?mark>', '', text)
+
+
+def is_clause_heading(text: str, expected: int | None) -> tuple[bool, int | None]:
+    """
+    Returns (True,new_expected) if *text* is the next main‑clause heading.
+    • Headings must be consecutive numbers (30→31→32 …).
+    • Must be reasonable length (≤30 words) and not contain obvious paragraph text
+    • Also handles numbered clauses without titles (e.g., "91.")
+    • Also handles existing "Clause X" format (e.g., "Clause 31. Trading Limits")
+    """
+    # Try both regex patterns
+    m = HEADER_RE.match(text.strip())
+    clause_m = CLAUSE_RE.match(text.strip())
+
+    # Use whichever pattern matches
+    if clause_m:
+        m = clause_m
+    elif not m:
+        return (False, expected)
+
+    num, title = int(m.group(1)), m.group(2).strip()
+
+    # More flexible consecutive numbering - allow some gaps but prefer consecutive
+    if expected is None:
+        expected = num          # first heading sets the baseline
+
+    # Allow for reasonable clause numbers (don't be too strict about perfect sequence)
+    if expected is not None and num < expected:
+        return (False, expected)  # Don't go backwards
+
+    # Be more lenient with gaps for higher numbered clauses (90+)
+    max_gap = 10 if num >= 90 else 5
+    if expected is not None and num > expected + max_gap:
+        return (False, expected)
+
+    # Handle different cases based on title content
+    words = title.split()
+
+    # Case 1: No title at all (e.g., "91." or "Clause 91")
+    if len(words) == 0:
+        return (True, num + 1)
+
+    # Case 2: Very short title (1-2 words) - likely legitimate clauses
+    if len(words) <= 2:
+        # Accept short titles like "Deleted" or legitimate short clause names
+        return (True, num + 1)
+
+    # Case 3: Long text that looks like paragraph content
+    if len(words) > 30:
+        return (False, expected)
+
+    # Case 4: Text starting with obvious sentence starters - likely paragraph text
+    paragraph_starters = [
+        'if', 'when', 'should', 'the charterers shall', 'the owners shall',
+        'in case', 'notwithstanding', 'subject to', 'provided that',
+        'it is understood that', 'all', 'any', 'referring to', 'during the'
+    ]
+
+    title_lower = title.lower()
+    if any(title_lower.startswith(starter) for starter in paragraph_starters):
+        return (False, expected)
+
+    # Case 5: Text with too many sentence indicators - likely paragraph text
+    sentence_indicators = ['shall', 'will', 'must', 'should', 'may', 'can']
+    indicator_count = sum(1 for indicator in sentence_indicators if indicator in title_lower)
+    if indicator_count > 1:  # More than one indicates sentence text
+        return (False, expected)
+
+    # Case 6: Accept if it looks like a proper heading
+    return (True, num + 1)
+
+
+def clean_header_text(text: str) -> str:
+    """Clean and format header text for display"""
+    # Remove escape characters
+    text = text.replace('\\', '')
+    # Remove leading colons, dashes, and extra spaces
+    text = re.sub(r'^[\:\-\s]+', '', text)
+    # Normalize whitespace
+    text = re.sub(r'\s+', ' ', text.strip())
+    return text
+
+
+class PhaseRecorder:
+    """
+    Accumulates wall time per named phase. With track_allocations, also the
+    bytes allocated and still held at the end of each phase ("net") and the
+    largest transient allocation seen inside it ("peak"), via tracemalloc -
+    which slows everything down, so time and allocations are best measured
+    in separate runs.
+    """
+
+    def __init__(self, track_allocations=False):
+        self.track_allocations = track_allocations
+        self.seconds = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.net_bytes = defaultdict(int)
+        self.peak_bytes = defaultdict(int)
+
+    @contextmanager
+    def phase(self, name):
+        if self.track_allocations:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] += time.perf_counter() - started
+            self.calls[name] += 1
+            if self.track_allocations:
+                current, peak = tracemalloc.get_traced_memory()
+                self.net_bytes[name] += current - before
+                self.peak_bytes[name] = max(self.peak_bytes[name], peak - before)
+
+    def to_dict(self):
+        return {name: {"seconds": self.seconds[name], "calls": self.calls[name],
+                       **({"net_bytes": self.net_bytes[name], "peak_bytes": self.peak_bytes[name]}
+                          if self.track_allocations else {})}
+                for name in self.seconds}
+
+
+_NO_PHASE = nullcontext()
+
+
+def _no_phase(name):
+    return _NO_PHASE
+
+
+def _add_marked_runs(p, highlighted_text, strip_tags):
+    parts = MARK_SPLIT_RE.split(highlighted_text)
+    for part in parts:
+        if part.startswith('<mark>') and part.endswith('</mark>'):
+            # This is highlighted text
+            run = p.add_run(strip_html_tags(part) if strip_tags else part[6:-7])
+            run.font.highlight_color = WD_COLOR_INDEX.YELLOW
+        else:
+            # Regular text
+            p.add_run(strip_html_tags(part) if strip_tags else part)
+
+
+def _finish_body_paragraph(p, phase):
+    with phase("runs"):
+        p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+        p.paragraph_format.space_before = Pt(0)
+        p.paragraph_format.space_after = Pt(10)
+    with phase("fonts"):
+        # Set font for all runs
+        for run in p.runs:
+            run.font.name = "Arial"
+            run.font.size = Pt(10)
+
+
+def _clause_xml_key(body_blocks):
+    return result_key(json.dumps(body_blocks), CLAUSE_XML_FORMAT, "riders_clause_xml")
+
+
+def clause_xml_keys(blocks):
+    """Clause-cache keys of the clause bodies build_riders_docx() lays out for *blocks*."""
+    clause_body = []
+    for block in blocks + [("heading", "", False)]:
+        if block[0] != "heading":
+            clause_body.append(block)
+            continue
+        if any(kind == "body" for kind, _, _ in clause_body):
+            yield _clause_xml_key(clause_body)
+        clause_body = []
+
+
+class ClauseCacheSnapshot:
+    """
+    A clause cache to hand to another process: the entries of a rider's
+    clauses found in the server's cache (see clause_xml_keys()), plus those
+    put while building it, which are also kept in *added* to be put back.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.added = {}
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.added[key] = value
+
+
+def _add_clause_body(doc, body_blocks, phase, clause_cache):
+    """
+    Adds the paragraphs of one clause body. Their XML only depends on the
+    blocks, so with a *clause_cache* it is keyed by them and copied in
+    when the same body was formatted before, in any session of the process.
+    """
+    if not any(kind == "body" for kind, _, _ in body_blocks):
+        return
+    key = None
+    if clause_cache is not None:
+        key = _clause_xml_key(body_blocks)
+        cached = clause_cache.get(key)
+        if cached is not None:
+            with phase("runs"):
+                for p in list(parse_xml(cached)):
+                    doc.element.body._insert_p(p)
+            return
+    paragraphs = []
+    for kind, text, flag in body_blocks:
+        if kind != "body":
+            continue
+        with phase("runs"):
+            p = doc.add_paragraph()
+            if '<mark>' in text:
+                _add_marked_runs(p, text, strip_tags=flag)
+            else:
+                p.add_run(text)
+        _finish_body_paragraph(p, phase)
+        paragraphs.append(p._p)
+    if key is not None:
+        clause_cache.put(key, b"<clause>" + b"".join(etree.tostring(p) for p in paragraphs) + b"</clause>")
+
+
+def parse_riders(expanded_plain_text, expanded_highlighted_text, phases=None):
+    """
+    The clause structure of an expanded rider, one (kind, text, flag) block
+    per output line: ("heading", "CLAUSE n. TITLE", restyled), ("body",
+    text, strip_tags) where text holds <mark> tags if anything in it was
+    expanded, or ("blank", "", False). Cheap next to building the .docx,
+    so the page previews this and builds the document only on request.
+    """
+    phase = phases.phase if phases is not None else _no_phase
+    blocks = []
+    expected_clause_num = None
+
+    plain_lines = expanded_plain_text.splitlines()
+    highlighted_lines = expanded_highlighted_text.splitlines()
+
+    # Ensure both lists have the same length
+    max_len = max(len(plain_lines), len(highlighted_lines))
+    plain_lines += [""] * (max_len - len(plain_lines))
+    highlighted_lines += [""] * (max_len - len(highlighted_lines))
+
+    for plain_line, highlighted_line in zip(plain_lines, highlighted_lines):
+        # Skip blank lines entirely
+        if not plain_line.strip():
+            blocks.append(("blank", "", False))
+            continue
+
+        with phase("headings"):
+            # Check if this line is a clause heading (handles both "31." and "Clause 31" formats)
+            is_header, expected_clause_num = is_clause_heading(plain_line, expected_clause_num)
+
+            if not is_header:
+                # regular paragraph - keep the abbreviation highlights if there are any
+                blocks.append(("body", highlighted_line if '<mark>' in highlighted_line else plain_line, True))
+                continue
+
+            # Extract number and title using both possible regex patterns
+            m = HEADER_RE.match(plain_line.strip())
+            clause_m = CLAUSE_RE.match(plain_line.strip())
+
+            # Use whichever pattern matched
+            if clause_m:
+                num = clause_m.group(1)
+                title = clean_header_text(clause_m.group(2))
+            else:
+                num = m.group(1)
+                title = clean_header_text(m.group(2))
+
+            # Determine if we should include the title or treat it as separate paragraph
+            should_include_title = True
+            remaining_text = ""
+
+            words = title.split()
+
+            # Check if title looks like paragraph text that got captured
+            if len(words) > 10:  # Long text - likely paragraph
+                should_include_title = False
+                remaining_text = title
+            elif title.lower().startswith(('in case', 'if', 'referring to', 'during the', 'where and when', 'should the')):
+                should_include_title = False
+                remaining_text = title
+
+            # Format the clause header consistently (always CAPS, bold, underlined)
+            if not should_include_title or not title or title.lower() == 'deleted':
+                clause_text = f"CLAUSE {num}"
+                if title.lower() == 'deleted':
+                    clause_text += ". DELETED"
+            else:
+                clause_text = f"CLAUSE {num}. {title.upper()}"
+
+            # Check if clause header was changed (standardized)
+            original_line = plain_line.strip()
+            header_was_changed = not original_line.upper().startswith(f"CLAUSE {num}.")
+            blocks.append(("heading", clause_text, header_was_changed))
+
+            # If we have remaining text that should be a separate paragraph, add it
+            if remaining_text:
+                # Check if remaining text has highlights
+                remaining_highlighted = highlighted_line[highlighted_line.find(remaining_text):] if remaining_text in highlighted_line else remaining_text
+                blocks.append(("body", remaining_highlighted if '<mark>' in remaining_highlighted else remaining_text, False))
+
+    return blocks
+
+
+def riders_preview_lines(blocks):
+    """One HTML line per block: headings bold and underlined, marked when restyled."""
+    preview_lines = []
+    for kind, text, flag in blocks:
+        if kind == "heading":
+            if flag:
+                preview_lines.append(f"<b><u><mark>{html.escape(text)}</mark></u></b>")
+            else:
+                preview_lines.append(f"<b><u>{html.escape(text)}</u></b>")
+        else:
+            preview_lines.append(html.escape(text).replace("&lt;mark&gt;", "<mark>").replace("&lt;/mark&gt;", "</mark>"))
+    return preview_lines
+
+
+def build_riders_docx(expanded_plain_text, expanded_highlighted_text, template=RIDERS_TEMPLATE, phases=None,
+                      blocks=None, clause_cache=None):
+    """
+    Lays the expanded rider text out on the riders template: clause headings
+    become "CLAUSE n. TITLE" (bold, underlined, green when restyled) and
+    expansions are highlighted yellow. Returns (docx bytes, preview lines).
+    *blocks* from an earlier parse_riders() call saves parsing again. With a
+    ResultCache as *clause_cache*, clause bodies formatted before are copied
+    from their cached paragraph XML instead of being built again.
+    """
+    phase = phases.phase if phases is not None else _no_phase
+
+    with phase("template"):
+        doc = Document(template)
+        style = doc.styles["Normal"]
+        style.font.name = "Arial"
+        style.font.size = Pt(10)
+
+    if blocks is None:
+        blocks = parse_riders(expanded_plain_text, expanded_highlighted_text, phases)
+
+    # Body blocks since the last heading, added as one clause
+    clause_body = []
+    for kind, text, flag in blocks:
+        if kind != "heading":
+            clause_body.append((kind, text, flag))
+            continue
+        _add_clause_body(doc, clause_body, phase, clause_cache)
+        clause_body = []
+        with phase("runs"):
+            # docx – header
+            p = doc.add_paragraph()
+            run = p.add_run(text)
+            run.bold = True
+            run.underline = True
+
+            # Add highlighting if clause header was standardized
+            if flag:
+                run.font.highlight_color = WD_COLOR_INDEX.BRIGHT_GREEN
+
+            # paragraph formatting
+            p.paragraph_format.space_before = Pt(0)
+            p.paragraph_format.space_after = Pt(10)
+            p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
+    _add_clause_body(doc, clause_body, phase, clause_cache)
+
+    with phase("save"):
+        bio = io.BytesIO()
+        doc.save(bio)
+        formatted_bytes = bio.getvalue()
+
+    return formatted_bytes, riders_preview_lines(blocks)
+
+
+def _clause_spans(lines):
+    """(start, end) of each clause of a rider's lines: a heading-like line and the lines up to the next one."""
+    start = 0
+    for i, line in enumerate(lines):
+        if i > start and (HEADER_RE.match(line) or CLAUSE_RE.match(line)):
+            yield start, i
+            start = i
+    if lines:
+        yield start, len(lines)
+
+
+def expand_riders(text, abbr_dict, clause_cache=None, hits=None):
+    """
+    expand_abbreviations() for a rider. With a ResultCache as *clause_cache*,
+    the body of each clause (the lines after its heading, so the clause
+    number does not matter) is read back from the cache when a clause with
+    the same body was expanded with this dictionary version before; only
+    headings and new or edited bodies are expanded (and counted in *hits*).
+    """
+    compiled = compile_abbreviations(abbr_dict)
+    if clause_cache is None:
+        return expand_abbreviations(text, compiled, hits)
+    lines = text.splitlines()
+    plain_parts, highlighted_parts = [], []
+    for start, end in _clause_spans(lines):
+        # A heading line is expanded every time: its number may read as part of a unit
+        if HEADER_RE.match(lines[start]) or CLAUSE_RE.match(lines[start]):
+            plain, highlighted = expand_line(lines[start], compiled, hits)
+            plain_parts.append(plain)
+            highlighted_parts.append(highlighted)
+            start += 1
+        if start == end:
+            continue
+        key = result_key("\n".join(lines[start:end]), compiled.version, "riders_clause")
+        expanded = clause_cache.get(key)
+        if expanded is None:
+            plain_lines, highlighted_lines = expand_lines(lines[start:end], compiled, hits)
+            expanded = ("\n".join(plain_lines), "\n".join(highlighted_lines))
+            clause_cache.put(key, expanded)
+        plain_parts.append(expanded[0])
+        highlighted_parts.append(expanded[1])
+    return "\n".join(plain_parts), "\n".join(highlighted_parts)
+
+
+def format_riders(text, abbr_dict, template=RIDERS_TEMPLATE, phases=None, clause_cache=None):
+    """
+    Expands *text* and builds the riders document: (docx bytes, preview
+    lines, plain text). A ResultCache as *clause_cache* lets clauses seen
+    before skip both expansion and formatting.
+    """
+    phase = phases.phase if phases is not None else _no_phase
+    with phase("expand"):
+        expanded_plain_text, expanded_highlighted_text = expand_riders(text, abbr_dict, clause_cache)
+    formatted_bytes, preview_lines = build_riders_docx(expanded_plain_text, expanded_highlighted_text, template, phases,
+                                                       clause_cache=clause_cache)
+    return formatted_bytes, preview_lines, expanded_plain_text
@@ -0,0 +1,153 @@
+"""
+Tokens that look like abbreviations but have no dictionary entry.
+
+Abbreviations missing from the workbook pass through expansion unchanged,
+so nothing points at them. An UnknownAbbreviations collector handed to the
+expansion loops (expand_lines, expand_abbreviations, expand_many, the page
+jobs, archive.py and mailbox_ingest.py) scans each line as it is expanded
+for three shapes:
+
+    NOR, WWD, CQD           short all-caps words (2-6 characters)
+    25kts, 3.5mt            a unit glued to a number
+    b/l, c/p, w/o           short slash-joined words
+
+and counts those the dictionary does not know, with the first few places
+each was seen. ranked() orders them by count and write_csv() exports them
+with the workbook's "Abbreviation" and "Full Form" columns first, ready to
+fill in and paste. The scan is one precompiled regex per line with a dict
+lookup per match, which adds up to a tenth to a plain expansion, so the
+page jobs only collect when the sidebar's unknown-abbreviations panel is
+switched on. They merge their findings into METRICS, and
+`python unknown_abbreviations.py metrics.json` prints the ranked list from
+a metrics snapshot.
+"""
+import csv
+import io
+import json
+import re
+import sys
+from collections import Counter
+
+UNKNOWN_RE = re.compile(
+    r'(?<![\w/])(?:'
+    r'([A-Z][A-Z0-9&]{1,5})'                # NOR, P&I, ETA2
+    r'|\d+(?:\.\d+)?([A-Za-z]{1,5})'        # 25kts, 3.5mt
+    r'|([A-Za-z]{1,4}/[A-Za-z]{1,4})'       # b/l, c/p
+    r')(?![\w/])')
+
+# Number suffixes that are not units
+NUMBER_SUFFIXES = frozenset({"st", "nd", "rd", "th", "x"})
+# Slash-joined words that are plain English
+SLASH_WORDS = frozenset({"and/or"})
+
+# Places kept per token
+DEFAULT_POSITIONS = 5
+
+
+def find_unknown(line, compiled):
+    """
+    Yields (column, token, kind) for each abbreviation-shaped token of
+    *line* that *compiled* has no entry for; kind is "caps", "unit" or
+    "slash". Caps words on lines written all in capitals (headings) are
+    skipped.
+    """
+    abbr_dict = compiled.abbr_dict
+    # Words of multi-word keys count as known too: "gr/net" of "gr/net tonnage"
+    is_key_word = compiled.is_key_word
+    shouting = None
+    for m in UNKNOWN_RE.finditer(line):
+        caps, unit, slash = m.groups()
+        if caps is not None:
+            if is_key_word(caps.lower()):
+                continue
+            if shouting is None:
+                shouting = line.isupper()
+            if not shouting:
+                yield m.start(), caps, "caps"
+        elif unit is not None:
+            key = unit.lower()
+            # Every unit is a one-word key, so this covers them too
+            if not is_key_word(key) and key not in NUMBER_SUFFIXES:
+                yield m.start(2), unit, "unit"
+        else:
+            key = slash.lower()
+            if is_key_word(key) or key in SLASH_WORDS:
+                continue
+            left, right = key.split("/")
+            # Either side from the dictionary expands the pair already
+            if left not in abbr_dict and right not in abbr_dict:
+                yield m.start(), slash, "slash"
+
+
+class UnknownAbbreviations:
+    """
+    Counts of unknown abbreviation-shaped tokens (by lower-cased token)
+    over any number of texts, with the first *max_positions* places each
+    was seen as (source, line, column). Not thread-safe: use one per job
+    and merge them with update().
+    """
+
+    def __init__(self, max_positions=DEFAULT_POSITIONS):
+        self.max_positions = max_positions
+        self.counts = Counter()
+        self.kinds = {}
+        self.positions = {}
+
+    def __len__(self):
+        return len(self.counts)
+
+    def scan(self, line, compiled, line_no=0, source=None):
+        for column, token, kind in find_unknown(line, compiled):
+            key = token.lower()
+            self.counts[key] += 1
+            places = self.positions.get(key)
+            if places is None:
+                self.kinds[key] = kind
+                places = self.positions[key] = []
+            if len(places) < self.max_positions:
+                places.append((source, line_no, column))
+
+    def scan_lines(self, lines, compiled, first_line=0, source=None):
+        for line_no, line in enumerate(lines, first_line):
+            self.scan(line, compiled, line_no, source)
+
+    def update(self, other):
+        """Adds the counts and places of another collector."""
+        self.counts.update(other.counts)
+        for key, places in other.positions.items():
+            self.kinds.setdefault(key, other.kinds[key])
+            known = self.positions.setdefault(key, [])
+            known.extend(places[:self.max_positions - len(known)])
+
+    def ranked(self, limit=None):
+        """[{abbreviation, kind, count, positions}], most frequent first."""
+        keys = sorted(self.counts, key=lambda k: (-self.counts[k], k))[:limit]
+        return [{"abbreviation": k, "kind": self.kinds[k], "count": self.counts[k],
+                 "positions": [list(p) for p in self.positions[k]]} for k in keys]
+
+    def write_csv(self, f, limit=None):
+        writer = csv.writer(f)
+        writer.writerow(["Abbreviation", "Full Form", "Count", "Kind", "Seen at"])
+        for row in self.ranked(limit):
+            seen = "; ".join(_place(*p) for p in row["positions"])
+            writer.writerow([row["abbreviation"], "", row["count"], row["kind"], seen])
+
+    def to_csv(self, limit=None):
+        out = io.StringIO()
+        self.write_csv(out, limit)
+        return out.getvalue()
+
+
+def _place(source, line_no, column):
+    # Lines and columns are 0-based internally, 1-based for people
+    where = f"line {line_no + 1}, col {column + 1}"
+    return where if source is None else f"{source}: {where}"
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 2:
+        sys.exit("usage: python unknown_abbreviations.py METRICS.json")
+    with open(sys.argv[1], encoding="utf-8") as f:
+        rows = json.load(f).get("unknown_abbreviations", [])
+    for row in rows:
+        print(f"{row['count']:>8}  {row['kind']:<6} {row['abbreviation']}")
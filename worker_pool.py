@@ -0,0 +1,359 @@
+"""
+Shared pool of worker processes for the CPU-bound work behind the pages.
+
+Every Streamlit session runs in the one server process and shares its GIL,
+so expansions started by several users at once used to run one after the
+other and stall everyone's reruns. The pages now hand chunks of lines and
+riders documents to a pool of processes instead, each started with the
+default dictionary compiled and the riders template read.
+
+Tasks are queued per session and dispatched round-robin, one at a time per
+free worker, so a user expanding a huge text does not hold up a colleague
+expanding a short one. Dictionaries other than the preloaded one (uploads,
+or the default after an edit) are sent to a worker the first time it needs
+them and kept there by version.
+
+NEMO_WORKERS sets the number of processes; the default is one per CPU,
+and 0 (or a single CPU) keeps all work in the server process.
+
+On a free-threaded CPython build the same dispatcher can run its tasks on
+threads instead (ThreadPool), all sharing the server's one compiled
+dictionary. NEMO_POOL=threads or NEMO_POOL=processes overrides the choice,
+which defaults to threads only when the GIL is disabled.
+"""
+import io
+import os
+import sys
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from dictionary_edits import apply_overlay, overlay_path
+from expander import CompiledDictionary, expand_lines, load_compiled_dictionary
+from persistent_cache import expand_lines_cached, open_default_cache
+from rider_pipeline import RIDERS_TEMPLATE, ClauseCacheSnapshot, build_riders_docx, clause_xml_keys, parse_riders
+
+# Dictionaries a worker keeps compiled, least recently used dropped first
+WORKER_DICTIONARIES = 8
+
+
+# Worker side ------------------------------------------------------------------
+
+_worker = {}
+
+
+def _init_worker(default_workbook, template):
+    _worker["dictionaries"] = OrderedDict()
+    if default_workbook:
+        compiled = load_compiled_dictionary(default_workbook)
+        apply_overlay(compiled, overlay_path(default_workbook))
+        _worker["dictionaries"][compiled.version] = compiled
+    with open(template, "rb") as f:
+        _worker["template"] = f.read()
+    _worker["line_cache"] = open_default_cache()
+
+
+def _worker_dictionary(version, payload):
+    dictionaries = _worker["dictionaries"]
+    compiled = dictionaries.get(version)
+    if compiled is not None:
+        dictionaries.move_to_end(version)
+        return compiled
+    if payload is None:
+        return None
+    items, plural_rules = payload
+    compiled = CompiledDictionary(dict(items), plural_rules)
+    # Keyed by the server's version, which edits chain rather than recompute
+    compiled.version = version
+    dictionaries[version] = compiled
+    while len(dictionaries) > WORKER_DICTIONARIES:
+        dictionaries.popitem(last=False)
+    return compiled
+
+
+def _expand_task(version, lines, payload=None, mode="both"):
+    compiled = _worker_dictionary(version, payload)
+    if compiled is None:
+        return None                     # ask the server for the dictionary
+    hits = Counter()
+    # The line cache holds both forms, so single-form chunks skip it
+    if _worker["line_cache"] is not None and mode == "both":
+        plain, highlighted = expand_lines_cached(lines, compiled, _worker["line_cache"], hits)
+    else:
+        plain, highlighted = expand_lines(lines, compiled, hits, mode)
+    return plain, highlighted, hits
+
+
+def _riders_task(expanded_plain_text, expanded_highlighted_text, blocks=None, clauses=None):
+    # *clauses* are the server's cached clause paragraphs for this rider; new ones go back with the result
+    clause_cache = ClauseCacheSnapshot(clauses) if clauses is not None else None
+    formatted_bytes, preview_lines = build_riders_docx(expanded_plain_text, expanded_highlighted_text,
+                                                       io.BytesIO(_worker["template"]), blocks=blocks,
+                                                       clause_cache=clause_cache)
+    return formatted_bytes, preview_lines, clause_cache.added if clause_cache is not None else {}
+
+
+# Server side ------------------------------------------------------------------
+
+class _Task:
+    __slots__ = ("fn", "args", "future", "started", "retry_args")
+
+    def __init__(self, fn, args, future, retry_args=None):
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.started = False
+        # Called for new arguments if the worker answers None
+        self.retry_args = retry_args
+
+
+class WorkerPool:
+    """
+    Round-robin dispatcher in front of a ProcessPoolExecutor. submit()
+    returns a Future straight away; cancelling it drops the task if it has
+    not reached a worker yet. At most one task per worker is handed to the
+    executor, so everything else waits in the per-session queues where the
+    round-robin order still applies.
+    """
+
+    def __init__(self, workers, default_workbook=None, template=RIDERS_TEMPLATE):
+        self.workers = workers
+        self._initargs = (default_workbook, os.path.abspath(template))
+        self._executor = None
+        self._queues = {}               # session -> deque of _Task
+        self._turns = deque()           # sessions with queued tasks, next first
+        self._running = 0
+        self._payloads = {}             # version -> picklable dictionary contents
+        self._lock = threading.Lock()
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=get_context("spawn"),
+                                                 initializer=_init_worker, initargs=self._initargs)
+        return self._executor
+
+    def submit(self, session, fn, *args, retry_args=None):
+        future = Future()
+        self._enqueue(session, _Task(fn, args, future, retry_args))
+        self._dispatch()
+        return future
+
+    def _enqueue(self, session, task, front=False):
+        with self._lock:
+            if session not in self._queues:
+                self._queues[session] = deque()
+                self._turns.append(session)
+            if front:
+                self._queues[session].appendleft(task)
+            else:
+                self._queues[session].append(task)
+
+    def _dispatch(self):
+        while True:
+            with self._lock:
+                if self._running >= self.workers or not self._turns:
+                    return
+                session = self._turns.popleft()
+                queue = self._queues[session]
+                task = queue.popleft()
+                if queue:
+                    self._turns.append(session)     # back of the line
+                else:
+                    del self._queues[session]
+                if not task.started:
+                    if not task.future.set_running_or_notify_cancel():
+                        continue                    # cancelled while queued
+                    task.started = True
+                self._running += 1
+                try:
+                    inner = self._ensure_executor().submit(task.fn, *task.args)
+                except BrokenProcessPool as exc:
+                    self._executor = None
+                    self._running -= 1
+                    inner = None
+                    error = exc
+            if inner is None:
+                task.future.set_exception(error)
+                continue
+            inner.add_done_callback(lambda inner, task=task, session=session: self._finished(inner, task, session))
+
+    def _finished(self, inner, task, session):
+        with self._lock:
+            self._running -= 1
+        if inner.cancelled():
+            # Dropped by shutdown(); the task's own future is already running
+            # and cannot be cancelled, so fail it for whoever is waiting
+            task.future.set_exception(CancelledError())
+            self._dispatch()
+            return
+        exc = inner.exception()
+        if isinstance(exc, BrokenProcessPool):
+            # A worker died; start a fresh pool for the next task
+            with self._lock:
+                self._executor = None
+        if exc is not None:
+            task.future.set_exception(exc)
+        elif inner.result() is None and task.retry_args is not None:
+            task.args, task.retry_args = task.retry_args(), None
+            self._enqueue(session, task, front=True)
+        else:
+            task.future.set_result(inner.result())
+        self._dispatch()
+
+    def _payload(self, compiled):
+        with self._lock:
+            payload = self._payloads.get(compiled.version)
+            if payload is None:
+                payload = (list(compiled.abbr_dict.items()), dict(compiled.plural_rules))
+                self._payloads = {compiled.version: payload}    # only the latest is worth keeping
+            return payload
+
+    def expand_lines(self, session, compiled, lines, mode="both"):
+        """Future of (plain lines, highlighted lines, hits) for *lines*; see expander.expand_lines() for *mode*."""
+        # A worker that does not have this dictionary yet answers None and
+        # the task is sent again, ahead of the session's queue, with it
+        return self.submit(session, _expand_task, compiled.version, lines, None, mode,
+                           retry_args=lambda: (compiled.version, lines, self._payload(compiled), mode))
+
+    def build_riders_docx(self, session, expanded_plain_text, expanded_highlighted_text, blocks=None,
+                          clause_cache=None):
+        """
+        Future of (docx bytes, preview lines). The rider's clauses found in
+        *clause_cache* (a cache of this process, such as SHARED_CACHE) go to
+        the worker with the task, and the ones it formats are put back.
+        """
+        if blocks is None:
+            blocks = parse_riders(expanded_plain_text, expanded_highlighted_text)
+        clauses = None
+        if clause_cache is not None:
+            clauses = {}
+            for key in clause_xml_keys(blocks):
+                cached = clause_cache.get(key)
+                if cached is not None:
+                    clauses[key] = cached
+        future = Future()
+        inner = self.submit(session, _riders_task, expanded_plain_text, expanded_highlighted_text, blocks, clauses)
+
+        def finished(inner):
+            if inner.cancelled():
+                future.cancel()
+                return
+            exc = inner.exception()
+            if exc is not None:
+                if not future.cancelled():
+                    future.set_exception(exc)
+                return
+            formatted_bytes, preview_lines, added = inner.result()
+            if clause_cache is not None:
+                for key, value in added.items():
+                    clause_cache.put(key, value)
+            # A caller that gave up still leaves the clauses cached
+            if not future.cancelled():
+                future.set_result((formatted_bytes, preview_lines))
+        inner.add_done_callback(finished)
+        # Cancelling the result drops the task if it is still queued
+        future.add_done_callback(lambda future: inner.cancel() if future.cancelled() else None)
+        return future
+
+    def stats(self):
+        with self._lock:
+            queued = {session: sum(not task.future.cancelled() for task in queue)
+                      for session, queue in self._queues.items()}
+        return {"workers": self.workers, "running": self._running,
+                "queued": sum(queued.values()), "sessions": sum(1 for n in queued.values() if n)}
+
+    def queued(self, session):
+        """Tasks of *session* waiting for a worker."""
+        with self._lock:
+            return sum(not task.future.cancelled() for task in self._queues.get(session, ()))
+
+    def shutdown(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+# Thread backend -----------------------------------------------------------------
+
+def _thread_expand(compiled, lines, mode, line_cache):
+    hits = Counter()
+    if line_cache is not None and mode == "both":
+        plain, highlighted = expand_lines_cached(lines, compiled, line_cache, hits)
+    else:
+        plain, highlighted = expand_lines(lines, compiled, hits, mode)
+    return plain, highlighted, hits
+
+
+def _thread_riders(expanded_plain_text, expanded_highlighted_text, template, blocks, clause_cache):
+    return build_riders_docx(expanded_plain_text, expanded_highlighted_text, template, blocks=blocks,
+                             clause_cache=clause_cache)
+
+
+class ThreadPool(WorkerPool):
+    """
+    WorkerPool that runs its tasks on threads of the server process. Tasks
+    use the caller's CompiledDictionary directly, which is safe because its
+    tables are only ever replaced, never changed, so nothing is copied or
+    sent anywhere. Threads only run in parallel where the GIL is disabled;
+    under a standard build they take turns.
+    """
+
+    def __init__(self, workers, template=RIDERS_TEMPLATE, line_cache=None):
+        super().__init__(workers, None, template)
+        with open(template, "rb") as f:
+            self._template = f.read()
+        self.line_cache = line_cache
+
+    def _ensure_executor(self):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix="nemo-worker")
+        return self._executor
+
+    def expand_lines(self, session, compiled, lines, mode="both"):
+        """Future of (plain lines, highlighted lines, hits) for *lines*."""
+        return self.submit(session, _thread_expand, compiled, lines, mode, self.line_cache)
+
+    def build_riders_docx(self, session, expanded_plain_text, expanded_highlighted_text, blocks=None,
+                          clause_cache=None):
+        """Future of (docx bytes, preview lines); *clause_cache* is used directly, threads share it."""
+        return self.submit(session, _thread_riders, expanded_plain_text, expanded_highlighted_text,
+                           io.BytesIO(self._template), blocks, clause_cache)
+
+
+def gil_enabled():
+    # sys._is_gil_enabled() only exists from Python 3.13
+    is_gil_enabled = getattr(sys, "_is_gil_enabled", None)
+    return is_gil_enabled() if is_gil_enabled is not None else True
+
+
+def default_backend():
+    """"threads" or "processes", from NEMO_POOL or the interpreter."""
+    backend = os.environ.get("NEMO_POOL")
+    if backend in ("threads", "processes"):
+        return backend
+    return "processes" if gil_enabled() else "threads"
+
+
+def default_worker_count():
+    workers = os.environ.get("NEMO_WORKERS")
+    if workers is not None:
+        return max(int(workers), 0)
+    cpus = os.cpu_count() or 1
+    return cpus if cpus > 1 else 0
+
+
+def open_default_pool(default_workbook=None, line_cache=None):
+    """
+    A WorkerPool (or ThreadPool, see default_backend()) sized by
+    NEMO_WORKERS, or None when work stays in-process. *line_cache* is
+    only used by a ThreadPool; worker processes open their own.
+    """
+    workers = default_worker_count()
+    if not workers:
+        return None
+    if default_backend() == "threads":
+        return ThreadPool(workers, line_cache=line_cache)
+    return WorkerPool(workers, default_workbook)